@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: compiled PathPolicy vs. the per-call pattern loops it replaced.
+
+Run with: python benchmarks/bench_path_policy.py [--paths 1000000]
+
+The legacy functions are slow enough that timing them on a million paths takes
+minutes, so by default they run on a sample and their per-path cost is
+extrapolated. Pass --legacy-sample 0 to time them on the full list.
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path, PurePosixPath
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from codebase_skeleton import Config, PathPolicy
+
+
+def legacy_should_exclude(rel_path: PurePosixPath, config: Config) -> bool:
+    """SkeletonGenerator.should_exclude before PathPolicy."""
+    rel_path_str = str(rel_path)
+    for pattern in config.exclude:
+        pattern_clean = pattern.rstrip("/")
+        if pattern_clean in rel_path_str:
+            return True
+        if rel_path.match(pattern):
+            return True
+    for pattern in config.DEFAULT_EXCLUDE_PATTERNS:
+        if rel_path.match(pattern) or any(p.match(pattern) for p in rel_path.parents):
+            return True
+        if "*" not in pattern and pattern in rel_path.parts:
+            return True
+    for part in rel_path.parts:
+        if part in config.EXCLUDE_DIRS:
+            return True
+    return False
+
+
+def legacy_should_full_content(rel_path: PurePosixPath, config: Config) -> bool:
+    """SkeletonGenerator.should_full_content before PathPolicy."""
+    if str(rel_path) in config.include_full:
+        return True
+    for pattern in config.include_patterns:
+        if rel_path.match(pattern):
+            return True
+    return rel_path.name in config.DEFAULT_FULL_PATTERNS
+
+
+def legacy_should_ignore(rel_path: PurePosixPath, config: Config) -> bool:
+    """TreeBuilder._fallback_tree.should_ignore before PathPolicy."""
+    if rel_path.name in {".gitignore", ".dockerignore"}:
+        return False
+    for pattern in list(config.exclude) + list(config.DEFAULT_EXCLUDE_PATTERNS):
+        if pattern.startswith("."):
+            if rel_path.name == pattern:
+                return True
+        elif "*" in pattern:
+            if rel_path.match(pattern):
+                return True
+        elif rel_path.name == pattern or pattern in rel_path.parts:
+            return True
+    return False
+
+
+def synthetic_paths(count: int, seed: int = 0):
+    """Monorepo-shaped relative paths: deep source trees plus vendored noise."""
+    rng = random.Random(seed)
+    tops = ["src", "lib", "packages", "apps", "node_modules", "tests", "docs", ".git"]
+    mids = ["core", "api", "ui", "utils", "models", "components", "build", "v2"]
+    names = ["index", "main", "utils", "models", "views", "helpers", "types"]
+    exts = [".py", ".js", ".ts", ".tsx", ".json", ".md", ".pyc", ".css"]
+    paths = []
+    for _ in range(count):
+        depth = rng.randint(0, 5)
+        parts = [rng.choice(tops)] + [rng.choice(mids) for _ in range(depth)]
+        parts.append(rng.choice(names) + rng.choice(exts))
+        paths.append("/".join(parts))
+    return paths
+
+
+def time_it(label: str, func, paths, total: int) -> float:
+    start = time.perf_counter()
+    for rel in paths:
+        func(rel)
+    elapsed = time.perf_counter() - start
+    per_path = elapsed / max(len(paths), 1)
+    extrapolated = per_path * total
+    note = "" if len(paths) == total else f" (extrapolated from {len(paths):,})"
+    print(f"  {label:<28} {extrapolated:8.2f}s  {per_path * 1e6:7.2f} us/path{note}")
+    return extrapolated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--paths", type=int, default=1_000_000)
+    parser.add_argument(
+        "--legacy-sample",
+        type=int,
+        default=50_000,
+        help="Paths to time the legacy functions on (0 = all)",
+    )
+    args = parser.parse_args()
+
+    config = Config(
+        exclude={"vendor/", "*.min.js"},
+        include_patterns={"*.toml", "config/*.yml"},
+        include_full={"src/core/settings.py"},
+    )
+    paths = synthetic_paths(args.paths)
+    sample = paths[: args.legacy_sample] if args.legacy_sample else paths
+    pure_sample = [PurePosixPath(p) for p in sample]
+
+    print(f"{args.paths:,} synthetic paths")
+    print("legacy:")
+    legacy = time_it(
+        "exclude + full + ignore",
+        lambda p: (
+            legacy_should_exclude(p, config)
+            or legacy_should_full_content(p, config),
+            legacy_should_ignore(p, config),
+        ),
+        pure_sample,
+        args.paths,
+    )
+
+    print("PathPolicy (cold directory cache):")
+    policy = PathPolicy(config)
+    compiled = time_it(
+        "exclude + full + ignore",
+        lambda p: (
+            policy.is_excluded(p) or policy.is_full_content(p),
+            policy.is_ignored(p),
+        ),
+        paths,
+        args.paths,
+    )
+
+    print(f"speedup: {legacy / compiled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
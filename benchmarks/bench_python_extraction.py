@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark: scope-aware Python extraction vs. the overlapping query it replaced.
+
+Run with: python benchmarks/bench_python_extraction.py [FILE ...]
+
+The legacy extractor captured every function_definition and class_definition
+at any depth, so methods were emitted inside their class and again on their
+own, and nested helpers and closures were listed too. It is reproduced here
+with today's per-definition helpers so only the traversal differs.
+
+Without arguments the largest modules of the running Python's standard library
+are used; pass big real-world files (e.g. django/db/models/query.py) instead.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import tree_sitter_python as tspython
+from tree_sitter import Language, Query, QueryCursor
+
+from codebase_skeleton import CodeExtractor, Outline, SourceBuffer, TokenCounter
+
+LEGACY_QUERY = """
+(import_statement) @import
+(import_from_statement) @import
+(function_definition) @function
+(class_definition) @class
+"""
+
+
+def legacy_extract(extractor: CodeExtractor, query, root, src: SourceBuffer) -> str:
+    """The query-based Python path before the scope-aware walk."""
+    captures = QueryCursor(query).captures(root)
+    nodes = sorted(
+        ((kind, node) for kind, found in captures.items() for node in found),
+        key=lambda item: item[1].start_byte,
+    )
+    result = []
+    last_import_idx = -1
+    for idx, (kind, node) in enumerate(nodes):
+        if kind == "import":
+            result.extend(extractor._lines(node, src))
+            last_import_idx = idx
+            continue
+        if last_import_idx == idx - 1:
+            result.append("")
+        if kind == "function":
+            lines = extractor._extract_function_python(node, src)
+        else:
+            lines = extractor._extract_class_python(node, src)
+        result.append(Outline.render(lines))
+    return "\n".join(result)
+
+
+def largest_stdlib_modules(count: int):
+    stdlib = Path(argparse.__file__).parent
+    files = [p for p in stdlib.glob("*.py")]
+    return sorted(files, key=lambda p: p.stat().st_size, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("files", nargs="*", type=Path)
+    parser.add_argument(
+        "--stdlib", type=int, default=8, help="Stdlib modules to use without FILEs"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    extractor = CodeExtractor()
+    if "python" not in extractor.parsers:
+        sys.exit("tree-sitter-python is required for this benchmark")
+    parser_py = extractor.parsers["python"]
+    query = Query(Language(tspython.language()), LEGACY_QUERY)
+    counter = TokenCounter()
+
+    files = args.files or largest_stdlib_modules(args.stdlib)
+    totals = {"legacy": [0, 0, 0.0], "scoped": [0, 0, 0.0]}  # nodes, tokens, time
+    print(f"{'file':<28} {'nodes':>15} {'tokens':>17}")
+    for path in files:
+        src = SourceBuffer(path.read_bytes())
+        root = parser_py.parse(src.data).root_node
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            legacy = legacy_extract(extractor, query, root, src)
+        legacy_time = (time.perf_counter() - start) / args.repeat
+        # A query cursor has to visit every node of the tree
+        legacy_nodes = root.descendant_count
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            before = extractor.nodes_visited
+            scoped = Outline.render(extractor._extract_python(root, src))
+        scoped_time = (time.perf_counter() - start) / args.repeat
+        scoped_nodes = extractor.nodes_visited - before
+
+        legacy_tokens = counter.count(legacy)
+        scoped_tokens = counter.count(scoped)
+        for key, values in (
+            ("legacy", (legacy_nodes, legacy_tokens, legacy_time)),
+            ("scoped", (scoped_nodes, scoped_tokens, scoped_time)),
+        ):
+            totals[key] = [a + b for a, b in zip(totals[key], values)]
+        print(
+            f"{path.name:<28} {legacy_nodes:>7,} → {scoped_nodes:<6,}"
+            f" {legacy_tokens:>8,} → {scoped_tokens:<7,}"
+        )
+
+    (l_nodes, l_tokens, l_time), (s_nodes, s_tokens, s_time) = totals.values()
+    fewer = l_nodes / s_nodes
+    print(f"nodes visited:  {l_nodes:,} → {s_nodes:,} ({fewer:.0f}x fewer)")
+    print(f"output tokens:  {l_tokens:,} → {s_tokens:,} ({s_tokens / l_tokens:.0%})")
+    print(f"extract time:   {l_time * 1e3:.1f} ms → {s_time * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cold start, from interpreter launch to the first byte of output.
+
+Run with: python benchmarks/bench_startup.py [--repeat 15] [--baseline REV]
+
+Every sample is a fresh interpreter, as in a pre-commit hook. Scenarios: a
+bare interpreter (the floor), importing the module only, and the CLI on a
+small synthetic repository in skeleton and overview mode, launched as a
+script (compiled from source on every run) and with ``python -m`` (cached
+bytecode). ``--baseline`` runs the same scenarios against codebase_skeleton.py
+from a git revision, so cold-start regressions show up side by side.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+
+
+def make_repo(root: Path, files: int):
+    """A small mixed Python/JS repository, typical of a hook invocation."""
+    (root / "src").mkdir()
+    (root / "web").mkdir()
+    (root / "README.md").write_text("# Demo\n")
+    for i in range(files):
+        (root / "src" / f"mod_{i}.py").write_text(
+            f"import os\n\n\nclass Model{i}:\n"
+            f'    """Model {i}."""\n\n'
+            "    def save(self, force: bool = False) -> None:\n"
+            "        os.sync()\n\n\n"
+            f"def helper_{i}(value):\n    return value * {i}\n"
+        )
+    for i in range(max(1, files // 4)):
+        (root / "web" / f"view_{i}.js").write_text(
+            f"export function render{i}(props) {{\n"
+            "  return props.items.map(item => item.name);\n}\n"
+        )
+
+
+def run_once(cmd, env, cwd):
+    """Seconds to the first byte of stdout, and to exit."""
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env, cwd=cwd
+    )
+    proc.stdout.read(1)
+    first = time.perf_counter() - start
+    proc.stdout.read()
+    proc.wait()
+    return first, time.perf_counter() - start
+
+
+def scenarios(source_dir: Path, repo: Path):
+    script = str(source_dir / "codebase_skeleton.py")
+    python = sys.executable
+    probe = "import codebase_skeleton; print('ok')"
+    module = [python, "-m", "codebase_skeleton", str(repo)]
+    return [
+        ("bare interpreter", [python, "-c", "print('ok')"]),
+        ("import only", [python, "-c", probe]),
+        ("script, skeleton", [python, script, str(repo)]),
+        ("-m, skeleton", module),
+        ("-m, overview", module + ["--mode=overview"]),
+    ]
+
+
+def measure(label: str, source_dir: Path, repo: Path, repeat: int, env):
+    env = dict(env, PYTHONPATH=str(source_dir))
+    # Warm the OS file cache and the module's bytecode cache
+    subprocess.run(
+        [sys.executable, "-c", "import codebase_skeleton"],
+        env=env,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    )
+    print(f"{label}:")
+    results = {}
+    for name, cmd in scenarios(source_dir, repo):
+        run_once(cmd, env, source_dir)
+        samples = [run_once(cmd, env, source_dir) for _ in range(repeat)]
+        first = statistics.median(s[0] for s in samples)
+        total = statistics.median(s[1] for s in samples)
+        results[name] = first
+        print(
+            f"  {name:<20} first byte {first * 1e3:7.1f} ms"
+            f"   exit {total * 1e3:7.1f} ms"
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=15)
+    parser.add_argument(
+        "--files", type=int, default=40, help="Python files in the repo"
+    )
+    parser.add_argument(
+        "--baseline", metavar="REV", help="Also time this git revision"
+    )
+    args = parser.parse_args()
+
+    work = Path(tempfile.mkdtemp(prefix="bench-startup-"))
+    try:
+        repo = work / "repo"
+        repo.mkdir()
+        make_repo(repo, args.files)
+        # Keep the skeleton cache out of the user's home, warm after one run
+        env = dict(os.environ, XDG_CACHE_HOME=str(work / "cache"))
+
+        current = measure("working tree", project_root, repo, args.repeat, env)
+        if args.baseline:
+            baseline_dir = work / "baseline"
+            baseline_dir.mkdir()
+            source = subprocess.run(
+                ["git", "show", f"{args.baseline}:codebase_skeleton.py"],
+                cwd=project_root,
+                check=True,
+                capture_output=True,
+            ).stdout
+            (baseline_dir / "codebase_skeleton.py").write_bytes(source)
+            baseline = measure(args.baseline, baseline_dir, repo, args.repeat, env)
+            print("first-byte speedup:")
+            for name, seconds in current.items():
+                print(f"  {name:<20} {baseline[name] / seconds:5.2f}x")
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark: batched token counting vs. the per-file loop it replaced.
+
+Run with: python benchmarks/bench_token_counting.py [DIR] [--tokenizer-file PATH]
+
+The corpus is every Python file under DIR (default: the top-level modules of
+the running Python's standard library), counted three ways: one
+TokenCounter.count call per file as generate() used to do, count_many on a
+single thread, and count_many across threads. Counts must agree exactly.
+
+tiktoken is required. cl100k_base comes from --tokenizer-file or
+tiktoken's cache; offline and uncached, a synthetic BPE vocabulary of the
+same size is built from the corpus so the relative timings still hold.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from codebase_skeleton import TokenCounter
+
+try:
+    import regex
+    import tiktoken
+except ImportError:
+    sys.exit("tiktoken is required for this benchmark")
+
+
+def synthetic_encoding(texts, vocab_size: int = 100_000):
+    """A cl100k-shaped encoding whose merges come from the corpus itself."""
+    pieces = Counter()
+    pattern = regex.compile(TokenCounter.CL100K_PATTERN)
+    for text in texts:
+        pieces.update(pattern.findall(text))
+    ranks = {bytes([b]): b for b in range(256)}
+    # Every prefix gets a rank before the piece, so BPE can merge up to it
+    for piece, _ in pieces.most_common():
+        data = piece.encode("utf-8")
+        for end in range(2, len(data) + 1):
+            ranks.setdefault(data[:end], len(ranks))
+        if len(ranks) >= vocab_size:
+            break
+    return tiktoken.Encoding(
+        name="synthetic",
+        pat_str=TokenCounter.CL100K_PATTERN,
+        mergeable_ranks=ranks,
+        special_tokens={},
+    )
+
+
+def timed(function, repeat: int):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directory", nargs="?", type=Path)
+    parser.add_argument("--tokenizer-file", type=str)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.directory:
+        paths = sorted(args.directory.rglob("*.py"))
+    else:
+        paths = sorted(Path(argparse.__file__).parent.glob("*.py"))
+    texts = [path.read_text("utf-8", errors="replace") for path in paths]
+    megabytes = sum(map(len, texts)) / 1e6
+
+    counter = TokenCounter(tokenizer_file=args.tokenizer_file, timeout=30)
+    if counter.encoder is None:
+        counter._encoder = synthetic_encoding(texts)
+        counter.name = "synthetic"
+    threads = args.threads or min(8, os.cpu_count() or 1)
+    print(
+        f"{len(texts):,} files, {megabytes:.1f} MB, encoding {counter.name}, "
+        f"{threads} threads"
+    )
+
+    loop_time, expected = timed(lambda: [counter.count(t) for t in texts], args.repeat)
+    rows = [("per-file loop", loop_time)]
+    for label, n in (("count_many, 1 thread", 1), ("count_many, threaded", threads)):
+        seconds, counts = timed(lambda: counter.count_many(texts, n), args.repeat)
+        assert counts == expected, f"{label} disagrees with the per-file loop"
+        rows.append((label, seconds))
+
+    print(f"{sum(expected):,} tokens")
+    for label, seconds in rows:
+        print(
+            f"  {label:<22} {seconds * 1e3:8.1f} ms  {megabytes / seconds:6.1f} MB/s"
+            f"  {loop_time / seconds:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,45 +5,94 @@ Generates LLM-optimized structural representations of codebases.
 """
 
 import argparse
+import hashlib
+import heapq
+import io
+import importlib
+import importlib.util
+import json
+import math
+import mmap
+import os
+import stat
+import struct
 import sys
+import tempfile
+import threading
+import time
+from collections.abc import Mapping
+from functools import partial
 from pathlib import Path
 from dataclasses import dataclass, field
-from typing import List, Set, Dict, Optional
-from collections import defaultdict
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Set,
+    Dict,
+    Optional,
+    Tuple,
+    Union,
+)
+from array import array
+from collections import defaultdict, deque
+from contextlib import contextmanager
 import re
 
-try:
-    import tree_sitter_python as tspython
-    import tree_sitter_javascript as tsjavascript
-    import tree_sitter_typescript as tstypescript
-    from tree_sitter import Language, Parser, Query, QueryCursor
-
-    TREE_SITTER_AVAILABLE = True
-except ImportError:
-    TREE_SITTER_AVAILABLE = False
-    print("Warning: tree-sitter not available, using fallback mode", file=sys.stderr)
-
-try:
-    import tiktoken
-
-    TIKTOKEN_AVAILABLE = True
-except ImportError:
-    TIKTOKEN_AVAILABLE = False
-    print(
-        "Warning: tiktoken not available, using approximate token counts",
-        file=sys.stderr,
-    )
 
-try:
-    from directory_tree import DisplayTree
+def _has_module(name: str) -> bool:
+    """Check that a module is installed without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+# Optional dependencies are only located here; each is imported on first use
+# (see __getattr__), so runs that never parse or count tokens do not pay
+# for importing them.
+TREE_SITTER_AVAILABLE = _has_module("tree_sitter")
+TIKTOKEN_AVAILABLE = _has_module("tiktoken")
+
+# Lazily imported names -> (module, attribute or None for the module itself)
+_LAZY_IMPORTS = {
+    "Language": ("tree_sitter", "Language"),
+    "Parser": ("tree_sitter", "Parser"),
+    "tiktoken": ("tiktoken", None),
+}
+
+
+def __getattr__(name: str):
+    """Import optional dependencies on first access (PEP 562)."""
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, attribute = _LAZY_IMPORTS[name]
+    try:
+        value = importlib.import_module(module_name)
+    except ImportError as e:
+        raise AttributeError(f"{name} is unavailable: {e}") from e
+    if attribute is not None:
+        value = getattr(value, attribute)
+    globals()[name] = value
+    return value
 
-    DIRECTORY_TREE_AVAILABLE = True
-except ImportError:
-    DIRECTORY_TREE_AVAILABLE = False
-    print(
-        "Warning: directory_tree not available, using basic tree display",
-        file=sys.stderr,
-    )
+
+def _optional(name: str):
+    """An optional dependency by name, honouring anything patched in."""
+    value = globals().get(name)
+    return value if value is not None else __getattr__(name)
+
+
+_warned: Set[str] = set()
+
+
+def _warn_once(message: str):
+    if message not in _warned:
+        _warned.add(message)
+        print(message, file=sys.stderr)
 
 
 @dataclass
@@ -59,6 +108,34 @@ class Config:
     show_deps: bool = False
     show_excluded: bool = False  # NEW LINE: Show detailed excluded directories list
     output: Optional[str] = None
+    git_index: bool = False  # Enumerate tracked files from .git/index
+    include_untracked: bool = False  # With git_index: also scan untracked files
+    files_from: Optional[str] = None  # Path list file ("-" = stdin); skips the walk
+    max_file_bytes: int = 1024 * 1024  # Larger files are read head-only (0 = no limit)
+    jobs: int = 1  # Worker count for extraction (0 = one per CPU)
+    backend: str = "process"  # process, thread
+    cache_dir: Optional[str] = None  # Skeleton cache directory (None = no cache)
+    cache_max_bytes: int = 256 * 1024 * 1024
+    nested_defs: bool = False  # Also list definitions inside function bodies
+    tokenizer_file: Optional[str] = None  # Local cl100k_base.tiktoken BPE file
+    tokenizer_cache: Optional[str] = None  # tiktoken download cache directory
+    tokenizer_timeout: float = 3.0  # Seconds to wait for the encoding to load
+    token_count: str = "exact"  # exact, estimate (calibrated chars/token)
+    format: str = "text"  # text, jsonl, msgpack (records, always streamed)
+    tree_depth: int = 5  # Directory levels the <tree> lists (0 = no limit)
+    tree_width: int = 50  # Entries listed per directory before a summary line
+    tree_lines: int = 400  # Lines the whole <tree> may take (0 = no limit)
+    shard_tokens: int = 0  # Split output into files of at most this many tokens
+    shard_count: int = 0  # Or into this many files of about equal size
+
+    # Result kinds each output mode shows. Files of any other kind are
+    # listed in the tree but never read or parsed: overview is stat-only.
+    MODE_SHOWS = {
+        "skeleton": {"full", "skeleton"},
+        "overview": set(),
+        "hybrid": {"full", "skeleton"},  # Full content for config files only
+        "custom": {"full", "skeleton"},
+    }
 
     # Smart defaults
     DEFAULT_FULL_PATTERNS = {
@@ -135,451 +212,2380 @@ class Config:
         "third_party",
     }
 
+    # Content gate: known text is read without sniffing, known binary is
+    # never opened, anything else has its first bytes sniffed.
+    TEXT_EXTENSIONS = {
+        ".py",
+        ".pyi",
+        ".js",
+        ".jsx",
+        ".mjs",
+        ".cjs",
+        ".ts",
+        ".tsx",
+        ".java",
+        ".kt",
+        ".go",
+        ".rs",
+        ".rb",
+        ".php",
+        ".c",
+        ".h",
+        ".cc",
+        ".cpp",
+        ".hpp",
+        ".cs",
+        ".swift",
+        ".scala",
+        ".sh",
+        ".bash",
+        ".sql",
+        ".md",
+        ".rst",
+        ".txt",
+        ".json",
+        ".yaml",
+        ".yml",
+        ".toml",
+        ".ini",
+        ".cfg",
+        ".xml",
+        ".html",
+        ".css",
+        ".scss",
+        ".vue",
+        ".svelte",
+    }
+
+    BINARY_EXTENSIONS = {
+        ".png",
+        ".jpg",
+        ".jpeg",
+        ".gif",
+        ".bmp",
+        ".ico",
+        ".webp",
+        ".tiff",
+        ".psd",
+        ".woff",
+        ".woff2",
+        ".ttf",
+        ".otf",
+        ".eot",
+        ".mp3",
+        ".mp4",
+        ".wav",
+        ".ogg",
+        ".webm",
+        ".mov",
+        ".avi",
+        ".pdf",
+        ".zip",
+        ".gz",
+        ".tgz",
+        ".bz2",
+        ".xz",
+        ".7z",
+        ".rar",
+        ".tar",
+        ".whl",
+        ".jar",
+        ".war",
+        ".class",
+        ".exe",
+        ".bin",
+        ".o",
+        ".a",
+        ".lib",
+        ".wasm",
+        ".sqlite",
+        ".sqlite3",
+        ".db",
+        ".npy",
+        ".npz",
+        ".pkl",
+        ".pickle",
+        ".parquet",
+        ".feather",
+        ".h5",
+        ".onnx",
+        ".pt",
+    }
+
+    # Data formats carry no structure worth extracting; only their head is read
+    # unless they are selected for full content.
+    DATA_EXTENSIONS = {
+        ".csv",
+        ".tsv",
+        ".json",
+        ".jsonl",
+        ".ndjson",
+        ".geojson",
+        ".xml",
+        ".svg",
+        ".log",
+        ".lock",
+        ".map",
+    }
+    DATA_HEAD_BYTES = 16 * 1024
+
+    def read_limit(self, suffix: str, full: bool) -> int:
+        """Byte budget for reading a file (0 = unlimited)."""
+        limit = self.max_file_bytes
+        if not full and suffix.lower() in self.DATA_EXTENSIONS:
+            limit = min(limit, self.DATA_HEAD_BYTES) if limit else self.DATA_HEAD_BYTES
+        return limit
+
+
+def _glob_to_regex(pattern: str, globstar: bool = False) -> str:
+    """Translate a glob into a regex fragment where wildcards never cross '/'.
+
+    With ``globstar``, '**' matches across directories as in .gitignore.
+    """
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == "*" and globstar and pattern[i : i + 1] == "*":
+            i += 1
+            if pattern[i : i + 1] == "/":
+                i += 1
+                out.append("(?:.*/)?")
+            else:
+                out.append(".*")
+        elif c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 1 if pattern[i : i + 1] in ("!", "]") else i)
+            if j == -1:
+                out.append(re.escape(c))
+                continue
+            body = pattern[i:j].replace("\\", "\\\\")
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            out.append(f"[{body}]")
+            i = j + 1
+        else:
+            out.append(re.escape(c))
+    return "".join(out)
+
+
+class _NameMatcher:
+    """Matches a single path component against a set of glob patterns.
+
+    Literal names go into an exact-name set, ``*<literal>`` globs into a
+    suffix table keyed by the text after the last dot, and everything else
+    into one combined regex.
+    """
+
+    def __init__(self, patterns):
+        self.names: Set[str] = set()
+        self.suffixes: Dict[str, List[str]] = defaultdict(list)
+        globs = []
+        for pattern in patterns:
+            if not any(c in pattern for c in "*?["):
+                self.names.add(pattern)
+            elif (
+                pattern.startswith("*")
+                and "." in pattern
+                and not any(c in pattern[1:] for c in "*?[")
+            ):
+                suffix = pattern[1:]
+                self.suffixes[suffix[suffix.rfind(".") :]].append(suffix)
+            else:
+                globs.append(_glob_to_regex(pattern))
+        self.regex = re.compile("|".join(globs)) if globs else None
+
+    def matches(self, name: str) -> bool:
+        if name in self.names:
+            return True
+        dot = name.rfind(".")
+        if dot != -1:
+            candidates = self.suffixes.get(name[dot:])
+            if candidates and any(name.endswith(s) for s in candidates):
+                return True
+        return bool(self.regex and self.regex.fullmatch(name))
+
+
+def _compile_sequences(patterns, anchored: bool = False):
+    """Compile multi-component patterns ('db/migrate', 'src/*.js') to one regex.
+
+    Unanchored patterns match a run of components ending at the end of the
+    path; a leading '/' or ``anchored=True`` pins them to the root instead.
+    """
+    parts = []
+    for pattern in patterns:
+        if pattern.startswith("/") or anchored:
+            parts.append("^" + _glob_to_regex(pattern.lstrip("/")))
+        else:
+            parts.append("(?:^|/)" + _glob_to_regex(pattern))
+    if not parts:
+        return None
+    return re.compile("(?:" + "|".join(parts) + ")$")
+
+
+class PathPolicy:
+    """Compiled path rules shared by exclusion, full-content and tree filtering.
+
+    ``Config.exclude``, ``DEFAULT_EXCLUDE_PATTERNS``, ``EXCLUDE_DIRS``,
+    ``include_full``, ``include_patterns`` and ``skeleton_only`` are compiled
+    once. Directory decisions are cached, so a file only pays for a check of
+    its own name. All paths are relative to the root with forward slashes.
+
+    Single-component patterns match any component of a path, so excluding a
+    directory excludes everything below it. Patterns containing '/' match a
+    run of components.
+    """
+
+    VISIBLE = 0  # Shown in the tree and processed
+    EXCLUDED = 1  # Shown in the tree, but not processed (EXCLUDE_DIRS)
+    IGNORED = 2  # Hidden from the tree and not processed
+
+    def __init__(self, config: Config):
+        self.config = config
+
+        ignore = set(config.DEFAULT_EXCLUDE_PATTERNS)
+        ignore.update(p.rstrip("/") for p in config.exclude if p.rstrip("/"))
+        self._ignore_names = _NameMatcher(p for p in ignore if "/" not in p)
+        self._ignore_seq = _compile_sequences(p for p in ignore if "/" in p)
+
+        self._exclude_dirs = _NameMatcher(
+            d for d in config.EXCLUDE_DIRS if "/" not in d
+        )
+        self._exclude_dir_seq = _compile_sequences(
+            d for d in config.EXCLUDE_DIRS if "/" in d
+        )
+
+        self._include_full = {
+            p[2:] if p.startswith("./") else p for p in config.include_full
+        }
+        self._include_patterns = _compile_sequences(config.include_patterns)
+        self._skeleton_only = _compile_sequences(
+            (p.strip("/") for p in config.skeleton_only if p.strip("/")),
+            anchored=True,
+        )
+        self._full_names = config.DEFAULT_FULL_PATTERNS
+
+        # Relative directory -> (state, inside a skeleton_only directory)
+        self._dir_cache: Dict[str, Tuple[int, bool]] = {"": (self.VISIBLE, False)}
+
+    def _classify(self, rel: str, name: str, state: int) -> int:
+        """Apply the name and sequence rules to one component on top of state."""
+        if state == self.IGNORED:
+            return state
+        if self._ignore_names.matches(name) or (
+            self._ignore_seq and self._ignore_seq.search(rel)
+        ):
+            return self.IGNORED
+        if state == self.VISIBLE and (
+            self._exclude_dirs.matches(name)
+            or (self._exclude_dir_seq and self._exclude_dir_seq.search(rel))
+        ):
+            return self.EXCLUDED
+        return state
+
+    def _dir_state(self, rel_dir: str) -> Tuple[int, bool]:
+        cached = self._dir_cache.get(rel_dir)
+        if cached is not None:
+            return cached
+        parent, _, name = rel_dir.rpartition("/")
+        parent_state, parent_skeleton = self._dir_state(parent)
+        result = (
+            self._classify(rel_dir, name, parent_state),
+            parent_skeleton
+            or bool(self._skeleton_only and self._skeleton_only.match(rel_dir)),
+        )
+        self._dir_cache[rel_dir] = result
+        return result
+
+    def state(self, rel: str, is_dir: bool = False) -> int:
+        """Return VISIBLE, EXCLUDED or IGNORED for a relative path."""
+        if is_dir:
+            return self._dir_state(rel)[0]
+        parent, _, name = rel.rpartition("/")
+        return self._classify(rel, name, self._dir_state(parent)[0])
+
+    def is_excluded(self, rel: str, is_dir: bool = False) -> bool:
+        """Check if a path is left out of processing."""
+        return self.state(rel, is_dir) != self.VISIBLE
+
+    def is_ignored(self, rel: str, is_dir: bool = False) -> bool:
+        """Check if a path is hidden from the tree as well."""
+        return self.state(rel, is_dir) == self.IGNORED
+
+    def is_full_content(self, rel: str) -> bool:
+        """Check if a (non-excluded) file should have full content."""
+        parent, _, name = rel.rpartition("/")
+
+        # In hybrid mode, NOTHING gets full content except config files
+        if self.config.mode == "hybrid":
+            return name in self._full_names
+
+        # Explicit includes win over everything else
+        if rel in self._include_full:
+            return True
+
+        # skeleton_only directories never get full content
+        if self._skeleton_only and (
+            self._dir_state(parent)[1] or self._skeleton_only.match(rel)
+        ):
+            return False
+
+        if self._include_patterns and self._include_patterns.search(rel):
+            return True
+
+        return name in self._full_names
+
+
+class ContentSniffer:
+    """Cheap text/binary gate, decided before a file is read in full."""
+
+    SNIFF_BYTES = 8192
+    # Bytes that plain text does not contain (C0 controls minus \t\n\f\r\x1b)
+    _CONTROL_BYTES = bytes(set(range(32)) - {8, 9, 10, 12, 13, 27}) + b"\x7f"
+
+    def __init__(self, config: Config):
+        self._text = config.TEXT_EXTENSIONS
+        self._binary = config.BINARY_EXTENSIONS
+        self._full_names = config.DEFAULT_FULL_PATTERNS
+
+    def is_binary(self, path: Path) -> bool:
+        """Classify by extension, sniffing the head only when it is unknown."""
+        suffix = path.suffix.lower()
+        if suffix in self._binary:
+            return True
+        if suffix in self._text or path.name in self._full_names:
+            return False
+        try:
+            with open(path, "rb") as f:
+                head = f.read(self.SNIFF_BYTES)
+        except OSError:
+            return False  # Let the real read report the error
+        return self.looks_binary(head)
+
+    @classmethod
+    def looks_binary(cls, head: bytes) -> bool:
+        """NUL bytes, dense control characters, or non-UTF-8 high-bit noise."""
+        if b"\0" in head:
+            return True
+        controls = len(head) - len(head.translate(None, cls._CONTROL_BYTES))
+        if controls * 10 > len(head):
+            return True
+        try:
+            head.decode("utf-8")
+            return False
+        except UnicodeDecodeError as e:
+            # A multi-byte character cut off by the head read is still text
+            if e.start >= len(head) - 3 and e.reason == "unexpected end of data":
+                return False
+        # Legacy 8-bit text has a few high bytes; compressed data is ~50%
+        high = sum(1 for b in head if b >= 0x80)
+        return high * 10 > len(head) * 3
+
+
+@dataclass
+class TokenEstimate:
+    """An estimated token count with a ~95% margin of error."""
+
+    tokens: int
+    margin: int = 0
+
+    @property
+    def low(self) -> int:
+        return max(0, self.tokens - self.margin)
+
+    @property
+    def high(self) -> int:
+        return self.tokens + self.margin
+
+    def __add__(self, other: "TokenEstimate") -> "TokenEstimate":
+        # Margins add linearly: per-kind ratio errors are not independent
+        return TokenEstimate(self.tokens + other.tokens, self.margin + other.margin)
+
+
+class TokenEstimator:
+    """Chars-per-token estimates by file kind, optionally fitted to a repo.
+
+    A file's kind is its extension (aliases such as .tsx -> .ts share a
+    ratio), with minified JavaScript split out since it packs far fewer
+    characters into a token. The built-in ratios approximate cl100k_base;
+    ``calibrate`` refits them from files counted exactly, which also
+    narrows each kind's spread. Margins are two spreads (~95%).
+    """
+
+    # kind -> (characters per token, relative spread of per-file ratios)
+    RATIOS = {
+        "": (4.0, 0.25),
+        ".py": (3.7, 0.15),
+        ".js": (3.4, 0.15),
+        ".min.js": (2.7, 0.15),
+        ".json": (3.0, 0.25),
+        ".md": (4.2, 0.15),
+        ".yaml": (3.3, 0.2),
+        ".html": (3.0, 0.2),
+        ".css": (3.2, 0.2),
+        ".c": (3.5, 0.2),
+        ".sh": (3.4, 0.2),
+        ".sql": (3.6, 0.2),
+        ".csv": (2.6, 0.3),
+    }
+    ALIASES = {
+        ".pyi": ".py",
+        ".jsx": ".js",
+        ".mjs": ".js",
+        ".cjs": ".js",
+        ".ts": ".js",
+        ".tsx": ".js",
+        ".rst": ".md",
+        ".txt": ".md",
+        ".yml": ".yaml",
+        ".toml": ".yaml",
+        ".ini": ".yaml",
+        ".cfg": ".yaml",
+        ".htm": ".html",
+        ".xml": ".html",
+        ".svg": ".html",
+        ".scss": ".css",
+        ".less": ".css",
+        ".h": ".c",
+        ".cc": ".c",
+        ".cpp": ".c",
+        ".hpp": ".c",
+        ".java": ".c",
+        ".cs": ".c",
+        ".go": ".c",
+        ".rs": ".c",
+        ".kt": ".c",
+        ".swift": ".c",
+        ".rb": ".c",
+        ".php": ".c",
+        ".bash": ".sh",
+        ".tsv": ".csv",
+    }
+    MINIFIED_LINE_LENGTH = 300  # Average line length that marks minified JS
+    MIN_SAMPLES = 3  # Files of a kind needed before calibration replaces a ratio
+    MIN_SPREAD = 0.05
+    # Per kind, files counted exactly to calibrate from in estimate mode
+    SAMPLE_FILES = 8
+    SAMPLE_CHARS = 512 * 1024
+
+    def __init__(self, ratios: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.ratios = dict(self.RATIOS if ratios is None else ratios)
+        self.calibrated: Dict[str, int] = {}  # kind -> files fitted
+
+    @classmethod
+    def kind(cls, suffix: str, text: str = "") -> str:
+        """The ratio table key for a file with this suffix and text."""
+        kind = suffix.lower()
+        kind = cls.ALIASES.get(kind, kind)
+        if kind == ".js" and len(text) > cls.MINIFIED_LINE_LENGTH * (
+            text.count("\n") + 1
+        ):
+            return ".min.js"
+        return kind
+
+    def estimate(self, text: str, suffix: str = "") -> TokenEstimate:
+        """Estimate tokens in text from its length and file kind."""
+        ratio, spread = self.ratios.get(self.kind(suffix, text), self.ratios[""])
+        tokens = int(len(text) / ratio)
+        return TokenEstimate(tokens, int(tokens * 2 * spread + 0.5))
+
+    @classmethod
+    def sample(cls, texts: List[str], suffixes: List[str]) -> List[int]:
+        """Indices of texts to count exactly, spread evenly within each kind."""
+        by_kind: Dict[str, List[int]] = defaultdict(list)
+        for index, (text, suffix) in enumerate(zip(texts, suffixes)):
+            by_kind[cls.kind(suffix, text)].append(index)
+        chosen = []
+        for indices in by_kind.values():
+            step = max(1, len(indices) // cls.SAMPLE_FILES)
+            chars = 0
+            for index in indices[::step][: cls.SAMPLE_FILES]:
+                if chars + len(texts[index]) <= cls.SAMPLE_CHARS:
+                    chars += len(texts[index])
+                    chosen.append(index)
+        return sorted(chosen)
+
+    def calibrate(self, samples: List[Tuple[str, str, int]]):
+        """Refit ratios from ``(suffix, text, exact tokens)`` samples.
+
+        A kind's ratio is its total characters over total tokens; its spread
+        is the character-weighted deviation of per-file ratios from that,
+        plus the ratio's own standard error. Kinds with fewer than
+        ``MIN_SAMPLES`` non-empty files keep their built-in ratio.
+        """
+        by_kind: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for suffix, text, tokens in samples:
+            if text and tokens:
+                by_kind[self.kind(suffix, text)].append((len(text), tokens))
+        for kind, files in by_kind.items():
+            if len(files) < self.MIN_SAMPLES:
+                continue
+            chars = sum(c for c, _ in files)
+            ratio = chars / sum(t for _, t in files)
+            variance = sum(c * (c / t / ratio - 1) ** 2 for c, t in files) / chars
+            spread = (variance * (1 + 1 / len(files))) ** 0.5
+            self.ratios[kind] = (ratio, max(spread, self.MIN_SPREAD))
+            self.calibrated[kind] = len(files)
+
 
 class TokenCounter:
-    """Token counting utility."""
+    """Token counting utility.
+
+    The tiktoken encoding is loaded on the first count, so runs that never
+    count tokens (``--mode=overview``, warm caches) never load it. Loading
+    never touches the network when ``tokenizer_file`` names a local BPE file
+    or ``cache_dir`` holds one (a miss downloads into it, so one successful
+    load keeps later runs offline); otherwise tiktoken resolves its own
+    cache, and the process environment is never changed. A load that takes
+    longer than ``timeout`` seconds is left running in the background
+    (filling the cache for next time) and this run falls back to
+    approximate counts from ``estimator``.
+    """
+
+    APPROXIMATE = "approx"
+    REASON_LIMIT = 100  # Load errors can be whole exception chains
+    ENCODING = "cl100k_base"
+    # cl100k_base construction parameters, for ranks read from a local file
+    CL100K_PATTERN = (
+        r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}|"""
+        r""" ?[^\s\p{L}\p{N}]++[\r\n]*|\s*[\r\n]|\s+(?!\S)|\s+"""
+    )
+    CL100K_URL = (
+        "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+    )
+    CL100K_SHA256 = "223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7"
+    CL100K_SPECIAL_TOKENS = {
+        "<|endoftext|>": 100257,
+        "<|fim_prefix|>": 100258,
+        "<|fim_middle|>": 100259,
+        "<|fim_suffix|>": 100260,
+        "<|endofprompt|>": 100276,
+    }
 
-    def __init__(self):
+    def __init__(
+        self,
+        tokenizer_file: Optional[str] = None,
+        cache_dir: Optional[str] = None,
+        timeout: float = 3.0,
+    ):
+        self._encoder = None
+        self.tokenizer_file = tokenizer_file
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.fallback_reason: Optional[str] = None
+        self.estimator = TokenEstimator()
         if TIKTOKEN_AVAILABLE:
-            self.encoder = tiktoken.get_encoding("cl100k_base")
+            self.name = self.ENCODING
+        else:
+            _warn_once("Warning: tiktoken not available, using approximate token counts")
+            self.name = self.APPROXIMATE
+            self.fallback_reason = "tiktoken not installed"
+
+    @property
+    def encoder(self):
+        """The tiktoken encoder, or None when counts are approximated."""
+        if self._encoder is None and self.name != self.APPROXIMATE:
+            self._encoder = self._load()
+        return self._encoder
+
+    def describe(self) -> str:
+        """One line for ``<stats>`` naming the counter actually in use."""
+        if self.name != self.APPROXIMATE:
+            return self.name
+        return f"approximate, chars/token by file type ({self.fallback_reason})"
+
+    def _load(self):
+        """Load the encoding in a daemon thread, waiting at most ``timeout``."""
+        outcome = {}
+
+        def load():
+            try:
+                outcome["encoder"] = self._load_encoding()
+            except Exception as e:
+                outcome["error"] = e
+
+        thread = threading.Thread(target=load, name="tokenizer-load", daemon=True)
+        thread.start()
+        thread.join(self.timeout)
+        if "encoder" in outcome:
+            return outcome["encoder"]
+        if "error" in outcome:
+            error = str(outcome["error"]) or type(outcome["error"]).__name__
+            if len(error) > self.REASON_LIMIT:
+                error = error[: self.REASON_LIMIT] + " …"
+            reason = f"{self.name} failed to load: {error}"
         else:
-            self.encoder = None
+            reason = f"{self.name} did not load within {self.timeout:g}s"
+        _warn_once(f"Warning: {reason}, using approximate token counts")
+        self.name = self.APPROXIMATE
+        self.fallback_reason = reason
+        return None
+
+    def _load_encoding(self):
+        tiktoken = _optional("tiktoken")
+        ranks_file = self.tokenizer_file or self._cached_ranks()
+        if ranks_file is None:
+            # tiktoken's own cache lookup ($TIKTOKEN_CACHE_DIR, then
+            # $DATA_GYM_CACHE_DIR, then a temp directory) is left alone
+            return tiktoken.get_encoding(self.name)
+        from tiktoken.load import load_tiktoken_bpe
+
+        return tiktoken.Encoding(
+            name=self.name,
+            pat_str=self.CL100K_PATTERN,
+            mergeable_ranks=load_tiktoken_bpe(str(ranks_file)),
+            special_tokens=self.CL100K_SPECIAL_TOKENS,
+        )
+
+    def _cached_ranks(self) -> Optional[Path]:
+        """The cl100k_base ranks file in ``cache_dir``, downloaded on a miss.
+
+        None without a ``cache_dir``. Files are named as in tiktoken's cache.
+        """
+        if not self.cache_dir:
+            return None
+        name = hashlib.sha1(self.CL100K_URL.encode()).hexdigest()
+        path = Path(self.cache_dir) / name
+        if self._verified(path):
+            return path
+        from tiktoken.load import read_file
+
+        data = read_file(self.CL100K_URL)
+        if hashlib.sha256(data).hexdigest() != self.CL100K_SHA256:
+            raise ValueError(f"hash mismatch for {self.CL100K_URL}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        return path
+
+    def _verified(self, path: Path) -> bool:
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return False
+        return hashlib.sha256(data).hexdigest() == self.CL100K_SHA256
 
-    def count(self, text: str) -> int:
-        """Count tokens in text."""
+    def count(self, text: str, suffix: str = "") -> int:
+        """Count tokens in text (estimated by file type without tiktoken)."""
         if self.encoder:
             return len(self.encoder.encode(text))
-        # Rough approximation: 4 chars per token
-        return len(text) // 4
+        # Rough approximation: 4 chars per token unless the file type is known
+        return self.estimator.estimate(text, suffix).tokens
+
+    # Batches smaller than this are counted on the calling thread
+    PARALLEL_MIN_CHARS = 256 * 1024
+
+    def count_many(
+        self,
+        texts: List[str],
+        threads: int = 0,
+        suffixes: Optional[List[str]] = None,
+    ) -> List[int]:
+        """Count tokens in many texts at once, in the order given.
+
+        Texts are encoded with ``encode_ordinary``, which skips the scan for
+        special-token strings that ``encode`` makes only to reject them (and
+        counts such strings as text instead of raising). Identical texts are
+        encoded once, and each token list is reduced to its length inside
+        the worker, so at most ``threads`` lists exist at a time. Large
+        batches are split into contiguous chunks over ``threads`` threads
+        (0 = one per CPU, at most 8); tiktoken releases the GIL while
+        encoding. ``suffixes`` give each text's file type for estimates.
+        """
+        encoder = self.encoder
+        if encoder is None:
+            suffixes = suffixes or [""] * len(texts)
+            return [
+                self.estimator.estimate(text, suffix).tokens
+                for text, suffix in zip(texts, suffixes)
+            ]
+        unique = list(dict.fromkeys(texts))
+
+        def measure(chunk: List[str]) -> List[int]:
+            return [len(encoder.encode_ordinary(text)) for text in chunk]
+
+        threads = threads or min(8, os.cpu_count() or 1)
+        if threads == 1 or sum(map(len, unique)) < self.PARALLEL_MIN_CHARS:
+            counts = measure(unique)
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+
+            size = max(1, -(-len(unique) // (threads * 4)))
+            chunks = [unique[i : i + size] for i in range(0, len(unique), size)]
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                counts = [n for part in pool.map(measure, chunks) for n in part]
+        by_text = dict(zip(unique, counts))
+        return [by_text[text] for text in texts]
+
+
+class DirectoryWalker:
+    """Pruning directory walker built on os.scandir.
+
+    ``classify`` receives a relative path (forward slashes) and whether it is
+    a directory, and returns a ``PathPolicy`` state. Ignored subtrees
+    (node_modules, .git, venv, ...) are never entered unless ``count_excluded``
+    asks for their files to be tallied. Excluded-but-visible subtrees (tests,
+    docs, ...) are only entered down to ``tree_depth`` so the tree can list
+    them.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        classify: Callable[[str, bool], int],
+        count_excluded: bool = False,
+        tree_depth: Optional[int] = None,
+        max_depth: Optional[int] = None,
+    ):
+        self.root = root
+        self.classify = classify
+        self.count_excluded = count_excluded
+        self.tree_depth = tree_depth
+        self.max_depth = max_depth
+        # Parent directory (relative, forward slashes) -> excluded entries.
+        # With count_excluded off, a pruned directory counts as one entry.
+        self.excluded: Dict[str, int] = defaultdict(int)
+
+    def _within(self, depth: int, limit: Optional[int]) -> bool:
+        return limit is None or depth < limit
+
+    def walk(self) -> Iterator[Tuple[str, "os.DirEntry", bool, int, int]]:
+        """Yield (rel, DirEntry, is_dir, state, depth) for non-ignored entries.
+
+        Entries come in path order: a directory's files, then each of its
+        subdirectories in name order. Depth 0 is the root's children.
+        """
+        visible, excluded_state, ignored = (
+            PathPolicy.VISIBLE,
+            PathPolicy.EXCLUDED,
+            PathPolicy.IGNORED,
+        )
+        root_real = os.path.realpath(self.root)
+        # Each frame: (directory path, relative prefix, real path, real paths
+        #              of symlink targets on this branch, depth, subtree state)
+        stack = [(str(self.root), "", root_real, frozenset(), 0, visible)]
+
+        while stack:
+            dir_path, rel_prefix, dir_real, links, depth, inherited = stack.pop()
+            parent_key = rel_prefix.rstrip("/") or "."
+            counting = self.count_excluded or inherited == visible
+            shown = self._within(depth, self.tree_depth)
+            subdirs = []
+
+            for entry in self._scan(dir_path):
+                rel = f"{rel_prefix}{entry.name}"
+                try:
+                    is_dir = entry.is_dir()
+                    if not is_dir and not entry.is_file():
+                        continue
+                except OSError:
+                    continue
 
+                state = ignored if inherited == ignored else self.classify(rel, is_dir)
 
-class TreeBuilder:
-    """Directory tree builder using directory_tree or fallback."""
+                if not is_dir:
+                    if state != visible and counting:
+                        self.excluded[parent_key] += 1
+                    if state == visible or (state == excluded_state and shown):
+                        yield rel, entry, False, state, depth
+                    continue
+
+                child_real, child_links = self._resolve_dir(entry, dir_real, links)
+                if child_real is None:
+                    continue  # Symlink loop
+
+                if state != visible and not self.count_excluded and counting:
+                    # Pruned: the directory counts once against its parent
+                    self.excluded[parent_key] += 1
+                if state == ignored and not self.count_excluded:
+                    continue
+
+                if state == visible or (state == excluded_state and shown):
+                    yield rel, entry, True, state, depth
+
+                enter = self._within(depth + 1, self.max_depth) and (
+                    state == visible
+                    or self.count_excluded
+                    or self._within(depth + 1, self.tree_depth)
+                )
+                if enter:
+                    subdirs.append(
+                        (entry.path, rel + "/", child_real, child_links, depth + 1, state)
+                    )
+
+            # Reverse so the stack pops subdirectories in name order
+            stack.extend(reversed(subdirs))
+
+    @staticmethod
+    def _scan(dir_path: str) -> List["os.DirEntry"]:
+        """List a directory sorted by name, ignoring unreadable directories."""
+        try:
+            with os.scandir(dir_path) as it:
+                return sorted(it, key=lambda e: e.name)
+        except OSError:
+            return []
 
     @staticmethod
-    def build(root: Path, config: Config) -> str:
-        """Build directory tree representation."""
-        if DIRECTORY_TREE_AVAILABLE:
+    def _resolve_dir(entry: "os.DirEntry", parent_real: str, links: frozenset):
+        """Return (real path, symlink targets) for a subdirectory.
+
+        Real paths of ordinary directories are derived by string concatenation;
+        only symlinked directories pay for a realpath() call. Returns
+        (None, links) when following the link would loop back on itself.
+        """
+        if not entry.is_symlink():
+            return os.path.join(parent_real, entry.name), links
+
+        target = os.path.realpath(entry.path)
+        if (
+            target in links
+            or parent_real == target
+            or parent_real.startswith(target + os.sep)
+        ):
+            return None, links
+        return target, links | {target}
+
+
+@dataclass
+class SnapshotEntry:
+    """One file or directory in a RepoSnapshot."""
+
+    rel: str  # Relative path with forward slashes
+    is_dir: bool
+    state: int = 0  # PathPolicy state
+    size: int = 0
+    mtime: float = 0.0
+    # Git blob id, set only when the index proves the worktree file matches it
+    blob_id: Optional[str] = None
+
+    @property
+    def change_key(self) -> Optional[str]:
+        """Key that changes whenever the content does, if known without reading."""
+        return self.blob_id
+
+    @property
+    def name(self) -> str:
+        return self.rel.rpartition("/")[2]
+
+    @property
+    def parent(self) -> str:
+        return self.rel.rpartition("/")[0]
+
+
+class RepoSnapshot:
+    """Indexed snapshot of a repository: paths, kinds, sizes and mtimes.
+
+    Built in a single filesystem pass and shared by the ``<tree>`` rendering
+    and file selection, so each run pays for the walk once.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.entries: Dict[str, SnapshotEntry] = {}  # rel -> entry, walk order
+        self.children: Dict[str, List[SnapshotEntry]] = defaultdict(list)
+        self.excluded: Dict[str, int] = defaultdict(int)
+        self.source = "filesystem walk"
+        self.tracked = 0
+        self.untracked = 0
+        self._counted: Set[str] = set()
+
+    @classmethod
+    def scan(
+        cls,
+        root: Path,
+        policy: PathPolicy,
+        count_excluded: bool = False,
+        tree_depth: Optional[int] = None,
+        max_depth: Optional[int] = None,
+    ) -> "RepoSnapshot":
+        """Walk root once with the policy's pruning rules."""
+        snapshot = cls(root)
+        walker = DirectoryWalker(
+            root,
+            policy.state,
+            count_excluded=count_excluded,
+            tree_depth=tree_depth,
+            max_depth=max_depth,
+        )
+        for rel, entry, is_dir, state, _depth in walker.walk():
+            if is_dir:
+                snapshot.add(SnapshotEntry(rel, True, state))
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            snapshot.add(SnapshotEntry(rel, False, state, st.st_size, st.st_mtime))
+        snapshot.excluded = walker.excluded
+        return snapshot
+
+    @classmethod
+    def from_git_index(
+        cls,
+        root: Path,
+        policy: PathPolicy,
+        count_excluded: bool = False,
+        tree_depth: Optional[int] = None,
+        include_untracked: bool = False,
+    ) -> Optional["RepoSnapshot"]:
+        """Build the snapshot from tracked paths in .git/index instead of walking.
+
+        Returns None when root is not inside a git worktree. Tracked files are
+        only stat()ed; their blob ids are kept when the worktree file still
+        matches the index. ``include_untracked`` adds a supplementary walk for
+        untracked files that honours the root .gitignore and info/exclude.
+        """
+        located = GitIndex.locate(root)
+        if located is None:
+            return None
+        git_dir, top, prefix = located
+        try:
+            index = GitIndex.read(git_dir)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read git index: {e}", file=sys.stderr)
+            return None
+
+        snapshot = cls(root)
+        snapshot.source = "git index"
+        for item in index.entries:
+            if not item.path.startswith(prefix):
+                continue
+            rel = item.path[len(prefix) :]
             try:
-                # Build ignore list from config
-                ignore_list = list(config.DEFAULT_EXCLUDE_PATTERNS | config.exclude)
+                st = os.stat(root / rel)
+            except OSError:
+                continue  # Deleted from the worktree
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            snapshot.tracked += 1
+            snapshot.add_file(
+                rel,
+                st.st_size,
+                st.st_mtime,
+                blob_id=item.blob_id if index.is_clean(item, st) else None,
+                policy=policy,
+                count_excluded=count_excluded,
+                tree_depth=tree_depth,
+            )
 
-                # Create DisplayTree instance
-                tree = DisplayTree(str(root), ignoreList=ignore_list, stringRep=True)
+        if include_untracked:
+            gitignore = GitIgnore.load(top, git_dir, prefix)
 
-                # DisplayTree returns string representation
-                return str(tree)
-            except Exception as e:
-                print(
-                    f"Warning: directory_tree failed: {e}, using fallback",
-                    file=sys.stderr,
-                )
-                return TreeBuilder._fallback_tree(root, config)
-        else:
-            return TreeBuilder._fallback_tree(root, config)
+            def classify(rel: str, is_dir: bool) -> int:
+                if gitignore.match(rel, is_dir):
+                    return PathPolicy.IGNORED
+                return policy.state(rel, is_dir)
+
+            walker = DirectoryWalker(root, classify, tree_depth=0)
+            for rel, entry, is_dir, state, _depth in walker.walk():
+                if is_dir or rel in snapshot.entries:
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                snapshot.add_file(rel, st.st_size, st.st_mtime)
+                snapshot.untracked += 1
+        return snapshot
+
+    @classmethod
+    def from_paths(cls, root: Path, paths: List[str]) -> "RepoSnapshot":
+        """Build the snapshot from an explicit list of root-relative file paths.
+
+        The list is taken as given: no walk and no exclusion rules. Paths that
+        do not name a regular file under root are reported and skipped.
+        """
+        snapshot = cls(root)
+        snapshot.source = "file list"
+        root_str = str(root)
+        for raw in paths:
+            rel = raw.replace("\\", "/")
+            if os.path.isabs(rel):
+                rel = os.path.relpath(rel, root_str).replace("\\", "/")
+            rel = os.path.normpath(rel).replace("\\", "/")
+            if rel == "." or rel == ".." or rel.startswith("../"):
+                print(f"Warning: {raw} is outside {root}, skipping", file=sys.stderr)
+                continue
+            if rel in snapshot.entries:
+                continue
+            try:
+                st = os.stat(os.path.join(root_str, rel))
+            except OSError as e:
+                print(f"Warning: Could not stat {raw}: {e}", file=sys.stderr)
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue  # Directories from `fd`/`find` output
+            snapshot.add_file(rel, st.st_size, st.st_mtime)
+            snapshot.tracked += 1
+        return snapshot
+
+    def add(self, entry: SnapshotEntry):
+        """Index an entry and attach it to its parent directory."""
+        self.entries[entry.rel] = entry
+        self.children[entry.parent].append(entry)
+
+    def add_file(
+        self,
+        rel: str,
+        size: int = 0,
+        mtime: float = 0.0,
+        blob_id: Optional[str] = None,
+        policy: Optional[PathPolicy] = None,
+        count_excluded: bool = False,
+        tree_depth: Optional[int] = None,
+    ):
+        """Index a file found without walking, synthesizing its directories.
+
+        Applies the same listing and excluded-count rules as DirectoryWalker.
+        Without a policy every path is treated as visible.
+        """
+        visible, excluded_state, ignored = (
+            PathPolicy.VISIBLE,
+            PathPolicy.EXCLUDED,
+            PathPolicy.IGNORED,
+        )
+        parts = rel.split("/")
+        top = None  # Outermost non-visible component
+        listed = True
+        prefix = ""
+        for depth, part in enumerate(parts[:-1]):
+            rel_dir = prefix + part
+            state = policy.state(rel_dir, True) if policy else visible
+            if state != visible and top is None:
+                top = rel_dir
+            if state == ignored:
+                listed = False
+            elif state == excluded_state and not (
+                tree_depth is None or depth < tree_depth
+            ):
+                listed = False
+            if listed and rel_dir not in self.entries:
+                self.add(SnapshotEntry(rel_dir, True, state))
+            prefix = rel_dir + "/"
+
+        state = policy.state(rel) if policy else visible
+        if state != visible:
+            top = top or rel
+            if count_excluded:
+                self.excluded[prefix.rstrip("/") or "."] += 1
+            elif top not in self._counted:
+                self._counted.add(top)
+                self.excluded[top.rpartition("/")[0] or "."] += 1
+            if state == ignored or not (
+                tree_depth is None or len(parts) - 1 < tree_depth
+            ):
+                listed = False
+
+        if listed:
+            self.add(SnapshotEntry(rel, False, state, size, mtime, blob_id))
+
+    def files(self) -> Iterator[SnapshotEntry]:
+        """Yield the files selected for processing, in walk order."""
+        for entry in self.entries.values():
+            if not entry.is_dir and entry.state == PathPolicy.VISIBLE:
+                yield entry
+
+    def path(self, entry: SnapshotEntry) -> Path:
+        return self.root / entry.rel
+
+
+def read_path_list(source: str) -> List[str]:
+    """Read newline- or NUL-separated paths from a file, or stdin for "-".
+
+    NUL separation (``git ls-files -z``, ``fd -0``) is detected from the
+    data itself; blank entries are dropped.
+    """
+    if source == "-":
+        data = sys.stdin.buffer.read()
+    else:
+        data = Path(source).read_bytes()
+    text = os.fsdecode(data)
+    separator = "\0" if "\0" in text else "\n"
+    return [p.rstrip("\r") for p in text.split(separator) if p.strip()]
+
+
+@dataclass
+class GitIndexEntry:
+    """One stage-0 entry of the git index."""
+
+    path: str  # Relative to the worktree top, forward slashes
+    blob_id: str
+    size: int  # Truncated to 32 bits, as stored by git
+    mtime_ns: int
+    mode: int
+
+
+class GitIndex:
+    """Local reader for the git index file (.git/index), versions 2 to 4.
+
+    Parses the file directly; git itself is never invoked.
+    """
+
+    SIGNATURE = b"DIRC"
+    # ctime s/ns, mtime s/ns, dev, ino, mode, uid, gid, size
+    _STAT = struct.Struct(">10I")
+    _FLAG_EXTENDED = 0x4000
+    _FLAG_SKIP_WORKTREE = 0x4000  # In the extended flags
+    _MODE_GITLINK = 0o160000
+
+    def __init__(self, entries: List[GitIndexEntry], index_mtime_ns: int = 0):
+        self.entries = entries
+        # Entries modified at or after the index was written are "racily clean"
+        self.index_mtime_ns = index_mtime_ns
 
     @staticmethod
-    def _fallback_tree(root: Path, config: Config) -> str:
-        """Fallback ASCII tree builder."""
-        lines = [f"{root.name}/"]
-
-        def should_ignore(path: Path) -> bool:
-            """Check if path should be ignored in tree."""
-            # Special case: Never ignore .gitignore or .dockerignore
-            # These are config files we want to show
-            if path.name in {".gitignore", ".dockerignore"}:
-                return False
+    def locate(root: Path) -> Optional[Tuple[Path, Path, str]]:
+        """Find (git dir, worktree top, prefix of root below the top).
+
+        Handles '.git' files (worktrees, submodules) and roots that are
+        subdirectories of the worktree.
+        """
+        root = Path(os.path.realpath(root))
+        for top in (root, *root.parents):
+            dot_git = top / ".git"
+            if dot_git.is_dir():
+                git_dir = dot_git
+            elif dot_git.is_file():
+                try:
+                    line = dot_git.read_text(encoding="utf-8").strip()
+                except OSError:
+                    return None
+                if not line.startswith("gitdir:"):
+                    return None
+                git_dir = (top / line[len("gitdir:") :].strip()).resolve()
+            else:
+                continue
+            if not (git_dir / "index").is_file():
+                return None
+            prefix = root.relative_to(top).as_posix()
+            return git_dir, top, "" if prefix == "." else prefix + "/"
+        return None
+
+    @classmethod
+    def read(cls, git_dir: Path) -> "GitIndex":
+        """Read and parse <git_dir>/index."""
+        index_path = git_dir / "index"
+        data = index_path.read_bytes()
+        entries = cls.parse(data, cls._hash_size(git_dir))
+        return cls(entries, index_path.stat().st_mtime_ns)
 
-            # Check custom exclusions first (use name-based matching for simplicity)
-            for pattern in config.exclude:
-                # For patterns starting with '.', do exact name match
-                if pattern.startswith("."):
-                    if path.name == pattern:
-                        return True
-                # For wildcard patterns like "*.pyc"
-                elif "*" in pattern:
-                    if path.match(pattern):
-                        return True
-                # For other patterns, check if they match the name or any parent directory name
-                else:
-                    # Check if the pattern matches this path's name
-                    if path.name == pattern:
-                        return True
-                    # Check if pattern appears in any parent directory name
-                    try:
-                        rel_path = path.relative_to(root)
-                        if pattern in rel_path.parts:
-                            return True
-                    except ValueError:
-                        # If we can't get relative path, check absolute path parts
-                        if pattern in path.parts:
-                            return True
-
-            # Check default exclusions
-            for pattern in config.DEFAULT_EXCLUDE_PATTERNS:
-                # For patterns starting with '.', do exact name match
-                if pattern.startswith("."):
-                    if path.name == pattern:
-                        return True
-                # For wildcard patterns like "*.pyc"
-                elif "*" in pattern:
-                    if path.match(pattern):
-                        return True
-                # For other patterns, check if they match as directory/file names
-                else:
-                    # Check if pattern matches the name
-                    if path.name == pattern:
-                        return True
-                    # Check if pattern appears in path hierarchy
-                    try:
-                        rel_path = path.relative_to(root)
-                        if pattern in rel_path.parts:
-                            return True
-                    except ValueError:
-                        if pattern in path.parts:
-                            return True
+    @staticmethod
+    def _hash_size(git_dir: Path) -> int:
+        """20 for SHA-1 repositories, 32 when extensions.objectFormat is sha256."""
+        for config in (git_dir / "config", git_dir / "commondir"):
+            try:
+                text = config.read_text(encoding="utf-8", errors="ignore")
+            except OSError:
+                continue
+            if config.name == "commondir":
+                common = (git_dir / text.strip()).resolve()
+                return GitIndex._hash_size(common) if common != git_dir else 20
+            if re.search(r"(?im)^\s*objectformat\s*=\s*sha256\s*$", text):
+                return 32
+            return 20
+        return 20
+
+    @classmethod
+    def parse(cls, data: bytes, hash_size: int = 20) -> List[GitIndexEntry]:
+        """Parse index bytes into stage-0 entries for files and symlinks."""
+        if len(data) < 12 or data[:4] != cls.SIGNATURE:
+            raise ValueError("not a git index file")
+        version, count = struct.unpack_from(">II", data, 4)
+        if version not in (2, 3, 4):
+            raise ValueError(f"unsupported git index version {version}")
+
+        entries = []
+        pos = 12
+        previous = b""
+        fixed = cls._STAT.size + hash_size + 2
+
+        for _ in range(count):
+            start = pos
+            stat_fields = cls._STAT.unpack_from(data, pos)
+            pos += cls._STAT.size
+            blob = data[pos : pos + hash_size]
+            pos += hash_size
+            (flags,) = struct.unpack_from(">H", data, pos)
+            pos += 2
+
+            extended = 0
+            if version >= 3 and flags & cls._FLAG_EXTENDED:
+                (extended,) = struct.unpack_from(">H", data, pos)
+                pos += 2
+
+            if version == 4:
+                # Prefix-compressed path: strip N bytes from the previous path
+                strip, pos = cls._read_varint(data, pos)
+                end = data.index(b"\0", pos)
+                path = previous[: len(previous) - strip] + data[pos:end]
+                pos = end + 1
+            else:
+                end = data.index(b"\0", pos)
+                path = data[pos:end]
+                # Entries are NUL-padded to a multiple of 8 bytes
+                entry_len = fixed + (pos - start - fixed) + len(path)
+                pos = start + ((entry_len + 8) & ~7)
+            previous = path
+
+            mode = stat_fields[6]
+            stage = (flags >> 12) & 0x3
+            if (
+                stage
+                or extended & cls._FLAG_SKIP_WORKTREE
+                or mode & 0o170000 == cls._MODE_GITLINK
+            ):
+                continue
+
+            entries.append(
+                GitIndexEntry(
+                    path=os.fsdecode(path),
+                    blob_id=blob.hex(),
+                    size=stat_fields[9],
+                    mtime_ns=stat_fields[2] * 1_000_000_000 + stat_fields[3],
+                    mode=mode,
+                )
+            )
+        return entries
+
+    @staticmethod
+    def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+        """Decode git's offset varint used by index v4."""
+        byte = data[pos]
+        pos += 1
+        value = byte & 0x7F
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+            value = ((value + 1) << 7) | (byte & 0x7F)
+        return value, pos
+
+    def is_clean(self, entry: GitIndexEntry, st: os.stat_result) -> bool:
+        """True if the worktree file provably still has the indexed content."""
+        if (st.st_size & 0xFFFFFFFF) != entry.size:
             return False
+        mtime_ns = (int(st.st_mtime) & 0xFFFFFFFF) * 1_000_000_000 + (
+            st.st_mtime_ns % 1_000_000_000
+        )
+        if mtime_ns != entry.mtime_ns:
+            return False
+        return st.st_mtime_ns < self.index_mtime_ns
 
-        def add_dir(path: Path, prefix: str = "", depth: int = 0):
-            # Limit depth to 5 levels (0-4)
-            if depth >= 5:
-                return
 
+class GitIgnore:
+    """Minimal .gitignore matcher for the untracked-file scan.
+
+    Reads the worktree's root .gitignore and .git/info/exclude. Supports
+    comments, negation, directory-only rules, anchoring and '**'; nested
+    .gitignore files are not consulted.
+    """
+
+    def __init__(self, lines: List[str], prefix: str = ""):
+        self.prefix = prefix
+        self.rules = []  # (regex, negate, dir_only); the last match wins
+        for line in lines:
+            line = line.rstrip("\n").rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            anchored = "/" in line
+            body = _glob_to_regex(line.lstrip("/"), globstar=True)
+            regex = re.compile(("^" if anchored else "(?:^|.*/)") + body + "$")
+            self.rules.append((regex, negate, dir_only))
+
+    @classmethod
+    def load(cls, top: Path, git_dir: Path, prefix: str = "") -> "GitIgnore":
+        lines = []
+        for path in (top / ".gitignore", git_dir / "info" / "exclude"):
             try:
-                items = sorted(path.iterdir(), key=lambda x: (not x.is_dir(), x.name))
-            except PermissionError:
-                return
+                lines.extend(path.read_text(encoding="utf-8").splitlines())
+            except OSError:
+                pass
+        return cls(lines, prefix)
+
+    def match(self, rel: str, is_dir: bool = False) -> bool:
+        """Check if a path relative to the scanned root is ignored."""
+        path = self.prefix + rel
+        ignored = False
+        for regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(path):
+                ignored = not negate
+        return ignored
+
+
+class TreeBuilder:
+    """Renders a ``RepoSnapshot`` as an ASCII directory tree."""
 
-            # Filter items before processing
-            items = [item for item in items if not should_ignore(item)]
+    MAX_DEPTH = 5
 
+    @staticmethod
+    def render(
+        snapshot: "RepoSnapshot",
+        max_depth: Optional[int] = None,
+        max_width: int = 0,
+        estimate: Optional[Callable[[SnapshotEntry], int]] = None,
+        max_lines: int = 0,
+    ) -> str:
+        """Render an ASCII tree from a snapshot without touching the filesystem.
+
+        ``max_depth`` limits the levels listed (0 = no limit). A directory
+        with more than ``max_width`` entries lists the first ones and
+        collapses the rest into a summary line with their files and size.
+        ``max_lines`` caps the whole tree: directories are opened shallowest
+        and largest first while their entries fit, and the rest stay closed.
+        With ``estimate`` (a file's tokens), each directory is annotated
+        with the files and estimated tokens of its whole subtree, and
+        summary lines with the tokens they hide.
+        """
+        if max_depth is None:
+            max_depth = TreeBuilder.MAX_DEPTH
+        totals = {}
+        if estimate or max_width or max_lines:
+            totals = TreeBuilder._totals(snapshot, estimate)
+        layout = TreeBuilder._layout(snapshot, totals, max_depth, max_width, max_lines)
+
+        def note(rel_dir: str, state: int = PathPolicy.VISIBLE) -> str:
+            if estimate is None:
+                return ""
+            if state == PathPolicy.EXCLUDED:
+                return " (excluded)"
+            files, _size, tokens = totals.get(rel_dir, (0, 0, 0))
+            if not files:
+                return ""
+            plural = "s" if files != 1 else ""
+            return f" ({files:,} file{plural}, ~{_format_tokens(tokens)} tokens)"
+
+        lines = [f"{snapshot.root.name}/{note('')}"]
+
+        def add_dir(rel_dir: str, prefix: str = ""):
+            if rel_dir not in layout:
+                return
+            items, hidden = layout[rel_dir]
             for i, item in enumerate(items):
-                is_last = i == len(items) - 1
+                is_last = i == len(items) - 1 and not hidden
                 current = "└── " if is_last else "├── "
                 extension = "    " if is_last else "│   "
 
-                if item.is_dir():
-                    lines.append(f"{prefix}{current}{item.name}/")
-                    add_dir(item, prefix + extension, depth + 1)
+                if item.is_dir:
+                    annotation = note(item.rel, item.state)
+                    lines.append(f"{prefix}{current}{item.name}/{annotation}")
+                    add_dir(item.rel, prefix + extension)
                 else:
                     lines.append(f"{prefix}{current}{item.name}")
+            if hidden:
+                summary = TreeBuilder._summary(hidden, totals, estimate)
+                lines.append(f"{prefix}└── {summary}")
 
-        add_dir(root)
+        add_dir("")
         return "\n".join(lines)
 
+    @staticmethod
+    def _layout(
+        snapshot: "RepoSnapshot",
+        totals: Dict[str, Tuple[int, int, int]],
+        max_depth: int,
+        max_width: int,
+        max_lines: int,
+    ) -> Dict[str, Tuple[List[SnapshotEntry], List[SnapshotEntry]]]:
+        """Directories to open, each with its listed and collapsed entries.
+
+        The root is always opened. Others open level by level, the largest
+        first within a level, skipping any whose entries would take the
+        tree past ``max_lines``.
+        """
+        layout = {}
+        lines = 1
+        queue = [(0, 0, 0, "")]
+        while queue:
+            depth, _tokens, _size, rel_dir = heapq.heappop(queue)
+            items = sorted(
+                snapshot.children.get(rel_dir, ()),
+                key=lambda x: (not x.is_dir, x.name),
+            )
+            hidden = []
+            if max_width and len(items) > max_width:
+                items, hidden = items[:max_width], items[max_width:]
+            cost = len(items) + (1 if hidden else 0)
+            if rel_dir and max_lines and lines + cost > max_lines:
+                continue
+            lines += cost
+            layout[rel_dir] = (items, hidden)
+            if max_depth and depth + 1 >= max_depth:
+                continue
+            for item in items:
+                if item.is_dir and snapshot.children.get(item.rel):
+                    _files, size, tokens = totals.get(item.rel, (0, 0, 0))
+                    heapq.heappush(queue, (depth + 1, -tokens, -size, item.rel))
+        return layout
+
+    @staticmethod
+    def _totals(
+        snapshot: "RepoSnapshot", estimate: Optional[Callable[[SnapshotEntry], int]]
+    ) -> Dict[str, Tuple[int, int, int]]:
+        """Files, bytes and estimated tokens under each directory ("" = root).
+
+        Only files selected for processing count, at any depth.
+        """
+        own: Dict[str, List[int]] = defaultdict(lambda: [0, 0, 0])
+        for entry in snapshot.files():
+            row = own[entry.parent]
+            row[0] += 1
+            row[1] += entry.size
+            row[2] += estimate(entry) if estimate else 0
+        totals: Dict[str, List[int]] = defaultdict(lambda: [0, 0, 0])
+        for rel_dir, (files, size, tokens) in own.items():
+            while True:
+                row = totals[rel_dir]
+                row[0] += files
+                row[1] += size
+                row[2] += tokens
+                if not rel_dir:
+                    break
+                rel_dir = rel_dir.rpartition("/")[0]
+        return {rel_dir: tuple(row) for rel_dir, row in totals.items()}
+
+    @staticmethod
+    def _summary(
+        hidden: List[SnapshotEntry],
+        totals: Dict[str, Tuple[int, int, int]],
+        estimate: Optional[Callable[[SnapshotEntry], int]],
+    ) -> str:
+        """'… 3,412 more files (2.1 MB, ~180k tokens)' for collapsed entries."""
+        dirs = sum(1 for entry in hidden if entry.is_dir)
+        files = len(hidden) - dirs
+        count = size = tokens = 0
+        for entry in hidden:
+            if entry.is_dir:
+                subtree = totals.get(entry.rel, (0, 0, 0))
+            elif entry.state == PathPolicy.VISIBLE:
+                subtree = (1, entry.size, estimate(entry) if estimate else 0)
+            else:
+                continue
+            count += subtree[0]
+            size += subtree[1]
+            tokens += subtree[2]
+        parts = []
+        if files:
+            parts.append(f"{files:,} more file{'s' if files != 1 else ''}")
+        if dirs:
+            parts.append(f"{dirs:,} more director{'ies' if dirs != 1 else 'y'}")
+        details = [f"{count:,} file{'s' if count != 1 else ''}"] if dirs else []
+        details.append(_format_size(size))
+        if estimate is not None:
+            details.append(f"~{_format_tokens(tokens)} tokens")
+        return f"… {' and '.join(parts)} ({', '.join(details)})"
+
+
+def _count_lines(data) -> int:
+    """Line count of bytes or an mmap, scanning in bounded slices."""
+    step = 1 << 20
+    return sum(data[i : i + step].count(b"\n") for i in range(0, len(data), step)) + 1
+
+
+def _format_size(size: float) -> str:
+    """Byte count for people: 512 B, 3.4 KB, 12.0 MB."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+
+
+def _format_tokens(tokens: int) -> str:
+    """Token count for people: 850, 1.2k, 180k, 2.3M."""
+    if tokens < 1000:
+        return str(tokens)
+    if tokens < 10_000:
+        return f"{tokens / 1000:.1f}k"
+    if tokens < 1_000_000:
+        return f"{tokens / 1000:.0f}k"
+    return f"{tokens / 1_000_000:.1f}M"
+
+
+def _count(count: int, noun: str, plural: Optional[str] = None) -> str:
+    """A count with its noun agreeing: 1 file, 2 files, 1 entry, 3 entries."""
+    if count == 1:
+        return f"{count} {noun}"
+    return f"{count} {plural or noun + 's'}"
+
+
+def _attr(value: str) -> str:
+    """Escape a value for a single-quoted attribute."""
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace("'", "&apos;")
+
+
+class SourceBuffer:
+    """Source bytes (``bytes`` or a read-only ``mmap``) with a line index.
+
+    Line and byte-range lookups decode only the fragment asked for, so the
+    source is never held as a second full copy in ``str`` form.
+    """
+
+    _NEWLINE = re.compile(b"\n")
+
+    def __init__(self, data):
+        self.data = data
+        self._line_starts: Optional[array] = None
+
+    @property
+    def line_starts(self) -> array:
+        """Byte offset of the start of each line, built on first use."""
+        if self._line_starts is None:
+            starts = array("Q", [0])
+            starts.extend(m.end() for m in self._NEWLINE.finditer(self.data))
+            self._line_starts = starts
+        return self._line_starts
+
+    @property
+    def line_count(self) -> int:
+        return len(self.line_starts)
+
+    def line(self, row: int) -> str:
+        """Decode one line, without its line ending."""
+        starts = self.line_starts
+        start = starts[row]
+        end = starts[row + 1] - 1 if row + 1 < len(starts) else len(self.data)
+        if end > start and self.data[end - 1] == 13:  # CRLF
+            end -= 1
+        return self.text(start, end)
+
+    def text(self, start: int, end: int) -> str:
+        return self.data[start:end].decode("utf8", errors="ignore")
+
+    def decode(self) -> str:
+        """The whole source as text, for the line-based fallback extractor."""
+        text = self.text(0, len(self.data))
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+class ParserRegistry(Mapping):
+    """Tree-sitter parsers by parser type, each built on first use.
+
+    Membership and iteration only consult which grammar packages are
+    installed, so a grammar is imported, and its parser built, only when a
+    file of that language is actually parsed.
+    """
+
+    def __init__(self, grammars: Dict[str, Tuple[str, str]]):
+        self._grammars = {
+            parser_type: grammar
+            for parser_type, grammar in grammars.items()
+            if _has_module(grammar[0])
+        }
+        self._parsers = {}
+
+    def __getitem__(self, parser_type: str):
+        parser = self._parsers.get(parser_type)
+        if parser is None:
+            module_name, function = self._grammars[parser_type]
+            try:
+                grammar = importlib.import_module(module_name)
+                language = _optional("Language")(getattr(grammar, function)())
+                parser = _optional("Parser")(language)
+            except Exception as e:
+                _warn_once(f"Warning: Tree-sitter init failed for {parser_type}: {e}")
+                del self._grammars[parser_type]
+                raise KeyError(parser_type) from e
+            self._parsers[parser_type] = parser
+        return parser
+
+    def __contains__(self, parser_type) -> bool:
+        return parser_type in self._grammars
+
+    def __iter__(self):
+        return iter(self._grammars)
+
+    def __len__(self) -> int:
+        return len(self._grammars)
+
+
+class OutlineLine(NamedTuple):
+    """One skeleton line, tagged with its role so it can be re-rendered."""
+
+    role: int
+    text: str
+    name: str = ""  # Definitions: "def greet", "class App", "interface Props"
+    suffix: str = ""  # Appended while bodies are shown as hidden
+    stub: str = ""  # Appended instead once bodies are left out
+
+
+class Outline:
+    """A skeleton as tagged lines, rendered at any level of detail.
+
+    Extraction runs once; the budget planner can then demote a file from
+    full docstrings to first lines, bare signatures or names alone without
+    parsing it again. At ``DOCSTRINGS`` the rendering is the skeleton
+    exactly as extracted.
+    """
+
+    # Line roles
+    IMPORT = 0
+    DEF = 1  # First line of a function, class or type signature
+    HEADER = 2  # Decorators and further signature lines
+    DOC = 3  # First docstring line (and the blank line after a docstring)
+    DOC_MORE = 4  # Further docstring lines
+    BODY = 5  # Implementation markers and the braces around them
+    CLOSE = 6  # Closing brace of a class
+    BLANK = 7
+    OTHER = 8  # Bindings, fields, re-exports: shown by their first line
+
+    # Detail levels, most detailed first
+    FULL = 0
+    DOCSTRINGS = 1
+    FIRST_LINE = 2
+    SIGNATURES = 3
+    NAMES = 4
+    PATH = 5
+    LEVELS = ("full", "docstrings", "first-line", "signatures", "names", "path")
+
+    QUOTES = ('"""', "'''", '"', "'")
+    MARKERS = {"# [Implementation hidden]", "# [No methods defined]"}
+
+    # Definitions recognised in fallback skeletons
+    DEF_PATTERN = re.compile(
+        r"\s*(?:export\s+(?:default\s+)?)?(?:declare\s+)?(?:abstract\s+)?"
+        r"(async\s+def|def|class|async\s+function|function|interface|type|enum)"
+        r"\s+([\w$]+)"
+    )
+
+    @classmethod
+    def render(cls, lines, level: int = DOCSTRINGS) -> str:
+        """Render outline lines (``OutlineLine`` or plain rows) at a level."""
+        lines = [OutlineLine(*line) for line in lines]
+        if level >= cls.PATH:
+            return ""
+        if level == cls.NAMES:
+            return "\n".join(
+                line.text[: len(line.text) - len(line.text.lstrip())] + line.name
+                for line in lines
+                if line.role == cls.DEF and line.name
+            )
+        result = []
+        for index, line in enumerate(lines):
+            role = line.role
+            if level >= cls.SIGNATURES and role in (cls.DOC, cls.DOC_MORE, cls.BODY):
+                continue
+            if level >= cls.FIRST_LINE and role == cls.DOC_MORE:
+                continue
+            text = line.text
+            if (
+                level == cls.FIRST_LINE
+                and role == cls.DOC
+                and index + 1 < len(lines)
+                and lines[index + 1].role == cls.DOC_MORE
+            ):
+                text = text.rstrip() + cls._quote(text)
+            tail = line.stub if level >= cls.SIGNATURES else line.suffix
+            result.append(text + tail)
+        return "\n".join(result)
+
+    @classmethod
+    def _quote(cls, text: str) -> str:
+        """The quote that opened a docstring, to close it after its first line."""
+        body = text.lstrip().lstrip("rRuUbBfF")
+        return next((quote for quote in cls.QUOTES if body.startswith(quote)), "")
+
+    @staticmethod
+    def pack(lines: List[OutlineLine]) -> List[list]:
+        """Rows for the cache, with trailing empty fields dropped."""
+        rows = []
+        for line in lines:
+            row = list(line)
+            while len(row) > 2 and not row[-1]:
+                row.pop()
+            rows.append(row)
+        return rows
+
+    @classmethod
+    def from_text(cls, text: str) -> List[OutlineLine]:
+        """Tag the lines of a skeleton made without a parse tree.
+
+        Used for the fallback extractor, whose output is plain text; roles
+        are recognised from each line's shape.
+        """
+        lines = []
+        quote = None
+        for line in text.split("\n"):
+            stripped = line.strip()
+            if quote is not None:
+                lines.append(OutlineLine(cls.DOC_MORE, line))
+                if quote in stripped:
+                    quote = None
+                continue
+            opening = cls._quote(stripped)
+            if not stripped:
+                lines.append(OutlineLine(cls.BLANK, line))
+            elif stripped in cls.MARKERS:
+                lines.append(OutlineLine(cls.BODY, line))
+            elif opening in ('"""', "'''"):
+                lines.append(OutlineLine(cls.DOC, line))
+                if stripped.count(opening) == 1:
+                    quote = opening
+            elif stripped.startswith(("import ", "from ")):
+                lines.append(OutlineLine(cls.IMPORT, line))
+            else:
+                match = cls.DEF_PATTERN.match(line)
+                if match is None:
+                    lines.append(OutlineLine(cls.OTHER, line))
+                    continue
+                keyword = " ".join(match.group(1).split())
+                stub = " ..." if stripped.endswith(":") else ""
+                lines.append(
+                    OutlineLine(
+                        cls.DEF, line, f"{keyword} {match.group(2)}", stub=stub
+                    )
+                )
+        return lines
+
 
 class CodeExtractor:
     """Extracts code skeletons using Tree-sitter v0.21+ API."""
 
-    def __init__(self):
-        self.parsers = {}
-        self.queries = {}
-        if TREE_SITTER_AVAILABLE:
-            self._init_parsers()
+    # Extension -> parser type
+    LANGUAGES = {
+        "py": "python",
+        "js": "javascript",
+        "jsx": "jsx",
+        "ts": "typescript",
+        "tsx": "tsx",
+    }
 
-    def _init_parsers(self):
-        """Initialize Tree-sitter parsers with v0.21+ API."""
-        try:
-            # Python
-            PY_LANGUAGE = Language(tspython.language())
-            self.parsers["python"] = Parser(PY_LANGUAGE)
-
-            # Python queries for extraction
-            self.queries["python"] = Query(
-                PY_LANGUAGE,
-                """
-                (import_statement) @import
-                (import_from_statement) @import
-                (function_definition) @function
-                (class_definition) @class
-                """,
-            )
+    MMAP_THRESHOLD = 256 * 1024  # Larger sources are memory-mapped
+    FIRST_LINE_LIMIT = 200  # Bytes kept of a one-line entry (minified code)
+
+    # Bump whenever extraction output changes, to invalidate cached skeletons
+    VERSION = 3
+
+    # Python statements looked through for definitions (conditional imports,
+    # try/except fallbacks, ...); function and class bodies are not among them
+    PYTHON_BLOCKS = {
+        "if_statement",
+        "elif_clause",
+        "else_clause",
+        "try_statement",
+        "except_clause",
+        "except_group_clause",
+        "finally_clause",
+        "with_statement",
+        "for_statement",
+        "while_statement",
+        "block",
+    }
+    PYTHON_IMPORTS = {
+        "import_statement",
+        "import_from_statement",
+        "future_import_statement",
+    }
+    PYTHON_DEFINITIONS = {
+        "function_definition",
+        "class_definition",
+        "decorated_definition",
+    }
+    PYTHON_MEMBERS = PYTHON_IMPORTS | PYTHON_DEFINITIONS
+
+    # JS/TS node types kept by the scoped walk (JSX/TSX share the grammars)
+    JS_FUNCTIONS = {"function_declaration", "generator_function_declaration"}
+    JS_FUNCTION_VALUES = {
+        "arrow_function",
+        "function_expression",
+        "function",
+        "generator_function",
+    }
+    JS_CLASSES = {"class_declaration", "abstract_class_declaration", "class"}
+    JS_DECLARATIONS = {"lexical_declaration", "variable_declaration"}
+    JS_MEMBERS = {
+        "method_definition",
+        "method_signature",
+        "abstract_method_signature",
+        "field_definition",
+        "public_field_definition",
+    }
+    # TypeScript-only top-level declarations, shown by their first line
+    TS_DECLARATIONS = {
+        "interface_declaration",
+        "type_alias_declaration",
+        "enum_declaration",
+        "ambient_declaration",
+        "function_signature",
+    }
+    TS_KEYWORDS = {
+        "interface_declaration": "interface",
+        "type_alias_declaration": "type",
+        "enum_declaration": "enum",
+        "function_signature": "function",
+    }
 
-            # JavaScript/TypeScript
-            JS_LANGUAGE = Language(tsjavascript.language())
-            self.parsers["javascript"] = Parser(JS_LANGUAGE)
-            self.parsers["jsx"] = Parser(JS_LANGUAGE)
-
-            # TypeScript
-            TS_LANGUAGE = Language(tstypescript.language_typescript())
-            self.parsers["typescript"] = Parser(TS_LANGUAGE)
-
-            # TypeScript JSX
-            TSX_LANGUAGE = Language(tstypescript.language_tsx())
-            self.parsers["tsx"] = Parser(TSX_LANGUAGE)
-
-            # Simplified query for all JS-family languages
-            js_query_text = """
-            (import_statement) @import
-            (export_statement) @export
-            (function_declaration) @function
-            (arrow_function) @function
-            (method_definition) @function
-            (class_declaration) @class
-            """
-
-            self.queries["javascript"] = Query(JS_LANGUAGE, js_query_text)
-            self.queries["jsx"] = Query(JS_LANGUAGE, js_query_text)
-            self.queries["typescript"] = Query(TS_LANGUAGE, js_query_text)
-            self.queries["tsx"] = Query(TSX_LANGUAGE, js_query_text)
+    # Parser type -> (grammar package, function returning its language)
+    GRAMMARS = {
+        "python": ("tree_sitter_python", "language"),
+        "javascript": ("tree_sitter_javascript", "language"),
+        "jsx": ("tree_sitter_javascript", "language"),
+        "typescript": ("tree_sitter_typescript", "language_typescript"),
+        "tsx": ("tree_sitter_typescript", "language_tsx"),
+    }
 
-        except Exception as e:
-            print(f"Warning: Tree-sitter init failed: {e}", file=sys.stderr)
+    def __init__(self, config: Optional[Config] = None):
+        self.nested_defs = config.nested_defs if config is not None else False
+        self.nodes_visited = 0  # Syntax nodes examined by the scoped walks
+        if TREE_SITTER_AVAILABLE:
+            self.parsers = ParserRegistry(self.GRAMMARS)
+        else:
+            _warn_once("Warning: tree-sitter not available, using fallback mode")
             self.parsers = {}
-            self.queries = {}
 
-    def extract_skeleton(self, file_path: Path, content: str) -> str:
-        """Extract skeleton from file content."""
+    def parses(self, file_path: Path) -> bool:
+        """Check if a Tree-sitter parser handles this file type."""
         ext = file_path.suffix.lstrip(".").lower()
+        return self.LANGUAGES.get(ext) in self.parsers
+
+    @contextmanager
+    def open_source(self, file_path: Path, size: int):
+        """Yield the file's bytes, memory-mapped from MMAP_THRESHOLD bytes up."""
+        if size >= self.MMAP_THRESHOLD:
+            with open(file_path, "rb") as f, mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ
+            ) as data:
+                yield data
+        else:
+            yield file_path.read_bytes()
 
-        # Map extensions to parser types
-        ext_map = {
-            "py": "python",
-            "js": "javascript",
-            "jsx": "jsx",
-            "ts": "typescript",
-            "tsx": "tsx",
-        }
+    def extract_skeleton(self, file_path: Path, content: Union[str, bytes]) -> str:
+        """Extract skeleton from file content (text, bytes or mmap)."""
+        return Outline.render(self.extract_outline(file_path, content))
 
-        parser_type = ext_map.get(ext)
+    def extract_outline(
+        self, file_path: Path, content: Union[str, bytes]
+    ) -> List[OutlineLine]:
+        """Extract the skeleton as outline lines, renderable at any detail level."""
+        ext = file_path.suffix.lstrip(".").lower()
+        parser_type = self.LANGUAGES.get(ext)
 
         if parser_type and parser_type in self.parsers:
-            return self._extract_with_treesitter(content, parser_type)
-        else:
-            return self._fallback_extract(content, ext)
-
-    def _extract_with_treesitter(self, content: str, parser_type: str) -> str:
+            src = SourceBuffer(
+                content.encode("utf8") if isinstance(content, str) else content
+            )
+            return self._parse_and_extract(src, parser_type)[0]
+        if not isinstance(content, str):
+            content = SourceBuffer(content).decode()
+        return Outline.from_text(self._fallback_extract(content, ext))
+
+    def _extract_with_treesitter(
+        self, content: Union[str, bytes], parser_type: str
+    ) -> str:
         """Extract skeleton using Tree-sitter v0.21+ API."""
+        src = SourceBuffer(
+            content.encode("utf8") if isinstance(content, str) else content
+        )
+        return Outline.render(self._parse_and_extract(src, parser_type)[0])
+
+    def extract_incremental(
+        self, file_path: Path, data: bytes, previous: Optional[Tuple[bytes, object]]
+    ) -> Tuple[List[OutlineLine], Optional[Tuple[bytes, object]]]:
+        """Extract an outline, reparsing incrementally from a previous parse.
+
+        ``previous`` is the (source, Tree) pair returned by the last call for
+        the same file. The differing span between the old and new source is
+        applied with ``Tree.edit`` so Tree-sitter reuses unchanged subtrees.
+        Returns the outline and the pair to pass in next time.
+        """
+        parser_type = self.LANGUAGES.get(file_path.suffix.lstrip(".").lower())
+        if parser_type not in self.parsers:
+            return self.extract_outline(file_path, data), None
+        old_tree = None
+        if previous is not None:
+            old_data, old_tree = previous
+            self._apply_edit(old_tree, old_data, data)
+        outline, tree = self._parse_and_extract(
+            SourceBuffer(data), parser_type, old_tree
+        )
+        return outline, (data, tree) if tree is not None else None
+
+    @staticmethod
+    def _apply_edit(tree, old: bytes, new: bytes):
+        """Describe the change from old to new to the tree as one edit."""
+        step = 4096  # Compare in slices (memcmp), then bytewise in the last one
+        limit = min(len(old), len(new))
+        start = 0
+        while (
+            start + step <= limit
+            and old[start : start + step] == new[start : start + step]
+        ):
+            start += step
+        while start < limit and old[start] == new[start]:
+            start += 1
+        suffix = 0
+        limit -= start
+        while suffix + step <= limit and (
+            old[len(old) - suffix - step : len(old) - suffix]
+            == new[len(new) - suffix - step : len(new) - suffix]
+        ):
+            suffix += step
+        while suffix < limit and old[-1 - suffix] == new[-1 - suffix]:
+            suffix += 1
+        old_end = len(old) - suffix
+        new_end = len(new) - suffix
+
+        def point(data: bytes, offset: int) -> Tuple[int, int]:
+            row = data.count(b"\n", 0, offset)
+            return row, offset - (data.rfind(b"\n", 0, offset) + 1)
+
+        tree.edit(
+            start_byte=start,
+            old_end_byte=old_end,
+            new_end_byte=new_end,
+            start_point=point(old, start),
+            old_end_point=point(old, old_end),
+            new_end_point=point(new, new_end),
+        )
+
+    def _parse_and_extract(
+        self, src: SourceBuffer, parser_type: str, old_tree=None
+    ) -> Tuple[List[OutlineLine], Optional[object]]:
+        """Parse (reusing old_tree when given) and build the outline."""
+        tree = None
         try:
-            source_bytes = bytes(content, "utf8")
             parser = self.parsers[parser_type]
-            tree = parser.parse(source_bytes)
-
-            if parser_type not in self.queries:
-                return self._fallback_extract(content, parser_type)
-
-            query = self.queries[parser_type]
-            query_cursor = QueryCursor(query)
-
-            # Use NEW API: captures() returns dict[str, list[Node]]
-            captures = query_cursor.captures(tree.root_node)
-
-            # Collect all nodes with their positions for sorting
-            all_nodes = []
-
-            if "import" in captures:
-                for node in captures["import"]:
-                    all_nodes.append(("import", node))
-
-            if "export" in captures:
-                for node in captures["export"]:
-                    all_nodes.append(("export", node))
-
-            if "function" in captures:
-                for node in captures["function"]:
-                    all_nodes.append(("function", node))
-
-            if "class" in captures:
-                for node in captures["class"]:
-                    all_nodes.append(("class", node))
-
-            # Sort by starting position to maintain source order
-            all_nodes.sort(key=lambda x: x[1].start_byte)
-
-            result = []
-            lines = content.split("\n")
-            last_import_idx = -1
-
-            for idx, (node_type, node) in enumerate(all_nodes):
-                if node_type == "import":
-                    start_line = node.start_point[0]
-                    end_line = node.end_point[0]
-                    for i in range(start_line, end_line + 1):
-                        if i < len(lines):
-                            result.append(lines[i])
-                    last_import_idx = idx
-
-                elif node_type == "export":
-                    # Add blank line after imports if this is first non-import
-                    if last_import_idx == idx - 1:
-                        result.append("")
-                    start_line = node.start_point[0]
-                    if start_line < len(lines):
-                        result.append(lines[start_line])
-
-                elif node_type == "function":
-                    # Add blank line after imports if this is first non-import
-                    if last_import_idx == idx - 1:
-                        result.append("")
-                    if parser_type == "python":
-                        result.append(self._extract_function_python(node, lines))
-                    else:
-                        result.append(self._extract_function_js(node, source_bytes))
-
-                elif node_type == "class":
-                    # Add blank line after imports if this is first non-import
-                    if last_import_idx == idx - 1:
-                        result.append("")
-                    if parser_type == "python":
-                        result.append(self._extract_class_python(node, lines))
-                    else:
-                        result.append(self._extract_class_js(node, source_bytes))
+            if old_tree is None:
+                tree = parser.parse(src.data)
+            else:
+                tree = parser.parse(src.data, old_tree)
 
-            return (
-                "\n".join(result)
-                if result
-                else self._fallback_extract(content, parser_type)
-            )
+            if parser_type == "python":
+                result = self._extract_python(tree.root_node, src)
+            else:
+                result = self._extract_js(tree.root_node, src)
+
+            if not result:
+                return self._outline_fallback(src, parser_type), tree
+            return result, tree
 
         except Exception as e:
             print(f"Warning: Tree-sitter extraction failed: {e}", file=sys.stderr)
-            return self._fallback_extract(content, parser_type)
+            return self._outline_fallback(src, parser_type), None
+
+    def _outline_fallback(self, src: SourceBuffer, ext: str) -> List[OutlineLine]:
+        return Outline.from_text(self._fallback_extract(src.decode(), ext))
+
+    def _python_members(self, node) -> Iterator:
+        """Yield the imports and definitions of one Python scope, in order.
+
+        Conditional blocks (if/try/with/...) are looked through; function and
+        class bodies are not, so each definition is reached exactly once.
+        """
+        for child in node.children:
+            self.nodes_visited += 1
+            if child.type in self.PYTHON_MEMBERS:
+                yield child
+            elif child.type in self.PYTHON_BLOCKS:
+                yield from self._python_members(child)
+
+    def _extract_python(self, root, src: SourceBuffer) -> List[OutlineLine]:
+        """Build outline lines for a module in one scope-aware walk."""
+        result = []
+        after_import = False
+        for node in self._python_members(root):
+            if node.type in self.PYTHON_IMPORTS:
+                result.extend(
+                    OutlineLine(Outline.IMPORT, line) for line in self._lines(node, src)
+                )
+                after_import = True
+                continue
+            # Add blank line after imports if this is first non-import
+            if after_import:
+                result.append(OutlineLine(Outline.BLANK, ""))
+                after_import = False
+            result.extend(self._extract_definition_python(node, src))
+        return result
+
+    def _extract_definition_python(
+        self, node, src: SourceBuffer
+    ) -> List[OutlineLine]:
+        """Extract a (possibly decorated) Python function or class."""
+        result = []
+        if node.type == "decorated_definition":
+            for child in node.children:
+                if child.type == "decorator":
+                    result.extend(
+                        OutlineLine(Outline.HEADER, line)
+                        for line in self._lines(child, src)
+                    )
+            node = node.child_by_field_name("definition")
+        if node.type == "class_definition":
+            result.extend(self._extract_class_python(node, src))
+        else:
+            result.extend(self._extract_function_python(node, src))
+        return result
 
-    def _extract_function_python(self, func_node, lines: List[str]) -> str:
+    def _extract_function_python(
+        self, func_node, src: SourceBuffer
+    ) -> List[OutlineLine]:
         """Extract Python function signature and docstring."""
-        result = []
+        keyword = "async def" if func_node.children[0].type == "async" else "def"
+        name = f"{keyword} {self._name(func_node, src)}"
 
         # Extract signature (may span multiple lines)
         body_node = func_node.child_by_field_name("body")
         if not body_node:
-            return lines[func_node.start_point[0]]  # Fallback
-
-        signature_end_line = body_node.start_point[0]
-        for i in range(func_node.start_point[0], signature_end_line):
-            result.append(lines[i])
-
-        # Add the line with colon
-        last_sig_line = lines[signature_end_line]
-        colon_pos = last_sig_line.find(":")
-        if colon_pos != -1:
-            result.append(last_sig_line[: colon_pos + 1])
-
-        # Extract docstring if present
-        if body_node.child_count > 0:
-            first_child = body_node.children[0]
-            if (
-                first_child.type == "expression_statement"
-                and first_child.child_count > 0
-                and first_child.children[0].type == "string"
-            ):
-                docstring_node = first_child.children[0]
-                doc_start = docstring_node.start_point[0]
-                doc_end = docstring_node.end_point[0]
-                for i in range(doc_start, doc_end + 1):
-                    if i < len(lines):
-                        result.append(lines[i])
-
-        result.append("    # [Implementation hidden]\n")
-        return "\n".join(result)
-
-    def _extract_function_js(self, func_node, source_bytes: bytes) -> str:
-        """Extract JS/TS function signature."""
+            # Fallback
+            return [OutlineLine(Outline.DEF, src.line(func_node.start_point[0]), name)]
+
+        result = self._definition(
+            self._signature_python(func_node, src), name, stub=" ..."
+        )
+        result.extend(self._docstring_python(body_node, src))
+
+        if self.nested_defs:
+            for member in self._python_members(body_node):
+                if member.type in self.PYTHON_DEFINITIONS:
+                    result.extend(self._extract_definition_python(member, src))
+
+        result.append(OutlineLine(Outline.BODY, "    # [Implementation hidden]\n"))
+        return result
+
+    def _docstring_python(self, body_node, src: SourceBuffer) -> List[OutlineLine]:
+        """The docstring opening a function or class body, if any."""
+        if body_node.child_count == 0:
+            return []
+        first_child = body_node.children[0]
+        if not (
+            first_child.type == "expression_statement"
+            and first_child.child_count > 0
+            and first_child.children[0].type == "string"
+        ):
+            return []
+        lines = self._lines(first_child.children[0], src)
+        return [OutlineLine(Outline.DOC, lines[0])] + [
+            OutlineLine(Outline.DOC_MORE, line) for line in lines[1:]
+        ]
+
+    def _extract_js(
+        self, node, src: SourceBuffer, nested: bool = False
+    ) -> List[OutlineLine]:
+        """Build outline lines for one JS/TS scope in a single walk.
+
+        Only the scope's own statements are examined: imports, exports,
+        declared functions and classes, and top-level bindings (named
+        function values as signatures). Callbacks and other expressions are
+        never entered. ``nested`` walks a function body for --nested-defs,
+        keeping just its function and class definitions.
+        """
+        result = []
+        after_import = False
+        for child in node.children:
+            self.nodes_visited += 1
+            kind = child.type
+            entry = None
+            if kind == "import_statement":
+                if not nested:
+                    result.extend(
+                        OutlineLine(Outline.IMPORT, line)
+                        for line in self._lines(child, src)
+                    )
+                    after_import = True
+                continue
+            elif kind == "export_statement":
+                entry = self._extract_export_js(child, src)
+            elif kind in self.JS_FUNCTIONS:
+                entry = self._extract_function_js(child, src)
+            elif kind in self.JS_CLASSES:
+                entry = self._extract_class_js(child, src)
+            elif kind in self.JS_DECLARATIONS:
+                entry = self._extract_declaration_js(child, src, bindings=not nested)
+            elif kind in self.TS_DECLARATIONS and not nested:
+                entry = [self._type_line(child, src)]
+            elif kind == "expression_statement" and not nested:
+                # Look through a module wrapped in an IIFE, like a block
+                body = self._iife_body(child)
+                if body is not None:
+                    result.extend(self._extract_js(body, src))
+                continue
+            if entry is None:
+                continue
+            # Add blank line after imports if this is first non-import
+            if after_import:
+                result.append(OutlineLine(Outline.BLANK, ""))
+                after_import = False
+            result.extend(entry)
+        return result
+
+    def _iife_body(self, node):
+        """The body of an immediately invoked function expression, or None.
+
+        Accepts ``(function () {...})()``, ``(function () {...}())`` and
+        ``!function () {...}()`` as bundlers and minifiers emit them.
+        """
+        while node.type in ("expression_statement", "parenthesized_expression") or (
+            node.type == "unary_expression"
+        ):
+            if not node.named_child_count:
+                return None
+            node = node.named_children[-1]
+        if node.type != "call_expression":
+            return None
+        function = node.child_by_field_name("function")
+        while function is not None and function.type == "parenthesized_expression":
+            inner = function.named_children
+            function = inner[0] if inner else None
+        if function is None or function.type not in self.JS_FUNCTION_VALUES:
+            return None
+        body = function.child_by_field_name("body")
+        return body if body is not None and body.type == "statement_block" else None
+
+    def _extract_export_js(self, export_node, src: SourceBuffer) -> List[OutlineLine]:
+        """Extract an export statement, expanding exported definitions."""
+        start = export_node.start_byte
+        for field_name in ("declaration", "value"):
+            node = export_node.child_by_field_name(field_name)
+            if node is None:
+                continue
+            if node.type in self.JS_FUNCTIONS or node.type in self.JS_FUNCTION_VALUES:
+                return self._extract_function_js(node, src, start)
+            if node.type in self.JS_CLASSES:
+                return self._extract_class_js(node, src, start)
+            if node.type in self.JS_DECLARATIONS:
+                return self._extract_declaration_js(node, src, start)
+            if node.type in self.TS_DECLARATIONS:
+                return [self._type_line(node, src, start)]
+        # Re-exports and exported expressions
+        return [OutlineLine(Outline.OTHER, self._first_line(export_node, src))]
+
+    def _extract_declaration_js(
+        self, decl_node, src: SourceBuffer, start: Optional[int] = None, bindings=True
+    ) -> Optional[List[OutlineLine]]:
+        """Extract a const/let/var declaration.
+
+        Function and class values become signatures; any other binding is
+        shown by its first line, or dropped when ``bindings`` is False. When
+        a declaration binds several variables, each is shown on its own,
+        behind the declaration's keyword (and ``export``).
+        """
+        start = decl_node.start_byte if start is None else start
+        declarators = [
+            child for child in decl_node.children if child.type == "variable_declarator"
+        ]
+        prefix = src.text(start, declarators[0].start_byte) if declarators else ""
+        entries = []
+        values = []  # Plain bindings, shown only beside a function or class
+        for declarator in declarators:
+            value = declarator.child_by_field_name("value")
+            name = self._name(declarator, src)
+            begin = declarator.start_byte
+            if value is not None and value.type in self.JS_FUNCTION_VALUES:
+                lines = self._extract_function_js(value, src, begin, name)
+            elif value is not None and value.type in self.JS_CLASSES:
+                lines = self._extract_class_js(value, src, begin, name)
+            else:
+                if bindings:
+                    line = prefix + self._first_line(declarator, src)
+                    values.append(OutlineLine(Outline.OTHER, line))
+                continue
+            entries.extend(values)
+            values = []
+            entries.append(lines[0]._replace(text=prefix + lines[0].text))
+            entries.extend(lines[1:])
+        if entries:
+            return entries + values
+        if bindings:
+            return [OutlineLine(Outline.OTHER, self._first_line(decl_node, src, start))]
+        return None
+
+    def _extract_function_js(
+        self,
+        func_node,
+        src: SourceBuffer,
+        start: Optional[int] = None,
+        name: Optional[str] = None,
+    ) -> List[OutlineLine]:
+        """Extract JS/TS function signature.
+
+        ``start`` extends the signature back over an enclosing export or
+        binding (``export const name = ``); by default it is the node itself.
+        ``name`` is the binding's name for function values.
+        """
+        start = func_node.start_byte if start is None else start
+        name = f"function {name or self._name(func_node, src) or '(anonymous)'}"
         body_node = func_node.child_by_field_name("body")
         if body_node:
             # Extract from start to body start
-            signature = (
-                source_bytes[func_node.start_byte : body_node.start_byte]
-                .decode("utf8", errors="ignore")
-                .rstrip()
-            )
+            signature = src.text(start, body_node.start_byte).rstrip()
             if not signature.endswith("{"):
                 signature += " {"
-            return signature + "\n    // [Implementation hidden]\n}\n"
+            result = [OutlineLine(Outline.DEF, signature, name, stub=" ... }")]
+            if self.nested_defs and body_node.type == "statement_block":
+                result.extend(self._extract_js(body_node, src, True))
+            result.append(OutlineLine(Outline.BODY, "    // [Implementation hidden]"))
+            result.append(OutlineLine(Outline.BODY, "}\n"))
+            return result
         else:
             # Arrow function or other
-            first_line = func_node.text.decode("utf8", errors="ignore").split("\n")[0]
-            return first_line + " // [Implementation hidden]\n"
+            first_line = self._first_line(func_node, src, start)
+            hidden = " // [Implementation hidden]\n"
+            return [OutlineLine(Outline.DEF, first_line, name, suffix=hidden)]
 
-    def _extract_class_python(self, class_node, lines: List[str]) -> str:
+    def _extract_class_python(
+        self, class_node, src: SourceBuffer
+    ) -> List[OutlineLine]:
         """Extract Python class definition with method signatures."""
-        result = []
-
         # Class signature
-        result.append(lines[class_node.start_point[0]])
+        name = f"class {self._name(class_node, src)}"
+        result = self._definition(self._signature_python(class_node, src), name)
 
         # Look for docstring and methods
         body_node = class_node.child_by_field_name("body")
         if body_node and body_node.child_count > 0:
-            first_child = body_node.children[0]
-
             # Extract class docstring if present
-            if (
-                first_child.type == "expression_statement"
-                and first_child.child_count > 0
-                and first_child.children[0].type == "string"
-            ):
-                docstring_node = first_child.children[0]
-                doc_start = docstring_node.start_point[0]
-                doc_end = docstring_node.end_point[0]
-                for i in range(doc_start, doc_end + 1):
-                    if i < len(lines):
-                        result.append(lines[i])
-                result.append("")  # Blank line after docstring
-
-            # Extract method signatures
+            docstring = self._docstring_python(body_node, src)
+            if docstring:
+                result.extend(docstring)
+                # Blank line after docstring, shown and hidden with it
+                result.append(OutlineLine(Outline.DOC, ""))
+
+            # Extract method (and nested class) signatures, decorators included
             methods_found = False
-            for child in body_node.children:
-                if child.type == "function_definition":
+            for member in self._python_members(body_node):
+                if member.type in self.PYTHON_DEFINITIONS:
                     methods_found = True
-                    method_sig = self._extract_function_python(child, lines)
-                    # Add proper indentation - methods should already be indented
-                    result.append(method_sig)
+                    # Members are already indented in the source lines
+                    result.extend(self._extract_definition_python(member, src))
 
             if not methods_found:
-                result.append("    # [No methods defined]\n")
-
-        return "\n".join(result)
-
-    def _extract_class_js(self, class_node, source_bytes: bytes) -> str:
-        """Extract JS/TS class definition with method signatures."""
+                result.append(OutlineLine(Outline.BODY, "    # [No methods defined]\n"))
+
+        return result
+
+    def _extract_class_js(
+        self,
+        class_node,
+        src: SourceBuffer,
+        start: Optional[int] = None,
+        name: Optional[str] = None,
+    ) -> List[OutlineLine]:
+        """Extract JS/TS class definition with member signatures."""
+        start = class_node.start_byte if start is None else start
+        name = f"class {name or self._name(class_node, src) or '(anonymous)'}"
         result = []
 
         # Class signature
         body_node = class_node.child_by_field_name("body")
         if body_node:
-            signature = (
-                source_bytes[class_node.start_byte : body_node.start_byte]
-                .decode("utf8", errors="ignore")
-                .rstrip()
-            )
+            signature = src.text(start, body_node.start_byte).rstrip()
             if not signature.endswith("{"):
                 signature += " {"
-            result.append(signature)
+            result.append(OutlineLine(Outline.DEF, signature, name))
 
-            # Extract method signatures from class body
+            # Extract member signatures from class body
             methods_found = False
             for child in body_node.children:
-                if child.type in ("method_definition", "field_definition"):
-                    methods_found = True
-                    # Get the method signature
-                    method_text = child.text.decode("utf8", errors="ignore")
-                    method_lines = method_text.split("\n")
-
-                    # Extract signature (first line, possibly with params on multiple lines)
-                    sig_lines = []
-                    brace_count = 0
-                    for line in method_lines:
-                        sig_lines.append(line)
-                        if "{" in line:
-                            brace_count += line.count("{")
-                            break
-
-                    signature_text = "\n".join(sig_lines)
-                    if "{" in signature_text:
-                        signature_text = signature_text.split("{")[0].rstrip() + " {"
+                if child.type not in self.JS_MEMBERS:
+                    continue
+                methods_found = True
+                method_body = child.child_by_field_name("body")
+                value = child.child_by_field_name("value")
+                if value is not None and value.type in self.JS_FUNCTION_VALUES:
+                    method_body = value.child_by_field_name("body")  # handler = () => {
+                if method_body is None or method_body.type != "statement_block":
+                    # Plain field, abstract method or overload: one line
+                    line = "    " + self._first_line(child, src)
+                    result.append(OutlineLine(Outline.OTHER, line))
+                    continue
 
-                    result.append("    " + signature_text)
-                    result.append("        // [Implementation hidden]")
-                    result.append("    }")
-                    result.append("")  # Blank line between methods
+                # The body itself is never decoded
+                signature_text = src.text(child.start_byte, method_body.start_byte)
+                result.append(
+                    OutlineLine(
+                        Outline.DEF,
+                        "    " + signature_text.rstrip() + " {",
+                        f"method {self._name(child, src)}",
+                        stub=" ... }",
+                    )
+                )
+                result.append(
+                    OutlineLine(Outline.BODY, "        // [Implementation hidden]")
+                )
+                result.append(OutlineLine(Outline.BODY, "    }"))
+                # Blank line between methods, left out with the bodies
+                result.append(OutlineLine(Outline.BODY, ""))
 
             if not methods_found:
-                result.append("    // [No methods defined]")
+                result.append(OutlineLine(Outline.BODY, "    // [No methods defined]"))
 
-            result.append("}\n")
-            return "\n".join(result)
+            result.append(OutlineLine(Outline.CLOSE, "}\n"))
+            return result
         else:
-            return class_node.text.decode("utf8", errors="ignore").split("\n")[0] + "\n"
+            line = self._first_line(class_node, src, start) + "\n"
+            return [OutlineLine(Outline.DEF, line, name)]
+
+    @classmethod
+    def _signature_python(cls, node, src: SourceBuffer) -> List[str]:
+        """The lines of a def/class header, cut after its closing colon."""
+        colon = next((c for c in node.children if c.type == ":"), None)
+        if colon is None:
+            return [src.line(node.start_point[0])]
+        row = colon.end_point[0]
+        lines = [src.line(i) for i in range(node.start_point[0], row)]
+        lines.append(src.text(src.line_starts[row], colon.end_byte))
+        return lines
+
+    @staticmethod
+    def _definition(
+        lines: List[str], name: str, stub: str = ""
+    ) -> List[OutlineLine]:
+        """Outline lines for a signature; ``stub`` goes after its last line."""
+        result = [OutlineLine(Outline.DEF, lines[0], name)]
+        result.extend(OutlineLine(Outline.HEADER, line) for line in lines[1:])
+        result[-1] = result[-1]._replace(stub=stub)
+        return result
+
+    @staticmethod
+    def _name(node, src: SourceBuffer) -> str:
+        """The text of a node's name (or property) field, if it has one."""
+        for field_name in ("name", "property"):
+            name = node.child_by_field_name(field_name)
+            if name is not None:
+                return src.text(name.start_byte, name.end_byte)
+        return ""
+
+    def _type_line(
+        self, node, src: SourceBuffer, start: Optional[int] = None
+    ) -> OutlineLine:
+        """A TypeScript declaration (interface, type, enum, ...): its first line."""
+        line = self._first_line(node, src, start)
+        keyword = self.TS_KEYWORDS.get(node.type)
+        name = self._name(node, src)
+        if keyword is None or not name:
+            return OutlineLine(Outline.OTHER, line)
+        return OutlineLine(Outline.DEF, line, f"{keyword} {name}")
+
+    @staticmethod
+    def _lines(node, src: SourceBuffer) -> List[str]:
+        """The full source lines a node spans."""
+        end = min(node.end_point[0] + 1, src.line_count)
+        return [src.line(i) for i in range(node.start_point[0], end)]
+
+    @classmethod
+    def _first_line(cls, node, src: SourceBuffer, start: Optional[int] = None) -> str:
+        """Decode a node's text (from start, if given) to the end of its first line.
+
+        Lines longer than FIRST_LINE_LIMIT (minified code) are cut short.
+        """
+        start = node.start_byte if start is None else start
+        end = src.data.find(b"\n", start, node.end_byte)
+        end = node.end_byte if end == -1 else end
+        if end - start > cls.FIRST_LINE_LIMIT:
+            return src.text(start, start + cls.FIRST_LINE_LIMIT) + " …"
+        return src.text(start, end).rstrip("\r")
 
     def _fallback_extract(self, content: str, ext: str = "") -> str:
         """AGGRESSIVE fallback extraction - signatures only."""
@@ -759,196 +2765,2259 @@ class CodeExtractor:
         return "\n".join(result)
 
 
+class SkeletonCache:
+    """Persistent on-disk cache of skeletons and their token counts.
+
+    Entries are content-addressed: the key hashes the source bytes, the file
+    extension and a fingerprint of everything else the skeleton depends on
+    (extractor version, available parsers, tokenizer). A stat key built from
+    path, size and mtime, or from the git blob id when the index vouches for
+    the file, points at the content key, so unchanged files are not read at
+    all.
+
+    Files are written to a temporary name and renamed into place, so
+    concurrent runs can share a directory. Hits refresh an entry's mtime,
+    and the least recently used entries are evicted once the directory
+    outgrows ``max_bytes``.
+    """
+
+    FORMAT = 2  # Entries hold outlines since version 2
+
+    def __init__(self, directory, max_bytes: int, fingerprint: str):
+        self.directory = Path(directory) / f"v{self.FORMAT}"
+        self.max_bytes = max_bytes
+        self.fingerprint = fingerprint
+        self.writes = 0
+
+    @staticmethod
+    def default_dir() -> Path:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+        return Path(base) / "codebase-skeleton"
+
+    def _hash(self, *parts) -> str:
+        digest = hashlib.sha256(self.fingerprint.encode("utf-8"))
+        for part in parts:
+            digest.update(b"\0")
+            if isinstance(part, str):
+                part = part.encode("utf-8", errors="surrogateescape")
+            digest.update(part)
+        return digest.hexdigest()
+
+    def stat_key(
+        self, path: Path, size: int, mtime: float, change_key: Optional[str] = None
+    ) -> str:
+        """Key for a file's identity without reading it.
+
+        A ``change_key`` names the content itself, so the key holds across
+        paths and mtimes; the suffix stays in, as it selects the parser.
+        """
+        if change_key:
+            return self._hash("change", path.suffix.lower(), change_key)
+        return self._hash("stat", str(path), str(size), repr(mtime))
+
+    def content_key(self, suffix: str, data) -> str:
+        """Key for source bytes (``bytes`` or ``mmap``) of a given file type."""
+        return self._hash("content", suffix.lower(), data)
+
+    def _path(self, kind: str, key: str) -> Path:
+        return self.directory / kind / key[:2] / key[2:]
+
+    def get(self, content_key: str) -> Optional[dict]:
+        """Load an entry and mark it as recently used."""
+        path = self._path("objects", content_key)
+        try:
+            record = json.loads(path.read_bytes())
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return record if isinstance(record, dict) else None
+
+    def lookup(self, stat_key: str) -> Optional[dict]:
+        """Follow a stat key to its entry without touching the source file."""
+        try:
+            content_key = self._path("refs", stat_key).read_text("ascii")
+        except (OSError, ValueError):
+            return None
+        return self.get(content_key.strip())
+
+    def put(self, content_key: str, record: dict):
+        self._write(
+            self._path("objects", content_key),
+            json.dumps(record, ensure_ascii=False).encode("utf-8"),
+        )
+
+    def link(self, stat_key: str, content_key: str):
+        self._write(self._path("refs", stat_key), content_key.encode("ascii"))
+
+    def _write(self, path: Path, data: bytes):
+        """Write atomically; the cache never fails a run."""
+        tmp = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self.writes += 1
+        except OSError:
+            if tmp is not None:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+    def evict(self):
+        """Drop least recently used files until the cache is under 90% of its cap."""
+        if not self.writes:
+            return
+        files = []
+        total = 0
+        for kind in ("objects", "refs"):
+            try:
+                shards = list(os.scandir(self.directory / kind))
+            except OSError:
+                continue
+            for shard in shards:
+                try:
+                    entries = list(os.scandir(shard.path))
+                except OSError:
+                    continue
+                for entry in entries:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        for _mtime, size, path in sorted(files):
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= target:
+                break
+
+
+class FileTask(NamedTuple):
+    """One file to process, as handed to ``FileProcessor.process``."""
+
+    path: Path
+    size: int
+    mtime: float
+    full: bool
+    change_key: Optional[str] = None  # SnapshotEntry.change_key, if known
+
+
+@dataclass
+class FileResult:
+    """Outcome of processing one file, merged back in path order."""
+
+    kind: str  # "full", "skeleton", "binary" or "error"
+    text: str = ""  # Full content or skeleton
+    loc: int = 0
+    truncated: Optional[Tuple[int, int]] = None  # (bytes read, file size)
+    error: Optional[str] = None
+    tokens: Optional[int] = None  # Known token count (from the cache)
+    outline: Optional[list] = None  # Skeleton lines (or cached rows), for demotion
+    token_margin: Optional[int] = None  # ~95% error when tokens is an estimate
+    cached: bool = False
+    stat_key: Optional[str] = None  # Cache keys to record the result under
+    content_key: Optional[str] = None
+
+
+class FileProcessor:
+    """Sniffs, reads and extracts a single file: the unit of work for --jobs.
+
+    Holds its own CodeExtractor, since Tree-sitter parsers cannot be shared
+    between threads or processes.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        extractor: Optional[CodeExtractor] = None,
+        cache: Optional[SkeletonCache] = None,
+    ):
+        self.config = config
+        self.sniffer = ContentSniffer(config)
+        self.extractor = (
+            extractor if extractor is not None else CodeExtractor(config)
+        )
+        self.cache = cache
+        # Watch mode: path -> (source, Tree) of the last parse, for reparsing
+        self.trees: Optional[Dict[Path, Tuple[bytes, object]]] = None
+
+    def process(
+        self,
+        path: Path,
+        size: int,
+        mtime: float,
+        full: bool,
+        change_key: Optional[str] = None,
+    ) -> FileResult:
+        """Produce the full content or skeleton of one file.
+
+        With a ``change_key`` (a git blob id the index vouches for), cached
+        results are found by content identity instead of path and mtime, so
+        they survive fresh clones and checkouts.
+        """
+        # Binary files stay in the tree but are never read or tokenized
+        if self.sniffer.is_binary(path):
+            return FileResult("binary")
+
+        limit = self._read_limit(path, full)
+        # Only whole-file skeletons are cached; head-only reads are cheap
+        cache = None if full or (limit and size > limit) else self.cache
+        stat_key = None
+        if cache is not None:
+            stat_key = cache.stat_key(path, size, mtime, change_key)
+            record = cache.lookup(stat_key)
+            if record is not None:
+                return self._cached(record)
+
+        truncated = None
+        try:
+            if limit and size > limit:
+                content, loc = self._read_head(path, limit)
+                truncated = (len(content.encode("utf-8")), size)
+            elif not full and self.extractor.parses(path):
+                # Parsed straight from bytes; the source is never decoded whole
+                with self.extractor.open_source(path, size) as data:
+                    loc = _count_lines(data)
+                    content_key = None
+                    if cache is not None:
+                        content_key = cache.content_key(path.suffix, data)
+                        record = cache.get(content_key)
+                        if record is not None:
+                            return self._cached(record, stat_key, content_key)
+                    if self.trees is not None:
+                        outline, self.trees[path] = (
+                            self.extractor.extract_incremental(
+                                path, bytes(data), self.trees.get(path)
+                            )
+                        )
+                    else:
+                        outline = self.extractor.extract_outline(path, data)
+                return FileResult(
+                    "skeleton",
+                    Outline.render(outline),
+                    loc,
+                    outline=outline,
+                    stat_key=stat_key,
+                    content_key=content_key,
+                )
+            else:
+                content = path.read_text(encoding="utf-8", errors="ignore")
+                loc = content.count("\n") + 1
+        except Exception as e:
+            return FileResult("error", error=str(e))
+
+        if full:
+            return FileResult("full", content, loc, truncated)
+        content_key = None
+        if cache is not None:
+            content_key = cache.content_key(path.suffix, content)
+            record = cache.get(content_key)
+            if record is not None:
+                return self._cached(record, stat_key, content_key)
+        outline = self.extractor.extract_outline(path, content)
+        return FileResult(
+            "skeleton",
+            Outline.render(outline),
+            loc,
+            truncated,
+            outline=outline,
+            stat_key=stat_key,
+            content_key=content_key,
+        )
+
+    @staticmethod
+    def _cached(
+        record: dict, stat_key: Optional[str] = None, content_key: Optional[str] = None
+    ) -> FileResult:
+        """Result for a cache hit; keys are set when a stat key needs linking."""
+        return FileResult(
+            "skeleton",
+            record["skeleton"],
+            record["loc"],
+            tokens=record.get("tokens"),
+            outline=record.get("outline"),
+            cached=True,
+            stat_key=stat_key,
+            content_key=content_key,
+        )
+
+    def _read_limit(self, path: Path, full: bool) -> int:
+        """Byte budget for reading a file (0 = unlimited)."""
+        return self.config.read_limit(path.suffix, full)
+
+    @staticmethod
+    def _read_head(path: Path, limit: int) -> Tuple[str, int]:
+        """Decode the first ``limit`` bytes and count lines over the whole file.
+
+        The remainder is streamed in fixed-size chunks, so memory stays
+        bounded whatever the file size. The partial last line is dropped.
+        """
+        with open(path, "rb") as f:
+            head = f.read(limit)
+            newlines = head.count(b"\n")
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                newlines += chunk.count(b"\n")
+        text = head.decode("utf-8", errors="ignore")
+        cut = text.rfind("\n")
+        if cut > 0:
+            text = text[:cut]
+        return text.replace("\r\n", "\n").replace("\r", "\n"), newlines + 1
+
+
+# Per-worker FileProcessor for --jobs: one per process (set by the pool
+# initializer) or one per thread (created lazily in thread-local storage).
+_worker_processor: Optional[FileProcessor] = None
+_worker_local = threading.local()
+
+
+def _init_process_worker(config: Config, cache: Optional[SkeletonCache]):
+    global _worker_processor
+    _worker_processor = FileProcessor(config, cache=cache)
+
+
+def _process_in_worker(tasks: List[FileTask]) -> List[FileResult]:
+    return [_worker_processor.process(*task) for task in tasks]
+
+
+def _process_in_thread(
+    config: Config,
+    cache: Optional[SkeletonCache],
+    tasks: List[FileTask],
+) -> List[FileResult]:
+    processor = getattr(_worker_local, "processor", None)
+    if processor is None:
+        processor = _worker_local.processor = FileProcessor(config, cache=cache)
+    return [processor.process(*task) for task in tasks]
+
+
+@dataclass
+class BudgetItem:
+    """A file competing for the token budget."""
+
+    rel: str
+    size: int
+    mtime: float
+    full: bool
+    estimate: int = 0  # Tokens for body and tags, from the size until read
+    rank: int = 0  # Position in priority order (0 = kept first)
+    level: int = Outline.DOCSTRINGS  # Skeleton detail, lowered by demote()
+    tokens: Optional[int] = None  # Exact body tokens at ``level``, once counted
+    margin: int = 0  # ~95% error of ``tokens`` when they are estimated
+
+
+class BudgetPlanner:
+    """Chooses the files that fit in ``Config.max_tokens``.
+
+    Files are ranked before anything is read: full-content files (configs,
+    READMEs) first, then entry points, then the rest by directory depth,
+    how recently they changed and size. Sizes give token estimates, so
+    files past the budget are never read or parsed. Once the chosen files
+    are counted, ``demote`` lowers the detail of the lowest-ranked
+    skeletons (see ``Outline``) and ``fit`` drops files until the tree,
+    metadata, tags and omitted list fit as well.
+    """
+
+    ENTRY_POINTS = {
+        "__main__.py",
+        "main.py",
+        "app.py",
+        "cli.py",
+        "manage.py",
+        "wsgi.py",
+        "asgi.py",
+        "index.js",
+        "index.ts",
+        "index.tsx",
+        "main.js",
+        "main.ts",
+        "server.js",
+        "server.ts",
+        "main.go",
+        "main.rs",
+        "lib.rs",
+    }
+    SKELETON_FRACTION = 0.3  # Skeleton tokens per source token, before reading
+    NAMES_FRACTION = 0.03  # The same, for a skeleton demoted to names only
+    TAG_CHARS_PER_TOKEN = 3.0  # <file path='...' ...> is mostly punctuation
+    TAG_CHARS = 40  # Tag text besides the path
+    DETAIL_CHARS = 22  # " detail='signatures'" on demoted files
+    RESERVE = 200  # Header, <stats> and section tags
+    # Score weights for files that are neither configs nor entry points
+    DEPTH_WEIGHT = 1.0
+    AGE_WEIGHT = 2.0  # Oldest file vs. newest
+    SIZE_WEIGHT = 0.5  # Per doubling beyond SIZE_UNIT
+    SIZE_UNIT = 16 * 1024
+    # Detail levels skeletons are demoted through before being dropped
+    LADDER = (Outline.FIRST_LINE, Outline.SIGNATURES, Outline.NAMES)
+    DEMOTE_BATCH = 64  # Files re-rendered and counted at a time
+
+    def __init__(self, config: Config, estimator: TokenEstimator):
+        self.config = config
+        self.budget = config.max_tokens
+        self.estimator = estimator
+        self._kinds: Dict[Tuple[str, bool], Tuple[int, str]] = {}
+
+    def tag_tokens(self, rel: str, demoted: bool = False) -> int:
+        chars = len(rel) + self.TAG_CHARS + (self.DETAIL_CHARS if demoted else 0)
+        return int(chars / self.TAG_CHARS_PER_TOKEN) + 1
+
+    def estimate(self, item: BudgetItem, level: int = Outline.DOCSTRINGS) -> int:
+        """Tokens a file is expected to take at a detail level, from its size."""
+        suffix = os.path.splitext(item.rel)[1]
+        return self.size_estimate(item.rel, suffix, item.size, item.full, level)
+
+    def size_estimate(
+        self,
+        rel: str,
+        suffix: str,
+        size: int,
+        full: bool,
+        level: int = Outline.DOCSTRINGS,
+    ) -> int:
+        """``estimate`` for a path whose suffix is already known."""
+        key = (suffix, full)
+        if key not in self._kinds:
+            limit = self.config.read_limit(suffix, full)
+            self._kinds[key] = (limit, self.estimator.kind(suffix))
+        limit, kind = self._kinds[key]
+        size = min(size, limit) if limit else size
+        # Ratios are looked up each time: calibration may refit them mid-run
+        ratio, _spread = self.estimator.ratios.get(kind, self.estimator.ratios[""])
+        body = size / ratio
+        if full:
+            return int(body) + self.tag_tokens(rel)
+        demoted = level != Outline.DOCSTRINGS
+        body *= self.NAMES_FRACTION if demoted else self.SKELETON_FRACTION
+        return int(body) + self.tag_tokens(rel, demoted)
+
+    def rank(self, items: List[BudgetItem]) -> List[BudgetItem]:
+        """Sort items by priority, highest first, and number them."""
+        by_age = sorted(items, key=lambda item: -item.mtime)
+        age = {item.rel: i / max(1, len(items) - 1) for i, item in enumerate(by_age)}
+
+        def key(item: BudgetItem):
+            name = item.rel.rsplit("/", 1)[-1]
+            tier = 0 if item.full else 1 if name in self.ENTRY_POINTS else 2
+            depth = item.rel.count("/")
+            size = max(0.0, math.log2(max(1, item.size) / self.SIZE_UNIT))
+            score = (
+                depth * self.DEPTH_WEIGHT
+                + age[item.rel] * self.AGE_WEIGHT
+                + size * self.SIZE_WEIGHT
+            )
+            return (tier, score, item.rel)
+
+        ranked = sorted(items, key=key)
+        for index, item in enumerate(ranked):
+            item.rank = index
+        return ranked
+
+    def plan(
+        self, items: List[BudgetItem], overhead: int
+    ) -> Tuple[List[BudgetItem], List[BudgetItem]]:
+        """Split items into (chosen, omitted) using size-based estimates.
+
+        A file is chosen if it fits at the bottom of the detail ladder, so
+        ``demote`` can make room for it. Lower-ranked files that still fit
+        are taken after a larger one is skipped, so one big file does not
+        waste the rest of the budget.
+        """
+        chosen, omitted = [], []
+        used = overhead
+        for item in self.rank(items):
+            item.estimate = self.estimate(item)
+            least = self.estimate(item, self.LADDER[-1])
+            if used + least <= self.budget:
+                chosen.append(item)
+                used += least
+            else:
+                omitted.append(item)
+        return chosen, omitted
+
+    def fit(
+        self,
+        chosen: List[BudgetItem],
+        omitted: List[BudgetItem],
+        overhead: int,
+        omitted_tokens: Callable[[List[BudgetItem]], int],
+    ) -> List[BudgetItem]:
+        """Drop chosen items, lowest rank first, until the output fits.
+
+        ``chosen`` estimates must be exact by now; ``omitted_tokens`` sizes
+        the listing of omitted files, which grows as files are dropped.
+        Returns the dropped items, which are also moved to ``omitted``.
+        """
+        chosen.sort(key=lambda item: item.rank)
+        used = overhead + sum(item.estimate for item in chosen)
+        dropped = []
+        while chosen and used + omitted_tokens(omitted) > self.budget:
+            item = chosen.pop()
+            used -= item.estimate
+            dropped.append(item)
+            omitted.append(item)
+        return dropped
+
+    def demote(
+        self,
+        chosen: List[BudgetItem],
+        omitted: List[BudgetItem],
+        overhead: int,
+        omitted_tokens: Callable[[List[BudgetItem]], int],
+        cost: Callable[[List[BudgetItem], int], List[TokenEstimate]],
+    ) -> List[BudgetItem]:
+        """Lower the detail of chosen skeletons until the output fits.
+
+        Skeletons are demoted lowest rank first, each to the bottom of
+        ``LADDER`` except the last one needed, which keeps the most detail
+        that fits; detail never rises as rank falls. ``cost(items, level)``
+        gives the items' body tokens at a level, with the margin of any
+        estimate. Whatever still does
+        not fit is dropped by ``fit``, full-content files included; returns
+        the dropped items.
+        """
+        chosen.sort(key=lambda item: item.rank)
+        used = overhead + sum(item.estimate for item in chosen)
+        budget = self.budget - omitted_tokens(omitted)
+        floor = self.LADDER[-1]
+        queue = [item for item in reversed(chosen) if not item.full]
+        for start in range(0, len(queue), self.DEMOTE_BATCH):
+            if used <= budget:
+                break
+            batch = queue[start : start + self.DEMOTE_BATCH]
+            for item, body in zip(batch, cost(batch, floor)):
+                if used <= budget:
+                    break
+                room = budget - used + item.estimate
+                level = floor
+                if self._tagged(item, body.tokens) <= room:
+                    # The last file demoted keeps the most detail that fits
+                    for gentler in self.LADDER[:-1]:
+                        gentle = cost([item], gentler)[0]
+                        if self._tagged(item, gentle.tokens) <= room:
+                            level, body = gentler, gentle
+                            break
+                estimate = self._tagged(item, body.tokens)
+                used += estimate - item.estimate
+                item.estimate, item.level = estimate, level
+                item.tokens, item.margin = body.tokens, body.margin
+        return self.fit(chosen, omitted, overhead, omitted_tokens)
+
+    def _tagged(self, item: BudgetItem, tokens: int) -> int:
+        return tokens + self.tag_tokens(item.rel, demoted=True)
+
+
+@dataclass
+class Shard:
+    """One output file of a sharded run."""
+
+    paths: List[str]  # Files in the shard, in output order
+    tokens: int  # Header and files, as planned
+    text: str = ""
+
+
+class ShardPacker:
+    """Packs files into shards of at most ``capacity`` tokens.
+
+    Files stay with their directory. A directory whose files fit in one
+    shard is a single unit; a larger one is split into its own files, in
+    runs that fit, and its subdirectories, recursively. Units are packed
+    first-fit in path order, so a directory is only split when it has to
+    be, siblings tend to share a shard and the shard count stays close to
+    the minimum. A file larger than ``capacity`` gets a shard of its own.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+
+    @classmethod
+    def for_count(cls, costs: Dict[str, int], count: int) -> "ShardPacker":
+        """The packer with the least capacity that needs at most ``count`` shards."""
+        total = sum(costs.values())
+        low, high = max(1, -(-total // count)), max(1, total)
+        while low < high:
+            middle = (low + high) // 2
+            if len(cls(middle).pack(costs)) <= count:
+                high = middle
+            else:
+                low = middle + 1
+        return cls(high)
+
+    def units(
+        self, rels: List[str], costs: Dict[str, int], depth: int = 0
+    ) -> Iterator[List[str]]:
+        """Split the path-sorted files of one directory into units that fit."""
+        if sum(costs[rel] for rel in rels) <= self.capacity:
+            yield rels
+            return
+        subdirs: Dict[str, List[str]] = {}
+        run, used = [], 0
+        for rel in rels:
+            if rel.count("/") > depth:
+                subdirs.setdefault(rel.split("/")[depth], []).append(rel)
+                continue
+            if run and used + costs[rel] > self.capacity:
+                yield run
+                run, used = [], 0
+            run.append(rel)
+            used += costs[rel]
+        if run:
+            yield run
+        for subdir in subdirs.values():
+            yield from self.units(subdir, costs, depth + 1)
+
+    def pack(self, costs: Dict[str, int]) -> List[List[str]]:
+        """Assign files, given their token costs, to shards."""
+        shards: List[List[str]] = []
+        room: List[int] = []
+        rels = sorted(costs, key=lambda rel: rel.split("/"))
+        for unit in self.units(rels, costs):
+            cost = sum(costs[rel] for rel in unit)
+            index = next((i for i, left in enumerate(room) if cost <= left), None)
+            if index is None:
+                index = len(shards)
+                shards.append([])
+                room.append(self.capacity)
+            shards[index].extend(unit)
+            room[index] -= cost
+        return shards
+
+
 class SkeletonGenerator:
     """Main skeleton generator."""
 
     def __init__(self, root_path: Path, config: Config):
         self.root = root_path
         self.config = config
-        self.token_counter = TokenCounter()
-        self.extractor = CodeExtractor()
+        self.token_counter = TokenCounter(
+            config.tokenizer_file, config.tokenizer_cache, config.tokenizer_timeout
+        )
+        self.extractor = CodeExtractor(config)
+        self.policy = PathPolicy(config)
+        self.cache = (
+            SkeletonCache(
+                config.cache_dir, config.cache_max_bytes, self._cache_fingerprint()
+            )
+            if config.cache_dir
+            else None
+        )
+        self.snapshot: Optional[RepoSnapshot] = None
+        # --files-from, read once: stdin cannot be read again on a rebuild
+        self._path_list: Optional[List[str]] = None
+        # Watch mode: results of the previous run, reused for unchanged files
+        self._memo: Optional[Dict[Path, Tuple[Tuple[int, float, bool], FileResult]]]
+        self._memo = None
+        self._processor: Optional[FileProcessor] = None
         self.stats = {
             "files_processed": 0,
             "full_content": 0,
             "skeleton": 0,
             "excluded": 0,
+            "binary": 0,
+            "truncated": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
             "total_tokens": 0,
+            "token_margin": 0,
+            "omitted": 0,
+            "demoted": 0,
+            "budget_used": 0,
+            "listed": 0,  # Files the mode shows nothing of, never read
+            "listed_bytes": 0,
+            "listed_lines": 0,  # Estimated from size
         }
 
     ####
 
+    def _rel(self, path: Path) -> str:
+        """Relative path with forward slashes for cross-platform compatibility."""
+        return path.relative_to(self.root).as_posix()
+
     def should_exclude(self, path: Path) -> bool:
         """Check if path should be excluded."""
-        rel_path = path.relative_to(self.root)
-        # Normalize to forward slashes for cross-platform compatibility
-        rel_path_str = str(rel_path).replace("\\", "/")
-
-        # Check explicit exclusions
-        for pattern in self.config.exclude:
-            pattern_clean = pattern.rstrip("/")
-            # Check if pattern appears in path
-            if pattern_clean in rel_path_str:
-                return True
-            # Also try glob matching
-            try:
-                if rel_path.match(pattern):
-                    return True
-            except:
-                pass
-
-        # Check default exclusions
-        for pattern in self.config.DEFAULT_EXCLUDE_PATTERNS:
-            if rel_path.match(pattern) or any(
-                p.match(pattern) for p in rel_path.parents
-            ):
-                return True
-            if "*" not in pattern and pattern in rel_path.parts:
-                return True
-
-        # Check if in excluded directory name
-        for part in rel_path.parts:
-            if part in self.config.EXCLUDE_DIRS:
-                return True
-
-        return False
+        return self.policy.is_excluded(self._rel(path))
 
     def should_full_content(self, path: Path) -> bool:
         """Check if file should have full content."""
-        # In hybrid mode, NOTHING gets full content except config files
-        if self.config.mode == "hybrid":
-            return path.name in self.config.DEFAULT_FULL_PATTERNS
+        return self.policy.is_full_content(self._rel(path))
+
+    def _scan(self) -> RepoSnapshot:
+        """Take the repository snapshot from a path list, the git index or a walk."""
+        if self.config.files_from:
+            if self._path_list is None:
+                self._path_list = read_path_list(self.config.files_from)
+            return RepoSnapshot.from_paths(self.root, self._path_list)
+        if self.config.git_index:
+            snapshot = RepoSnapshot.from_git_index(
+                self.root,
+                self.policy,
+                count_excluded=self.config.show_excluded,
+                tree_depth=self.config.tree_depth or None,
+                include_untracked=self.config.include_untracked,
+            )
+            if snapshot is not None:
+                return snapshot
+            print(
+                f"Warning: No git index found for {self.root}, walking the directory",
+                file=sys.stderr,
+            )
+        return RepoSnapshot.scan(
+            self.root,
+            self.policy,
+            count_excluded=self.config.show_excluded,
+            tree_depth=self.config.tree_depth or None,
+        )
+
+    def _render_tree(self, snapshot: RepoSnapshot) -> str:
+        """The <tree>, collapsed to the configured limits.
+
+        Directories are annotated with the tokens their files are expected
+        to take when shown, estimated from sizes as the budget planner does.
+        """
+        planner = BudgetPlanner(self.config, self.token_counter.estimator)
+        binary = Config.BINARY_EXTENSIONS
+
+        def estimate(entry: SnapshotEntry) -> int:
+            suffix = os.path.splitext(entry.rel)[1]
+            if suffix.lower() in binary:
+                return 0
+            full = self.policy.is_full_content(entry.rel)
+            return planner.size_estimate(entry.rel, suffix, entry.size, full)
+
+        config = self.config
+        return TreeBuilder.render(
+            snapshot, config.tree_depth, config.tree_width, estimate, config.tree_lines
+        )
+
+    def _cache_fingerprint(self) -> str:
+        """Everything besides file content that cached results depend on."""
+        return json.dumps(
+            [
+                CodeExtractor.VERSION,
+                sorted(self.extractor.parsers),
+                self.extractor.nested_defs,
+                self.token_counter.name,
+            ]
+        )
+
+    def enable_incremental(self):
+        """Keep results and parse trees between generate() calls (watch mode).
+
+        Files whose size, mtime and full-content decision are unchanged reuse
+        their previous result; changed files are reparsed incrementally.
+        """
+        if self._memo is None:
+            self._memo = {}
+            self._processor = FileProcessor(self.config, self.extractor, self.cache)
+            self._processor.trees = {}
+
+    def invalidate(self, paths):
+        """Force files to be reprocessed on the next incremental run."""
+        if self._memo is not None:
+            for path in paths:
+                self._memo.pop(Path(path), None)
+
+    def _process_incremental(self, tasks: List[FileTask]) -> Iterator[FileResult]:
+        memo = {}
+        results: List[Optional[FileResult]] = []
+        pending = []
+        for index, (path, size, mtime, full, _change) in enumerate(tasks):
+            previous = self._memo.get(path)
+            if previous is not None and previous[0] == (size, mtime, full):
+                results.append(previous[1])
+            else:
+                results.append(None)
+                pending.append(index)
 
-        # Normalize path to use forward slashes for cross-platform compatibility
-        rel_path_str = str(path.relative_to(self.root)).replace("\\", "/")
+        if self._memo or len(pending) < 2:
+            for index in pending:
+                results[index] = self._processor.process(*tasks[index])
+        else:
+            # First run: fan out like a one-shot run; trees start on first edit
+            fresh = self._process_batch([tasks[index] for index in pending])
+            for index, result in zip(pending, fresh):
+                results[index] = result
+
+        for (path, size, mtime, full, _change), result in zip(tasks, results):
+            memo[path] = ((size, mtime, full), result)
+        for path in self._memo.keys() - memo.keys():
+            self._processor.trees.pop(path, None)
+        self._memo = memo
+        return iter(results)
+
+    def _process(self, tasks: List[FileTask]) -> Iterator[FileResult]:
+        """Process files, yielding results in task order."""
+        if self._memo is not None:
+            return self._process_incremental(tasks)
+        return self._process_batch(tasks)
+
+    def _process_batch(self, tasks: List[FileTask]) -> Iterator[FileResult]:
+        """Process files serially or on a --jobs pool, in task order.
+
+        Results are produced as they are consumed: a pool works at most
+        ``POOL_WINDOW`` chunks per worker ahead of the reader, so finished
+        results never pile up behind a slow one.
+        """
+        jobs = self.config.jobs or os.cpu_count() or 1
+        if jobs <= 1 or len(tasks) < 2:
+            processor = FileProcessor(self.config, self.extractor, self.cache)
+            return (processor.process(*task) for task in tasks)
+
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        jobs = min(jobs, len(tasks))
+        chunksize = max(1, min(64, len(tasks) // (jobs * 4)))
+        chunks = [tasks[i : i + chunksize] for i in range(0, len(tasks), chunksize)]
+        if self.config.backend == "thread":
+            pool = ThreadPoolExecutor(max_workers=jobs)
+            worker = partial(_process_in_thread, self.config, self.cache)
+        else:
+            pool = ProcessPoolExecutor(
+                max_workers=jobs,
+                initializer=_init_process_worker,
+                initargs=(self.config, self.cache),
+            )
+            worker = _process_in_worker
+        return self._windowed(pool, worker, chunks, jobs * self.POOL_WINDOW)
 
-        # Explicit includes
-        if rel_path_str in self.config.include_full:
-            return True
+    @staticmethod
+    def _windowed(pool, worker, chunks, window: int) -> Iterator[FileResult]:
+        """Yield chunk results in order with at most ``window`` chunks queued."""
+        with pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(worker, chunk))
+                if len(pending) >= window:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def _store(self, result: FileResult, tokens: Optional[int]):
+        """Record a freshly extracted skeleton (or a new stat key) in the cache."""
+        if self.cache is None or not result.content_key:
+            return
+        if not result.cached:
+            if result.token_margin is not None:
+                tokens = None  # Estimates are not cached as exact counts
+            self.cache.put(
+                result.content_key,
+                {
+                    "skeleton": result.text,
+                    "outline": Outline.pack(result.outline or []),
+                    "loc": result.loc,
+                    "tokens": tokens,
+                },
+            )
+        if result.stat_key:
+            self.cache.link(result.stat_key, result.content_key)
+        result.stat_key = result.content_key = None  # Stored once
+
+    def _shows(self, kind: str) -> bool:
+        """Whether the output mode shows files of a result kind."""
+        return kind in Config.MODE_SHOWS[self.config.mode]
+
+    def _count_tokens(self, full_files, skeleton_files, calibrate: bool = True):
+        """Fill in missing token counts for every file the output will show.
+
+        Exact counts are made in one batch. In estimate mode only a sample
+        per file kind is counted exactly, to calibrate the estimator for
+        the rest (unless ``calibrate`` is False, when the current ratios are
+        kept); without an encoder every count is estimated. Counts stay on
+        the results, so incremental runs reuse them as-is.
+        """
+        shown = []
+        if self._shows("full"):
+            shown.extend(full_files)
+        if self._shows("skeleton"):
+            shown.extend(skeleton_files)
+        pending = [(path, result) for path, result in shown if result.tokens is None]
+        texts = [self._rendered(result) for _, result in pending]
+        suffixes = [path.suffix for path, _ in pending]
+
+        counter = self.token_counter
+        exact: Dict[int, int] = {}
+        if pending and counter.encoder is not None:
+            if self.config.token_count == "exact":
+                exact = dict(enumerate(counter.count_many(texts)))
+            elif calibrate:
+                sample = TokenEstimator.sample(texts, suffixes)
+                counts = counter.count_many([texts[i] for i in sample])
+                exact = dict(zip(sample, counts))
+                counter.estimator.calibrate(
+                    [(suffixes[i], texts[i], n) for i, n in exact.items()]
+                )
+        for index, (_, result) in enumerate(pending):
+            if index in exact:
+                result.tokens = exact[index]
+            else:
+                estimate = counter.estimator.estimate(texts[index], suffixes[index])
+                result.tokens, result.token_margin = estimate.tokens, estimate.margin
+
+    def _count_emitted(
+        self,
+        files: List[Tuple[Path, FileResult]],
+        planned: Dict[str, BudgetItem],
+    ) -> bool:
+        """Count exactly what will be written, where it was only estimated.
+
+        In estimate mode the budget is settled on estimates; the files that
+        are finally emitted, at their final detail level, are then encoded
+        so the output reports exact counts. Returns whether any count changed.
+        """
+        counter = self.token_counter
+        if self.config.token_count != "estimate" or counter.encoder is None:
+            return False
+        pending = []
+        for path, result in files:
+            if result.token_margin is None or not self._shows(result.kind):
+                continue
+            item = planned.get(self._rel(path))
+            level = Outline.DOCSTRINGS if item is None else item.level
+            pending.append((result, item, level))
+        if not pending:
+            return False
+        texts = [self._rendered(result, level) for result, _, level in pending]
+        for (result, item, level), tokens in zip(pending, counter.count_many(texts)):
+            if level == Outline.DOCSTRINGS:
+                # The cache keeps this count; demoted texts are not cached
+                result.tokens, result.token_margin = tokens, None
+            if item is not None:
+                item.tokens, item.margin = tokens, 0
+        return True
+
+    def _margin(self, files: List[Tuple[Path, FileResult]]) -> int:
+        """Summed ~95% error of the estimated counts among files written."""
+        return sum(
+            result.token_margin or 0 for _, result in files if self._shows(result.kind)
+        )
+
+    # Omitted files are listed per directory, collapsed to shallower
+    # directories until the listing has at most this many lines
+    OMITTED_LINES = 40
 
-        # Pattern matches
-        for pattern in self.config.include_patterns:
-            if path.match(pattern):
-                return True
+    @staticmethod
+    def _collapse_parents(parents: Iterable[str], limit: int) -> Dict[str, str]:
+        """Map directories to ancestors, shallower until at most ``limit`` remain."""
+        dirs = {parent: parent.split("/") if parent else [] for parent in parents}
+        depth = max(map(len, dirs.values()), default=0)
+        while depth and len({"/".join(p[:depth]) for p in dirs.values()}) > limit:
+            depth -= 1
+        return {parent: "/".join(parts[:depth]) for parent, parts in dirs.items()}
+
+    @classmethod
+    def _collapse_dirs(cls, rels: List[str], limit: int) -> Dict[str, List[str]]:
+        """Group paths by directory, shallower until at most ``limit`` groups."""
+        parents = [rel.rpartition("/")[0] for rel in rels]
+        keys = cls._collapse_parents(set(parents), limit)
+        by_dir: Dict[str, List[str]] = defaultdict(list)
+        for rel, parent in zip(rels, parents):
+            by_dir[keys[parent]].append(rel)
+        return by_dir
+
+    @classmethod
+    def _render_omitted(cls, omitted: List[BudgetItem]) -> str:
+        """List files left out by the budget, collapsed per directory."""
+        # Summed per directory first: the budget re-renders this listing as
+        # it drops files, and huge repositories omit most of theirs
+        own: Dict[str, List] = {}
+        for item in omitted:
+            parent = item.rel.rpartition("/")[0]
+            row = own.get(parent)
+            if row is None:
+                own[parent] = [1, item.estimate, item.rel]
+            else:
+                row[0] += 1
+                row[1] += item.estimate
+        keys = cls._collapse_parents(own, cls.OMITTED_LINES)
+        by_dir: Dict[str, List] = {}
+        for parent, (files, tokens, rel) in own.items():
+            row = by_dir.setdefault(keys[parent], [0, 0, rel])
+            row[0] += files
+            row[1] += tokens
+        total = sum(tokens for _files, tokens, _rel in by_dir.values())
+        lines = [f"<omitted files='{len(omitted)}' tokens='{total}'>"]
+        for directory, (files, tokens, rel) in sorted(by_dir.items()):
+            if files == 1:
+                lines.append(f"<file path='{_attr(rel)}' tokens='{tokens}'/>")
+            else:
+                lines.append(
+                    f"<directory path='{_attr(directory or '.')}' "
+                    f"files='{files}' tokens='{tokens}'/>"
+                )
+        lines.append("</omitted>")
+        return "\n".join(lines)
 
-        # Default full content files (only in non-hybrid mode)
-        if path.name in self.config.DEFAULT_FULL_PATTERNS:
-            return True
+    def _omitted_tokens(self, omitted: List[BudgetItem]) -> int:
+        return self.token_counter.count(self._render_omitted(omitted)) if omitted else 0
+
+    def _describe_tokenizer(self) -> str:
+        counter = self.token_counter
+        if self.config.token_count != "estimate" or counter.encoder is None:
+            return counter.describe()
+        fitted = sum(counter.estimator.calibrated.values())
+        if not fitted:
+            return f"{counter.name}, budget estimated from chars/token by file type"
+        return (
+            f"{counter.name}, budget estimated from chars/token calibrated "
+            f"on {fitted} files"
+        )
+
+    @classmethod
+    def _rendered(cls, result: FileResult, level: int = Outline.DOCSTRINGS) -> str:
+        """A result's text as printed, with its truncation note.
+
+        Skeletons render from their outline below the default detail level.
+        """
+        text = result.text
+        if level != Outline.DOCSTRINGS and result.outline is not None:
+            text = Outline.render(result.outline, level)
+        if result.truncated is None:
+            return text
+        return text + cls._truncation_note(result.truncated)
+
+    def _demoted_tokens(
+        self, results: Dict[str, FileResult], items: List[BudgetItem], level: int
+    ) -> List[TokenEstimate]:
+        """Body tokens of skeletons rendered at a lower detail level.
+
+        Estimates carry their own margin, which replaces the one of the
+        file's full skeleton.
+        """
+        texts = [self._rendered(results[item.rel], level) for item in items]
+        suffixes = [os.path.splitext(item.rel)[1] for item in items]
+        counter = self.token_counter
+        if self.config.token_count == "exact" and counter.encoder is not None:
+            return [TokenEstimate(n) for n in counter.count_many(texts)]
+        return [
+            counter.estimator.estimate(text, suffix)
+            for text, suffix in zip(texts, suffixes)
+        ]
 
-        return False
+    @staticmethod
+    def _truncation_note(truncated: Tuple[int, int]) -> str:
+        return "\n# [Truncated: read {} of {} bytes]".format(*truncated)
+
+    @staticmethod
+    def _truncation_attr(truncated: Optional[Tuple[int, int]]) -> str:
+        return "" if truncated is None else " truncated='true'"
+
+    # Files counted and written at a time when streaming
+    STREAM_BATCH = 64
+    BYTES_PER_LINE = 36  # For line estimates of files that are not read
+    POOL_WINDOW = 2  # Chunks submitted ahead per --jobs worker
+    # Tokens held back for each shard's header until one is rendered, and
+    # the most directories the header's tree digest lists
+    SHARD_OVERHEAD = 100
+    DIGEST_LINES = 40
 
     ####
-    def generate(self) -> str:
-        """Generate skeleton output."""
-        output = []
+    def generate(self, snapshot: Optional[RepoSnapshot] = None) -> str:
+        """Generate skeleton output, from a fresh scan unless a snapshot is given."""
+        buffer = io.StringIO()
+        self.write(buffer, snapshot)
+        return buffer.getvalue()
+
+    def write(self, out, snapshot: Optional[RepoSnapshot] = None, stream=False):
+        """Write the output to a text stream.
+
+        By default ``<stats>`` leads, so every result is held until the last
+        one is counted. With ``stream``, files are written and flushed in
+        batches of ``STREAM_BATCH`` as soon as they are extracted and
+        counted, and ``<stats>`` becomes a trailer before
+        ``<total-tokens>``; only one batch and the worker pool's in-flight
+        tasks are held at a time. Under a token budget, files are written
+        once the budget is settled, as demotion needs every count.
+        """
+        if self.config.format != "text":
+            return self._write_records(RecordWriter(out, self.config.format), snapshot)
+        writer = OutputWriter(out)
+        self.stats = dict.fromkeys(self.stats, 0)
 
         # Header
-        output.append(f"<codebase project='{self.root.name}'>")
-        output.append("\n<metadata>")
+        writer.add(f"<codebase project='{_attr(self.root.name)}'>")
+        writer.add("\n<metadata>")
+
+        # One filesystem pass feeds both the tree and the file collection.
+        # Exclusion is checked on directories as well as files, so excluded
+        # subtrees are skipped without being entered. Their files are only
+        # tallied individually when --show-excluded asks for the listing.
+        if snapshot is None:
+            snapshot = self._scan()
+        self.snapshot = snapshot
 
         # Directory tree
-        output.append("<tree>")
-        tree = TreeBuilder.build(self.root, self.config)
-        output.append(tree)
-        output.append("</tree>\n")
+        tree = self._render_tree(snapshot)
+        writer.add("<tree>")
+        writer.add(tree)
+        writer.add("</tree>\n")
+
+        planner, overhead, planned, omitted, shown = self._select(snapshot, tree)
+        demoted: List[int] = []
+        section = None
+        if stream and planner is None:
+            writer.add("</metadata>\n")
+            writer.flush()
+            for batch in self._counted_batches(shown):
+                section = self._write_files(writer, batch, {}, section)
+                writer.flush()
+        else:
+            files, demoted = self._settle(shown, planner, overhead, planned, omitted)
+            if not stream:
+                self._write_stats(writer, planner, demoted)
+            writer.add("</metadata>\n")
+            section = self._write_files(writer, files, planned, section)
+        if section is not None:
+            writer.add(f"\n</{section}>\n")
 
-        # Collect files
-        full_files = []
-        skeleton_files = []
-        excluded_dirs = defaultdict(int)
+        if omitted:
+            writer.add(self._render_omitted(omitted) + "\n")
 
-        for path in self.root.rglob("*"):
-            if not path.is_file():
-                continue
+        # Excluded summary (optional, controlled by --show-excluded flag)
+        excluded_dirs = snapshot.excluded
+        if excluded_dirs and self.config.show_excluded:
+            writer.add("<excluded>")
+            for dir_path, count in sorted(excluded_dirs.items()):
+                writer.add(f"<directory path='{_attr(dir_path)}' files='{count}'/>")
+            writer.add("</excluded>\n")
+
+        if self.cache is not None:
+            self.cache.evict()
+
+        if stream:
+            self._write_stats(writer, planner, demoted)
+        writer.add(f"\n<total-tokens>{self.stats['total_tokens']}</total-tokens>")
+        writer.add("</codebase>")
+        writer.flush()
+
+    def generate_shards(
+        self, snapshot: Optional[RepoSnapshot] = None
+    ) -> Tuple[List[Shard], List[str]]:
+        """Generate the output split by ``shard_tokens`` or ``shard_count``.
+
+        Per-file token counts are bin-packed by ``ShardPacker``. Every shard
+        is a complete document: the tree digest shared by all shards, then
+        its own files. With ``shard_tokens`` the files get the room the
+        largest rendered header leaves. Returns the shards and the paths
+        omitted by ``max_tokens``.
+        """
+        self.stats = dict.fromkeys(self.stats, 0)
+        if snapshot is None:
+            snapshot = self._scan()
+        self.snapshot = snapshot
+
+        planner, overhead, planned, omitted, shown = self._select(snapshot, "")
+        files, _demoted = self._settle(shown, planner, overhead, planned, omitted)
+        tags = BudgetPlanner(self.config, self.token_counter.estimator)
+        by_rel = {self._rel(path): (path, result) for path, result in files}
+        costs = {
+            rel: (
+                planned[rel].estimate
+                if rel in planned
+                else result.tokens + tags.tag_tokens(rel)
+            )
+            for rel, (_path, result) in by_rel.items()
+        }
 
-            # Check exclusion FIRST - excluded directories are completely ignored
-            # regardless of file type or content
-            if self.should_exclude(path):
-                parent = path.parent.relative_to(self.root)
-                # Normalize path for output
-                parent_str = str(parent).replace("\\", "/")
-                excluded_dirs[parent_str] += 1
-                self.stats["excluded"] += 1
-                continue  # Stop processing this file completely
+        limit = self.config.shard_tokens
+        header = self.SHARD_OVERHEAD
+        while True:
+            if self.config.shard_count:
+                packer = ShardPacker.for_count(costs, self.config.shard_count)
+            else:
+                if limit <= header:
+                    raise ValueError(
+                        f"--shard-tokens {limit} leaves no room for files "
+                        f"after the {header}-token shard header"
+                    )
+                packer = ShardPacker(limit - header)
+            groups = packer.pack(costs) or [[]]
+            digest = self._render_digest(groups, costs)
+            frame = io.StringIO()
+            self._write_shard(
+                OutputWriter(frame), len(groups), len(groups), digest, [], {}
+            )
+            # Section tags and the digits of <total-tokens> are not in the frame
+            sections = "<full-content>\n</full-content>\n<skeleton>\n</skeleton>"
+            needed = self.token_counter.count(f"{frame.getvalue()}{sections}{limit}")
+            if self.config.shard_count or needed <= header:
+                break
+            header = needed
+
+        shards = []
+        for index, rels in enumerate(groups, 1):
+            # Full content first, as in unsharded output
+            group = sorted(rels, key=lambda rel: by_rel[rel][1].kind != "full")
+            buffer = io.StringIO()
+            self._write_shard(
+                OutputWriter(buffer),
+                index,
+                len(groups),
+                digest,
+                [by_rel[rel] for rel in group],
+                planned,
+            )
+            tokens = needed + sum(costs[rel] for rel in rels)
+            if limit and tokens > limit:
+                print(
+                    f"Warning: Shard {index} is over --shard-tokens ({tokens} "
+                    f"tokens): {group[0]} does not fit in one shard",
+                    file=sys.stderr,
+                )
+            shards.append(Shard(group, tokens, buffer.getvalue()))
 
-            # Now check if remaining files need full content
-            should_full = self.should_full_content(path)
+        if self.cache is not None:
+            self.cache.evict()
+        return shards, [item.rel for item in omitted]
 
-            # Try to read the file
-            try:
-                content = path.read_text(encoding="utf-8", errors="ignore")
-            except Exception as e:
-                print(f"Warning: Could not read {path}: {e}", file=sys.stderr)
+    def tree_id(self) -> str:
+        """Short hash of the snapshot's files, sizes and mtimes."""
+        digest = hashlib.sha256()
+        for entry in self.snapshot.files():
+            digest.update(f"{entry.rel}\0{entry.size}\0{entry.mtime}\n".encode())
+        return digest.hexdigest()[:12]
+
+    @staticmethod
+    def _format_ranges(numbers: List[int]) -> str:
+        """1,2,3,5 -> '1-3,5'."""
+        ranges = []
+        for number in numbers:
+            if ranges and ranges[-1][1] == number - 1:
+                ranges[-1][1] = number
+            else:
+                ranges.append([number, number])
+        return ",".join(
+            str(first) if first == last else f"{first}-{last}"
+            for first, last in ranges
+        )
+
+    def _render_digest(self, groups: List[List[str]], costs: Dict[str, int]) -> str:
+        """The tree digest every shard repeats.
+
+        Directories are collapsed to at most ``DIGEST_LINES``, each with its
+        file and token counts and the shards holding its files.
+        """
+        shard_of = {rel: index for index, rels in enumerate(groups, 1) for rel in rels}
+        by_dir = self._collapse_dirs(sorted(shard_of), self.DIGEST_LINES)
+        lines = [
+            f"<tree-digest id='{self.tree_id()}' files='{len(shard_of)}' "
+            f"tokens='{sum(costs.values())}' shards='{len(groups)}'>"
+        ]
+        for directory, rels in sorted(by_dir.items()):
+            tokens = sum(costs[rel] for rel in rels)
+            shards = self._format_ranges(sorted({shard_of[rel] for rel in rels}))
+            lines.append(
+                f"<directory path='{_attr(directory or '.')}' files='{len(rels)}' "
+                f"tokens='{tokens}' shards='{shards}'/>"
+            )
+        lines.append("</tree-digest>")
+        return "\n".join(lines)
+
+    def _write_shard(
+        self,
+        writer: "OutputWriter",
+        index: int,
+        count: int,
+        digest: str,
+        files: List[Tuple[Path, FileResult]],
+        planned: Dict[str, BudgetItem],
+    ):
+        project = _attr(self.root.name)
+        writer.add(f"<codebase project='{project}' shard='{index}' of='{count}'>")
+        writer.add("\n<metadata>")
+        writer.add(digest)
+        writer.add("</metadata>\n")
+        start = self.stats["total_tokens"]
+        section = self._write_files(writer, files, planned, None)
+        if section is not None:
+            writer.add(f"\n</{section}>\n")
+        tokens = self.stats["total_tokens"] - start
+        writer.add(f"\n<total-tokens>{tokens}</total-tokens>")
+        writer.add("</codebase>")
+
+    def _select(self, snapshot: RepoSnapshot, tree: str):
+        """Choose the files to show and start processing them.
+
+        Returns ``(planner, overhead, planned, omitted, shown)``: the budget
+        planner (None without ``max_tokens``), the tokens ``overhead``
+        planned for besides files (``tree`` and the metadata), the chosen
+        and omitted budget items, and the iterator of processed results.
+        """
+        self.stats["excluded"] = sum(snapshot.excluded.values())
+
+        # Rank files against the token budget from their sizes, so files
+        # that cannot fit are never read
+        items = [
+            BudgetItem(
+                entry.rel,
+                entry.size,
+                entry.mtime,
+                self.policy.is_full_content(entry.rel),
+            )
+            for entry in snapshot.files()
+        ]
+        # Files the mode does not show are never read: only listed and sized
+        unread = [i for i in items if not self._shows("full" if i.full else "skeleton")]
+        if unread:
+            items = [i for i in items if self._shows("full" if i.full else "skeleton")]
+            binary = Config.BINARY_EXTENSIONS
+            self.stats["listed"] = len(unread)
+            self.stats["listed_bytes"] = sum(item.size for item in unread)
+            self.stats["listed_lines"] = sum(
+                -(-item.size // self.BYTES_PER_LINE)
+                for item in unread
+                if os.path.splitext(item.rel)[1].lower() not in binary
+            )
+
+        planner = None
+        overhead = 0
+        planned: Dict[str, BudgetItem] = {}
+        omitted: List[BudgetItem] = []
+        if self.config.max_tokens > 0 and items:
+            planner = BudgetPlanner(self.config, self.token_counter.estimator)
+            overhead = self.token_counter.count(tree) + planner.RESERVE
+            chosen, omitted = planner.plan(items, overhead)
+            planned = {item.rel: item for item in chosen}
+            items = [item for item in items if item.rel in planned]
+
+        # Full-content files are output first, so they are processed first
+        items.sort(key=lambda item: not item.full)
+        tasks = [
+            FileTask(
+                self.root / item.rel,
+                item.size,
+                item.mtime,
+                item.full,
+                snapshot.entries[item.rel].change_key,
+            )
+            for item in items
+        ]
+        return planner, overhead, planned, omitted, self._results(tasks)
+
+    def _settle(
+        self,
+        shown: Iterator[Tuple[Path, FileResult]],
+        planner: Optional[BudgetPlanner],
+        overhead: int,
+        planned: Dict[str, BudgetItem],
+        omitted: List[BudgetItem],
+    ) -> Tuple[List[Tuple[Path, FileResult]], List[int]]:
+        """Count every shown file and settle the budget.
+
+        Returns the files to write, full content first, and the detail
+        levels of demoted skeletons.
+        """
+        full_files = []
+        skeleton_files = []
+        for path, result in shown:
+            if result.kind == "full":
+                full_files.append((path, result))
+            else:
+                skeleton_files.append((path, result))
+
+        # Count everything the output will show in one batch; this also
+        # settles which tokenizer <stats> reports
+        self._count_tokens(full_files, skeleton_files)
+        if planner is None:
+            self._count_emitted(full_files + skeleton_files, planned)
+            self.stats["token_margin"] = self._margin(full_files + skeleton_files)
+            return full_files + skeleton_files, []
+
+        # Exact counts replace the estimates; demote, then drop, what still
+        # overflows
+        kept = []
+        results = {}
+        for path, result in full_files + skeleton_files:
+            item = planned[self._rel(path)]
+            item.tokens, item.margin = result.tokens, result.token_margin or 0
+            item.estimate = result.tokens + planner.tag_tokens(item.rel)
+            results[item.rel] = result
+            kept.append(item)
+        dropped = planner.demote(
+            kept,
+            omitted,
+            overhead,
+            self._omitted_tokens,
+            partial(self._demoted_tokens, results),
+        )
+        emitted = {item.rel for item in kept}
+        if self._count_emitted(
+            [f for f in full_files + skeleton_files if self._rel(f[0]) in emitted],
+            planned,
+        ):
+            # Exact counts may exceed the estimates the budget was settled on
+            for item in kept:
+                demoted = item.level != Outline.DOCSTRINGS
+                item.estimate = item.tokens + planner.tag_tokens(item.rel, demoted)
+            dropped += planner.fit(kept, omitted, overhead, self._omitted_tokens)
+        if dropped:
+            gone = {item.rel for item in dropped}
+            full_files = [f for f in full_files if self._rel(f[0]) not in gone]
+            skeleton_files = [f for f in skeleton_files if self._rel(f[0]) not in gone]
+            self.stats["full_content"] = len(full_files)
+            self.stats["skeleton"] = len(skeleton_files)
+            self.stats["files_processed"] = len(full_files) + len(skeleton_files)
+        # Only what is written counts towards the margin, at its written level
+        self.stats["token_margin"] = sum(item.margin for item in kept)
+        self.stats["omitted"] = len(omitted)
+        demoted = [item.level for item in kept if item.level > Outline.DOCSTRINGS]
+        self.stats["demoted"] = len(demoted)
+        self.stats["budget_used"] = (
+            overhead
+            + sum(item.estimate for item in kept)
+            + self._omitted_tokens(omitted)
+        )
+        return full_files + skeleton_files, demoted
+
+    def _results(self, tasks: List[FileTask]) -> Iterator[Tuple[Path, FileResult]]:
+        """Process files, yielding those with content to show and tallying all."""
+        for task, result in zip(tasks, self._process(tasks)):
+            path = task.path
+            if result.kind == "binary":
+                self.stats["binary"] += 1
+                continue
+            if result.kind == "error":
+                print(
+                    f"Warning: Could not read {path}: {result.error}", file=sys.stderr
+                )
                 # IMPORTANT: Skip this file entirely if it can't be read
                 # Don't count it as processed, don't add it to output
                 continue
 
             self.stats["files_processed"] += 1
+            if result.truncated is not None:
+                self.stats["truncated"] += 1
 
-            if should_full:
-                full_files.append((path, content))
+            if result.kind == "full":
                 self.stats["full_content"] += 1
             else:
-                # Generate skeleton
-                skeleton = self.extractor.extract_skeleton(path, content)
-                skeleton_files.append((path, skeleton, len(content.split("\n"))))
                 self.stats["skeleton"] += 1
-
-        # Stats
-        output.append("<stats>")
-        output.append(f"Files processed: {self.stats['files_processed']}")
-        output.append(f"Full content: {self.stats['full_content']} files")
-        output.append(f"Skeleton: {self.stats['skeleton']} files")
-        output.append(f"Excluded: {self.stats['excluded']} files")
+                if result.cached:
+                    self.stats["cache_hits"] += 1
+                elif result.content_key:
+                    self.stats["cache_misses"] += 1
+            yield path, result
+
+    def _counted_batches(
+        self, shown: Iterator[Tuple[Path, FileResult]]
+    ) -> Iterator[List[Tuple[Path, FileResult]]]:
+        """Yield shown files in batches of ``STREAM_BATCH`` as they are counted.
+
+        The first batch calibrates token estimates for the rest.
+        """
+        batch, first = [], True
+        for entry in shown:
+            batch.append(entry)
+            if len(batch) == self.STREAM_BATCH:
+                yield self._counted(batch, first)
+                batch, first = [], False
+        yield self._counted(batch, first)
+
+    def _counted(
+        self, batch: List[Tuple[Path, FileResult]], calibrate: bool
+    ) -> List[Tuple[Path, FileResult]]:
+        full_files = [entry for entry in batch if entry[1].kind == "full"]
+        skeleton_files = [entry for entry in batch if entry[1].kind != "full"]
+        self._count_tokens(full_files, skeleton_files, calibrate)
+        self._count_emitted(batch, {})
+        self.stats["token_margin"] += self._margin(batch)
+        return batch
+
+    def _shown(
+        self, path: Path, result: FileResult, planned: Dict[str, BudgetItem]
+    ) -> Tuple[str, str, int, Optional[str]]:
+        """A file as it is written: path, text, tokens and demoted detail.
+
+        The detail is the level name for demoted skeletons, else None.
+        Counts the file in ``total_tokens`` and caches fresh skeletons.
+        """
+        rel = self._rel(path)
+        level = Outline.DOCSTRINGS
+        tokens = result.tokens
+        if result.kind != "full":
+            self._store(result, result.tokens)
+            item = planned.get(rel)
+            if item is not None and item.level != Outline.DOCSTRINGS:
+                level, tokens = item.level, item.tokens
+        self.stats["total_tokens"] += tokens
+        detail = None if level == Outline.DOCSTRINGS else Outline.LEVELS[level]
+        return rel, self._rendered(result, level), tokens, detail
+
+    def _write_files(
+        self,
+        writer: "OutputWriter",
+        files: List[Tuple[Path, FileResult]],
+        planned: Dict[str, BudgetItem],
+        section: Optional[str],
+    ) -> Optional[str]:
+        """Write <file> elements, opening sections as needed.
+
+        ``section`` is the section left open by the previous call; returns
+        the one left open now.
+        """
+        for path, result in files:
+            kind = result.kind
+            if not self._shows(kind):
+                continue
+            name = "full-content" if kind == "full" else "skeleton"
+            if name != section:
+                if section is not None:
+                    writer.add(f"\n</{section}>\n")
+                writer.add(f"<{name}>")
+                section = name
+            rel, text, tokens, detail = self._shown(path, result, planned)
+            truncated = self._truncation_attr(result.truncated)
+            if kind == "full":
+                writer.add(f"\n<file path='{_attr(rel)}' tokens='{tokens}'{truncated}>")
+            else:
+                detail = "" if detail is None else f" detail='{detail}'"
+                writer.add(
+                    f"\n<file path='{_attr(rel)}' loc='{result.loc}' "
+                    f"tokens='{tokens}'{truncated}{detail}>"
+                )
+            writer.add(text)
+            writer.add("</file>")
+        return section
+
+    def _write_stats(
+        self,
+        writer: "OutputWriter",
+        planner: Optional[BudgetPlanner],
+        demoted: List[int],
+    ):
+        snapshot = self.snapshot
+        writer.add("<stats>")
+        if self.stats["listed"]:
+            size = _format_size(self.stats["listed_bytes"])
+            writer.add(
+                f"Files: {self.stats['listed']} listed, not read ({size}, "
+                f"~{self.stats['listed_lines']:,} lines estimated)"
+            )
+        if Config.MODE_SHOWS[self.config.mode]:
+            writer.add(f"Files processed: {self.stats['files_processed']}")
+            writer.add(f"Full content: {_count(self.stats['full_content'], 'file')}")
+            writer.add(f"Skeleton: {_count(self.stats['skeleton'], 'file')}")
+        # Without --show-excluded, pruned directories count once, unopened
+        excluded = self.stats["excluded"]
+        if self.config.show_excluded:
+            writer.add(f"Excluded: {_count(excluded, 'file')}")
+        else:
+            writer.add(f"Excluded: {_count(excluded, 'entry', 'entries')}")
+        if self.stats["binary"]:
+            writer.add(f"Binary: {_count(self.stats['binary'], 'file')} skipped")
+        if self.stats["truncated"]:
+            truncated = _count(self.stats["truncated"], "file")
+            writer.add(f"Truncated: {truncated} read head-only")
+        if snapshot.source == "git index":
+            writer.add(
+                f"Source: git index ({snapshot.tracked} tracked, "
+                f"{snapshot.untracked} untracked)"
+            )
+        elif snapshot.source == "file list":
+            writer.add(f"Source: file list ({snapshot.tracked} files)")
+        if self.cache is not None:
+            writer.add(
+                f"Cache: {self.stats['cache_hits']} hits, "
+                f"{self.stats['cache_misses']} misses"
+            )
         if TREE_SITTER_AVAILABLE and self.extractor.parsers:
-            output.append("Tree-sitter: enabled")
+            writer.add("Tree-sitter: enabled")
         else:
-            output.append("Tree-sitter: disabled (using fallback)")
-        output.append("</stats>")
-        output.append("</metadata>\n")
-
-        # Full content files
-        if full_files and self.config.mode != "overview":
-            output.append("<full-content>")
-            for path, content in full_files:
-                rel_path = path.relative_to(self.root)
-                # Normalize path for output (forward slashes)
-                rel_path_str = str(rel_path).replace("\\", "/")
-                tokens = self.token_counter.count(content)
-                self.stats["total_tokens"] += tokens
-
-                output.append(f"\n<file path='{rel_path_str}' tokens='{tokens}'>")
-                output.append(content)
-                output.append("</file>")
-            output.append("\n</full-content>\n")
-
-        # Skeleton files
-        if skeleton_files and self.config.mode in ("skeleton", "hybrid", "custom"):
-            output.append("<skeleton>")
-            for path, skeleton, loc in skeleton_files:
-                rel_path = path.relative_to(self.root)
-                # Normalize path for output (forward slashes)
-                rel_path_str = str(rel_path).replace("\\", "/")
-                tokens = self.token_counter.count(skeleton)
-                self.stats["total_tokens"] += tokens
-
-                output.append(
-                    f"\n<file path='{rel_path_str}' loc='{loc}' tokens='{tokens}'>"
+            writer.add("Tree-sitter: disabled (using fallback)")
+        if planner is not None:
+            used = self.stats["budget_used"]
+            over = " (over budget)" if used > self.config.max_tokens else ""
+            writer.add(
+                f"Budget: {used} of {self.config.max_tokens} tokens{over}, "
+                f"{_count(self.stats['omitted'], 'file')} omitted"
+            )
+            if demoted:
+                levels = ", ".join(
+                    f"{demoted.count(level)} {Outline.LEVELS[level]}"
+                    for level in planner.LADDER
+                    if level in demoted
                 )
-                output.append(skeleton)
-                output.append("</file>")
-            output.append("\n</skeleton>\n")
+                writer.add(f"Detail: {_count(len(demoted), 'file')} demoted ({levels})")
+        if Config.MODE_SHOWS[self.config.mode]:
+            # Nothing is tokenized in overview; don't load a tokenizer to say so
+            writer.add(f"Tokenizer: {self._describe_tokenizer()}")
+        if self.stats["token_margin"]:
+            margin = self.stats["token_margin"]
+            writer.add(f"Token estimate margin: ±{margin} (95%)")
+        writer.add("</stats>")
+
+    def _write_records(self, records: "RecordWriter", snapshot: Optional[RepoSnapshot]):
+        """Write the output as records, streamed like ``write(stream=True)``.
+
+        A ``codebase`` record and the ``tree`` lead; one ``file`` record
+        follows per file as soon as its batch is counted (or once the
+        budget is settled), then ``omitted`` and ``excluded`` records and
+        the ``stats`` trailer.
+        """
+        self.stats = dict.fromkeys(self.stats, 0)
+        if snapshot is None:
+            snapshot = self._scan()
+        self.snapshot = snapshot
+        records.add(
+            {
+                "type": "codebase",
+                "project": self.root.name,
+                "mode": self.config.mode,
+                "version": RecordWriter.VERSION,
+            }
+        )
+        tree = self._render_tree(snapshot)
+        records.add({"type": "tree", "text": tree})
+        records.flush()
+
+        planner, overhead, planned, omitted, shown = self._select(snapshot, tree)
+        if planner is None:
+            batches = self._counted_batches(shown)
+        else:
+            batches = [self._settle(shown, planner, overhead, planned, omitted)[0]]
+        for batch in batches:
+            for path, result in batch:
+                if self._shows(result.kind):
+                    records.add(self._file_record(path, result, planned))
+            records.flush()
+
+        for item in omitted:
+            records.add({"type": "omitted", "path": item.rel, "tokens": item.estimate})
+        if snapshot.excluded and self.config.show_excluded:
+            for dir_path, count in sorted(snapshot.excluded.items()):
+                records.add({"type": "excluded", "path": dir_path, "files": count})
+
+        if self.cache is not None:
+            self.cache.evict()
+
+        stats = {"type": "stats", **self.stats}
+        stats["source"] = snapshot.source
+        stats["tree_sitter"] = bool(TREE_SITTER_AVAILABLE and self.extractor.parsers)
+        if planner is not None:
+            stats["budget"] = self.config.max_tokens
+        if Config.MODE_SHOWS[self.config.mode]:
+            stats["tokenizer"] = self._describe_tokenizer()
+        records.add(stats)
+        records.flush()
+
+    def _file_record(
+        self, path: Path, result: FileResult, planned: Dict[str, BudgetItem]
+    ) -> Dict[str, Any]:
+        rel, text, tokens, detail = self._shown(path, result, planned)
+        record = {
+            "type": "file",
+            "path": rel,
+            "language": RecordWriter.language(rel),
+            "mode": result.kind,
+            "loc": result.loc,
+            "tokens": tokens,
+            "content": text,
+        }
+        if result.truncated is not None:
+            record["truncated"] = list(result.truncated)  # [bytes read, size]
+        if detail is not None:
+            record["detail"] = detail
+        return record
+
+
+class OutputWriter:
+    """Writes output pieces to a text stream as ``"\\n".join`` would.
+
+    Pieces go out as they are produced instead of being collected, and
+    ``flush`` hands everything written so far to the stream's reader.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.started = False
+
+    def add(self, piece: str):
+        if self.started:
+            self.out.write("\n")
+        self.out.write(piece)
+        self.started = True
+
+    def flush(self):
+        self.out.flush()
+
+
+class RecordWriter:
+    """Writes output records as JSON Lines, or MessagePack to a binary stream.
+
+    Each record is a dict with a ``type``; see
+    ``SkeletonGenerator._write_records``.
+    """
+
+    VERSION = 1  # Bump when record fields change incompatibly
+
+    # File name or extension -> language, for file records
+    LANGUAGES = {
+        "py": "python",
+        "pyi": "python",
+        "js": "javascript",
+        "mjs": "javascript",
+        "cjs": "javascript",
+        "jsx": "jsx",
+        "ts": "typescript",
+        "tsx": "tsx",
+        "go": "go",
+        "rs": "rust",
+        "java": "java",
+        "kt": "kotlin",
+        "rb": "ruby",
+        "php": "php",
+        "c": "c",
+        "h": "c",
+        "cc": "cpp",
+        "cpp": "cpp",
+        "hpp": "cpp",
+        "cs": "csharp",
+        "swift": "swift",
+        "sh": "shell",
+        "bash": "shell",
+        "sql": "sql",
+        "html": "html",
+        "css": "css",
+        "scss": "scss",
+        "md": "markdown",
+        "rst": "restructuredtext",
+        "txt": "text",
+        "json": "json",
+        "yaml": "yaml",
+        "yml": "yaml",
+        "toml": "toml",
+        "ini": "ini",
+        "cfg": "ini",
+        "xml": "xml",
+        "Dockerfile": "dockerfile",
+        "Makefile": "makefile",
+    }
 
-        # Excluded summary (optional, controlled by --show-excluded flag)
-        if excluded_dirs and self.config.show_excluded:
-            output.append("<excluded>")
-            for dir_path, count in sorted(excluded_dirs.items()):
-                output.append(f"<directory path='{dir_path}' files='{count}'/>")
-            output.append("</excluded>\n")
+    def __init__(self, out, format: str = "jsonl"):
+        self.out = out
+        self.binary = format == "msgpack"
+
+    @classmethod
+    def language(cls, rel: str) -> str:
+        """Language of a file from its name or extension ("text" if unknown)."""
+        name = rel.rsplit("/", 1)[-1]
+        if name in cls.LANGUAGES:
+            return cls.LANGUAGES[name]
+        stem, dot, suffix = name.rpartition(".")
+        if not dot or not stem:
+            return "text"
+        return cls.LANGUAGES.get(suffix.lower(), suffix.lower())
+
+    def add(self, record: Dict[str, Any]):
+        if self.binary:
+            self.out.write(MsgPack.pack(record))
+        else:
+            line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+            self.out.write(line + "\n")
+
+    def flush(self):
+        self.out.flush()
+
+
+class MsgPack:
+    """Stdlib-only MessagePack for the record output.
+
+    Covers what records hold: None, bools, ints, floats, strings, bytes,
+    lists and dicts. ``unpack`` reads back a stream of packed objects for
+    consumers without the msgpack package.
+    """
+
+    @classmethod
+    def pack(cls, obj: Any) -> bytes:
+        out = bytearray()
+        cls._pack(obj, out)
+        return bytes(out)
+
+    @classmethod
+    def _pack(cls, obj: Any, out: bytearray):
+        if obj is None:
+            out.append(0xC0)
+        elif obj is True or obj is False:
+            out.append(0xC3 if obj else 0xC2)
+        elif isinstance(obj, int):
+            cls._pack_int(obj, out)
+        elif isinstance(obj, float):
+            out += struct.pack(">Bd", 0xCB, obj)
+        elif isinstance(obj, str):
+            data = obj.encode("utf-8", "surrogatepass")
+            cls._header(len(data), out, 0xA0, 32, (0xD9, 0xDA, 0xDB))
+            out += data
+        elif isinstance(obj, (bytes, bytearray)):
+            cls._header(len(obj), out, None, 0, (0xC4, 0xC5, 0xC6))
+            out += obj
+        elif isinstance(obj, (list, tuple)):
+            cls._header(len(obj), out, 0x90, 16, (None, 0xDC, 0xDD))
+            for item in obj:
+                cls._pack(item, out)
+        elif isinstance(obj, dict):
+            cls._header(len(obj), out, 0x80, 16, (None, 0xDE, 0xDF))
+            for key, value in obj.items():
+                cls._pack(key, out)
+                cls._pack(value, out)
+        else:
+            raise TypeError(f"Cannot pack {type(obj).__name__}")
 
-        output.append(f"\n<total-tokens>{self.stats['total_tokens']}</total-tokens>")
-        output.append("</codebase>")
+    @staticmethod
+    def _pack_int(value: int, out: bytearray):
+        if 0 <= value < 0x80 or -32 <= value < 0:
+            out += struct.pack(">b" if value < 0 else ">B", value)
+        elif value >= 0:
+            for code, fmt in ((0xCC, "B"), (0xCD, "H"), (0xCE, "I"), (0xCF, "Q")):
+                if value < 1 << (8 * struct.calcsize(fmt)):
+                    out += struct.pack(f">B{fmt}", code, value)
+                    return
+            raise OverflowError("int too large to pack")
+        else:
+            for code, fmt in ((0xD0, "b"), (0xD1, "h"), (0xD2, "i"), (0xD3, "q")):
+                if value >= -(1 << (8 * struct.calcsize(fmt) - 1)):
+                    out += struct.pack(f">B{fmt}", code, value)
+                    return
+            raise OverflowError("int too small to pack")
 
-        return "\n".join(output)
+    @staticmethod
+    def _header(size: int, out: bytearray, fix: Optional[int], fix_limit: int, codes):
+        """Type and length: fixed-size form, else 8-, 16- or 32-bit length."""
+        if fix is not None and size < fix_limit:
+            out.append(fix | size)
+        elif codes[0] is not None and size < 0x100:
+            out += struct.pack(">BB", codes[0], size)
+        elif size < 0x10000:
+            out += struct.pack(">BH", codes[1], size)
+        else:
+            out += struct.pack(">BI", codes[2], size)
+
+    # Code -> (struct format, size) of fixed-width scalars
+    SCALARS = {
+        0xCA: (">f", 4),
+        0xCB: (">d", 8),
+        0xCC: (">B", 1),
+        0xCD: (">H", 2),
+        0xCE: (">I", 4),
+        0xCF: (">Q", 8),
+        0xD0: (">b", 1),
+        0xD1: (">h", 2),
+        0xD2: (">i", 4),
+        0xD3: (">q", 8),
+    }
+    # Code -> (kind, length format, length size) of variable-length types
+    SIZED = {
+        0xC4: ("bin", ">B", 1),
+        0xC5: ("bin", ">H", 2),
+        0xC6: ("bin", ">I", 4),
+        0xD9: ("str", ">B", 1),
+        0xDA: ("str", ">H", 2),
+        0xDB: ("str", ">I", 4),
+        0xDC: ("array", ">H", 2),
+        0xDD: ("array", ">I", 4),
+        0xDE: ("map", ">H", 2),
+        0xDF: ("map", ">I", 4),
+    }
+
+    @classmethod
+    def unpack(cls, data: bytes) -> Iterator[Any]:
+        """Yield the objects packed one after another in ``data``."""
+        pos = 0
+        while pos < len(data):
+            obj, pos = cls._unpack(data, pos)
+            yield obj
+
+    @classmethod
+    def _unpack(cls, data: bytes, pos: int) -> Tuple[Any, int]:
+        code = data[pos]
+        pos += 1
+        if code < 0x80:
+            return code, pos
+        if code >= 0xE0:
+            return code - 0x100, pos
+        if code in cls.SCALARS:
+            fmt, size = cls.SCALARS[code]
+            return struct.unpack_from(fmt, data, pos)[0], pos + size
+        if code in (0xC0, 0xC2, 0xC3):
+            return {0xC0: None, 0xC2: False, 0xC3: True}[code], pos
+        if code in cls.SIZED:
+            kind, fmt, size = cls.SIZED[code]
+            length = struct.unpack_from(fmt, data, pos)[0]
+            pos += size
+        elif 0xA0 <= code < 0xC0:
+            kind, length = "str", code & 0x1F
+        elif code >= 0xC0:
+            raise ValueError(f"Unsupported MessagePack type 0x{code:02x}")
+        elif code >= 0x90:
+            kind, length = "array", code & 0x0F
+        else:
+            kind, length = "map", code & 0x0F
+        if kind in ("str", "bin"):
+            chunk = bytes(data[pos : pos + length])
+            value = chunk.decode("utf-8", "surrogatepass") if kind == "str" else chunk
+            return value, pos + length
+        items = []
+        for _ in range(length * (2 if kind == "map" else 1)):
+            item, pos = cls._unpack(data, pos)
+            items.append(item)
+        if kind == "array":
+            return items, pos
+        return dict(zip(items[::2], items[1::2])), pos
+
+
+class _CountingWriter(io.RawIOBase):
+    """Passes bytes through to ``raw``, counting them."""
+
+    def __init__(self, raw):
+        super().__init__()
+        self.raw = raw
+        self.count = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.raw.write(data)
+        size = memoryview(data).nbytes
+        self.count += size
+        return size
+
+
+class CompressedOutput:
+    """An output stream compressed as it is written (gzip, xz or bz2).
+
+    Use as a context manager around ``SkeletonGenerator.write``: it yields
+    a text stream (binary with ``binary``) over the compressor, so output
+    is compressed piece by piece and never held whole. Afterwards
+    ``uncompressed`` and ``compressed`` hold the byte counts. Generator
+    flushes stop at the compressor, so per-batch flushes don't cost ratio.
+    """
+
+    # Codec -> (module, file class, keyword arguments). Level 6 gzip is
+    # within 1% of level 9's size at twice the speed; mtime 0 keeps archives
+    # of unchanged skeletons byte-identical
+    CODECS = {
+        "gzip": ("gzip", "GzipFile", {"compresslevel": 6, "mtime": 0}),
+        "xz": ("lzma", "LZMAFile", {}),
+        "bz2": ("bz2", "BZ2File", {}),
+    }
+    SUFFIXES = {".gz": "gzip", ".xz": "xz", ".bz2": "bz2"}
+
+    def __init__(self, target, codec: str, binary: bool = False):
+        self.target = target  # Path, or a binary stream left open
+        self.codec = codec
+        self.binary = binary
+        self.uncompressed = 0
+        self.compressed = 0
+
+    @classmethod
+    def infer(cls, path: str) -> Optional[str]:
+        """The codec an output file name asks for, if any."""
+        return cls.SUFFIXES.get(Path(path).suffix.lower())
+
+    @classmethod
+    def available(cls, codec: str) -> bool:
+        """Whether this Python was built with the codec's library."""
+        return importlib.util.find_spec(cls.CODECS[codec][0]) is not None
+
+    def __enter__(self):
+        module, name, options = self.CODECS[self.codec]
+        codec = importlib.import_module(module)
+        if isinstance(self.target, (str, Path)):
+            self._file = open(self.target, "wb")
+        else:
+            self._file = self.target
+        self._out = _CountingWriter(self._file)
+        if name == "GzipFile":
+            self._compressor = codec.GzipFile(fileobj=self._out, mode="wb", **options)
+        else:
+            self._compressor = getattr(codec, name)(self._out, "wb", **options)
+        self._in = _CountingWriter(self._compressor)
+        self.stream = io.BufferedWriter(self._in)
+        if not self.binary:
+            self.stream = io.TextIOWrapper(self.stream, encoding="utf-8")
+        return self.stream
+
+    def __exit__(self, *exc):
+        try:
+            self.stream.close()
+            self._compressor.close()
+        finally:
+            if self._file is not self.target:
+                self._file.close()
+            else:
+                self._file.flush()
+        self.uncompressed, self.compressed = self._in.count, self._out.count
+
+
+def write_shards(generator: SkeletonGenerator, output: Path) -> List[Path]:
+    """Write sharded output and its manifest next to ``output``.
+
+    ``out.txt`` becomes ``out.01.txt``, ``out.02.txt``, ... and
+    ``out.manifest.json``, which lists the paths in each shard. Returns the
+    shard paths followed by the manifest's.
+    """
+    shards, omitted = generator.generate_shards()
+    width = max(2, len(str(len(shards))))
+    paths = [
+        output.with_name(f"{output.stem}.{index:0{width}d}{output.suffix}")
+        for index in range(1, len(shards) + 1)
+    ]
+    for path, shard in zip(paths, shards):
+        write_atomic(path, shard.text)
+    manifest = {
+        "project": generator.root.name,
+        "tree_digest": generator.tree_id(),
+        "shard_tokens": generator.config.shard_tokens or None,
+        "shards": [
+            {
+                "file": path.name,
+                "files": len(shard.paths),
+                "tokens": shard.tokens,
+                "paths": shard.paths,
+            }
+            for path, shard in zip(paths, shards)
+        ],
+        "omitted": omitted,
+    }
+    manifest_path = output.with_name(f"{output.stem}.manifest.json")
+    write_atomic(manifest_path, json.dumps(manifest, indent=2) + "\n")
+    return paths + [manifest_path]
+
+
+def write_atomic(path: Path, text: str):
+    """Replace path with text so readers never see a partial file."""
+    fd, tmp = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class PollingWatcher:
+    """Change source that simply wakes up every ``interval`` seconds.
+
+    Returns None ("unknown"), so the session re-stats the tree and compares.
+    """
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+
+    def watch(self, root: Path, rel_dirs):
+        pass
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[Set[str]]:
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        return None
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Linux inotify change source, used through ctypes (no extra dependency).
+
+    ``wait`` returns the relative paths that changed, an empty set on
+    timeout, or None when the kernel queue overflowed and events were lost.
+    """
+
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    MASK = (
+        IN_MODIFY
+        | IN_ATTRIB
+        | IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+        | IN_MOVE_SELF
+    )
+    _EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; name follows
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs: Dict[int, str] = {}  # watch descriptor -> relative dir
+        self._watched: Set[str] = set()
+
+    @classmethod
+    def create(cls) -> Optional["InotifyWatcher"]:
+        """An inotify watcher, or None where inotify is unavailable."""
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            return cls()
+        except (OSError, AttributeError):
+            return None
+
+    def watch(self, root: Path, rel_dirs):
+        """Watch the given directories (relative to root; "" is root itself)."""
+        for rel in rel_dirs:
+            if rel in self._watched:
+                continue
+            target = os.fsencode(os.path.join(root, rel) if rel else root)
+            wd = self._libc.inotify_add_watch(self.fd, target, self.MASK)
+            if wd >= 0:
+                self._dirs[wd] = rel
+                self._watched.add(rel)
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[Set[str]]:
+        import select
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed: Set[str] = set()
+        overflow = False
+        pos = 0
+        while pos + self._EVENT.size <= len(data):
+            wd, mask, _cookie, length = self._EVENT.unpack_from(data, pos)
+            pos += self._EVENT.size
+            name = os.fsdecode(data[pos : pos + length].rstrip(b"\0"))
+            pos += length
+            if mask & self.IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & self.IN_IGNORED:  # Watch removed (directory deleted)
+                self._watched.discard(self._dirs.pop(wd, None))
+                continue
+            rel_dir = self._dirs.get(wd)
+            if rel_dir is None:
+                continue
+            changed.add(f"{rel_dir}/{name}" if rel_dir and name else name or rel_dir)
+        return None if overflow else changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class WatchSession:
+    """Keeps an output file in sync with the tree (``--watch``).
+
+    Changes come from inotify where available, otherwise from polling.
+    Bursts of events are debounced, only changed files are reprocessed
+    (incrementally, via the generator's retained parse trees), and the
+    output is replaced atomically.
+    """
+
+    def __init__(
+        self,
+        generator: "SkeletonGenerator",
+        output: Path,
+        debounce: float = 0.3,
+        watcher=None,
+    ):
+        self.generator = generator
+        self.output = Path(output).resolve()
+        self.debounce = debounce
+        self.watcher = watcher or InotifyWatcher.create() or PollingWatcher()
+        self._signature = None
+        self._written: Optional[str] = None
+        generator.enable_incremental()
+
+    def _relevant(self, changed: Set[str]) -> Set[str]:
+        """Drop events caused by writing the output (or its temp file)."""
+        root = self.generator.root
+        tmp_prefix = f".{self.output.name}."
+        relevant = set()
+        for rel in changed:
+            path = root / rel
+            if path == self.output or (
+                path.parent == self.output.parent
+                and path.name.startswith(tmp_prefix)
+            ):
+                continue
+            relevant.add(rel)
+        return relevant
+
+    def refresh(self, changed: Optional[Set[str]] = None) -> bool:
+        """Rescan and regenerate; True if the output file was rewritten."""
+        generator = self.generator
+        snapshot = generator._scan()
+        signature = [(e.rel, e.size, e.mtime) for e in snapshot.entries.values()]
+        if changed:
+            generator.invalidate(generator.root / rel for rel in changed)
+        elif signature == self._signature:
+            return False
+        self._signature = signature
+        self.watcher.watch(
+            generator.root,
+            [""] + [e.rel for e in snapshot.entries.values() if e.is_dir],
+        )
+
+        text = generator.generate(snapshot)
+        if text == self._written:
+            return False
+        write_atomic(self.output, text)
+        self._written = text
+        return True
+
+    def run(self, on_update: Optional[Callable[[float], None]] = None):
+        """Watch until interrupted; on_update receives each rebuild's duration."""
+        # Create the output first so every scan sees the same tree and counts
+        self.output.touch(exist_ok=True)
+        try:
+            self._update(None, on_update)
+            while True:
+                changed = self.watcher.wait()
+                if changed is not None:
+                    changed = self._relevant(changed)
+                    if not changed:
+                        continue
+                    # Debounce: wait for a quiet window before rebuilding
+                    while True:
+                        more = self.watcher.wait(self.debounce)
+                        if more is None:
+                            changed = None
+                            break
+                        more = self._relevant(more)
+                        if not more:
+                            break
+                        changed |= more
+                self._update(changed, on_update)
+        finally:
+            self.watcher.close()
+
+    def _update(self, changed, on_update):
+        start = time.monotonic()
+        if self.refresh(changed) and on_update is not None:
+            on_update(time.monotonic() - start)
 
 
 ###
@@ -965,10 +5034,11 @@ Examples:
   %(prog)s ~/my-project --output=skeleton.txt
   %(prog)s ~/my-project --include-full="src/auth/models.py"
   %(prog)s ~/my-project --exclude="vendor/,legacy/"
+  git ls-files -z | %(prog)s ~/my-project --files-from=-
 
 Install optional dependencies:
   pip install tree-sitter tree-sitter-python tree-sitter-javascript tree-sitter-typescript
-  pip install tiktoken directory-tree
+  pip install tiktoken
         """,
     )
 
@@ -1002,27 +5072,236 @@ Install optional dependencies:
     )
 
     parser.add_argument(
-        "--max-tokens", type=int, default=50000, help="Maximum token budget"
+        "--max-tokens",
+        type=int,
+        help="Token budget for the whole output; lower-priority files are "
+        f"omitted and listed (0 = no limit, default: {Config.max_tokens}, "
+        "or no limit when sharding, streaming or writing records)",
+    )
+    parser.add_argument(
+        "--max-file-bytes",
+        type=int,
+        default=Config.max_file_bytes,
+        help="Read only the head of larger files (default: 1 MiB, 0 = no limit)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Extract files with N workers (default: 1, 0 = one per CPU)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["process", "thread"],
+        default="process",
+        help="Worker pool for --jobs (default: process)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        metavar="DIR",
+        help="Cache skeletons in DIR across runs, e.g. "
+        f"{SkeletonCache.default_dir()} (default: no cache)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Do not read or write the cache"
+    )
+    parser.add_argument(
+        "--cache-max-bytes",
+        type=int,
+        default=Config.cache_max_bytes,
+        help="Evict least recently used cache entries beyond this size "
+        "(default: 256 MiB)",
+    )
+    parser.add_argument(
+        "--nested-defs",
+        action="store_true",
+        help="Also list functions and classes defined inside function bodies",
+    )
+    parser.add_argument(
+        "--tokenizer-file",
+        type=str,
+        metavar="PATH",
+        help="Load cl100k_base ranks from this local .tiktoken file (no network)",
+    )
+    parser.add_argument(
+        "--tokenizer-cache",
+        type=str,
+        metavar="DIR",
+        help="Directory to load cl100k_base from, downloading into it on a "
+        "miss, e.g. a vendored copy (default: tiktoken's own cache)",
+    )
+    parser.add_argument(
+        "--tokenizer-timeout",
+        type=float,
+        default=Config.tokenizer_timeout,
+        metavar="SECONDS",
+        help="Use approximate token counts if the tokenizer takes longer "
+        "than this to load (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--token-count",
+        choices=["exact", "estimate"],
+        default="exact",
+        help="Count tokens exactly, or settle the budget on chars/token "
+        "estimates calibrated on a sample of files, counting only the files "
+        "emitted exactly (default: exact)",
     )
     parser.add_argument(
         "--show-deps", action="store_true", help="Show dependency graph (future)"
     )
+    parser.add_argument(
+        "--tree-depth",
+        type=int,
+        default=Config.tree_depth,
+        metavar="N",
+        help="Directory levels shown in <tree> (0 = no limit, default: %(default)s)",
+    )
+    parser.add_argument(
+        "--tree-width",
+        type=int,
+        default=Config.tree_width,
+        metavar="N",
+        help="Entries listed per directory in <tree>; the rest are summed up "
+        "in one line (0 = no limit, default: %(default)s)",
+    )
+    parser.add_argument(
+        "--tree-lines",
+        type=int,
+        default=Config.tree_lines,
+        metavar="N",
+        help="Lines the whole <tree> may take; the largest directories are "
+        "opened first, the rest stay closed (0 = no limit, default: %(default)s)",
+    )
     parser.add_argument(
         "--show-excluded",
         action="store_true",
         help="Include detailed excluded directories list in output (default: False)",
     )
 
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument(
+        "--files-from",
+        type=str,
+        metavar="PATH",
+        help="Process exactly the newline- or NUL-separated paths in PATH "
+        "('-' for stdin) instead of walking the directory",
+    )
+    source.add_argument(
+        "--git-index",
+        action="store_true",
+        help="Enumerate tracked files from .git/index instead of walking the directory",
+    )
+    parser.add_argument(
+        "--include-untracked",
+        action="store_true",
+        help="With --git-index, also scan for untracked files not in .gitignore",
+    )
+
     parser.add_argument("--output", type=str, help="Output file (default: stdout)")
+    parser.add_argument(
+        "--format",
+        choices=["text", "jsonl", "msgpack"],
+        default="text",
+        help="Output format: the tagged text document, or streamed records "
+        "(one JSON object per line, or MessagePack) for machine consumers; "
+        "records imply --max-tokens=0 unless given (default: text)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write files as soon as they are ready, with <stats> as a trailer, "
+        "holding only a small batch in memory; implies --max-tokens=0 unless "
+        "given, as a budget holds every file until it is settled",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=sorted(CompressedOutput.CODECS),
+        help="Compress the output as it is written (default: from the --output "
+        "suffix: .gz, .xz or .bz2)",
+    )
+    shard = parser.add_mutually_exclusive_group()
+    shard.add_argument(
+        "--shard-tokens",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Split the output into --output.01, .02, ... files of at most N "
+        "tokens each, keeping directories together, with a JSON manifest",
+    )
+    shard.add_argument(
+        "--shard-count",
+        type=int,
+        default=0,
+        metavar="K",
+        help="Split the output into K files of about equal size instead",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and rewrite --output whenever files change",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.3,
+        metavar="SECONDS",
+        help="With --watch, wait for this long without changes before rebuilding "
+        "(default: 0.3)",
+    )
 
     args = parser.parse_args()
 
+    sharding = args.shard_tokens > 0 or args.shard_count > 0
+    if sharding:
+        if not args.output:
+            parser.error("--shard-tokens and --shard-count require --output")
+        if args.watch or args.stream or args.format != "text":
+            parser.error(
+                "sharded output cannot be combined with --watch, --stream or --format"
+            )
+    if args.watch and args.format == "msgpack":
+        parser.error("--watch writes text; use --format=jsonl or text")
+    compress = args.compress
+    if compress is None and args.output:
+        compress = CompressedOutput.infer(args.output)
+    if compress and (args.watch or sharding):
+        parser.error("compressed output cannot be combined with --watch or sharding")
+    if compress and not CompressedOutput.available(compress):
+        parser.error(f"{compress} is not available in this Python build")
+    max_tokens = args.max_tokens
+    if max_tokens is None:
+        # A budget is settled over every file, which streaming cannot wait for
+        streamed = args.stream or args.format != "text"
+        max_tokens = 0 if sharding or streamed else Config.max_tokens
+
     # Build config
     config = Config(
         mode=args.mode,
-        max_tokens=args.max_tokens,
+        max_tokens=max_tokens,
         show_deps=args.show_deps,
+        show_excluded=args.show_excluded,
         output=args.output,
+        git_index=args.git_index,
+        include_untracked=args.include_untracked,
+        files_from=args.files_from,
+        max_file_bytes=args.max_file_bytes,
+        jobs=args.jobs,
+        backend=args.backend,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        cache_max_bytes=args.cache_max_bytes,
+        nested_defs=args.nested_defs,
+        tokenizer_file=args.tokenizer_file,
+        tokenizer_cache=args.tokenizer_cache,
+        tokenizer_timeout=args.tokenizer_timeout,
+        token_count=args.token_count,
+        shard_tokens=max(0, args.shard_tokens),
+        shard_count=max(0, args.shard_count),
+        format=args.format,
+        tree_depth=max(0, args.tree_depth),
+        tree_width=max(0, args.tree_width),
+        tree_lines=max(0, args.tree_lines),
     )
 
     if args.include_full:
@@ -1044,20 +5323,99 @@ Install optional dependencies:
         print(f"Error: Path is not a directory: {root_path}", file=sys.stderr)
         sys.exit(1)
 
+    if args.watch:
+        if not args.output:
+            parser.error("--watch requires --output")
+        # Never feed the output (or its temp files) back into itself
+        try:
+            rel = Path(args.output).resolve().relative_to(root_path).as_posix()
+            config.exclude = set(config.exclude) | {"/" + rel}
+        except ValueError:
+            pass
+
     generator = SkeletonGenerator(root_path, config)
-    output = generator.generate()
+    if args.watch:
+        session = WatchSession(generator, Path(args.output), debounce=args.debounce)
+        polling = isinstance(session.watcher, PollingWatcher)
+        kind = "polling" if polling else "inotify"
+        print(f"👀 Watching {root_path} ({kind}); Ctrl-C to stop", file=sys.stderr)
+        try:
+            session.run(
+                lambda seconds: print(
+                    f"✅ Updated {args.output} in {seconds:.2f}s "
+                    f"({generator.stats['total_tokens']} tokens)",
+                    file=sys.stderr,
+                )
+            )
+        except KeyboardInterrupt:
+            pass
+        return
 
     # Write output
+    if sharding:
+        try:
+            *shards, manifest = write_shards(generator, Path(args.output))
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"✅ Skeleton written to {len(shards)} shards: {shards[0]} ...")
+        print(f"🗂️ Manifest: {manifest}")
+        print(f"📊 Stats:")
+        print(f"  - Files processed: {generator.stats['files_processed']}")
+        print(f"  - Total tokens: {generator.stats['total_tokens']}")
+        return
+    binary = args.format == "msgpack"
+    if args.output and compress:
+        output = CompressedOutput(args.output, compress, binary)
+        with output as f:
+            generator.write(f, stream=args.stream)
+        ratio = output.compressed / max(1, output.uncompressed)
+        print(f"✅ Skeleton written to {args.output}")
+        print(f"📊 Stats:")
+        print(f"  - Files processed: {generator.stats['files_processed']}")
+        print(f"  - Full content: {generator.stats['full_content']}")
+        print(f"  - Skeleton: {generator.stats['skeleton']}")
+        print(f"  - Total tokens: {generator.stats['total_tokens']}")
+        print(
+            f"  - Size: {_format_size(output.uncompressed)} uncompressed, "
+            f"{_format_size(output.compressed)} {compress} ({ratio:.0%})"
+        )
+        return
     if args.output:
-        Path(args.output).write_text(output, encoding="utf-8")
+        if binary:
+            with open(args.output, "wb") as f:
+                generator.write(f)
+        elif args.stream or args.format != "text":
+            with open(args.output, "w", encoding="utf-8") as f:
+                generator.write(f, stream=True)
+        else:
+            Path(args.output).write_text(generator.generate(), encoding="utf-8")
         print(f"✅ Skeleton written to {args.output}")
         print(f"📊 Stats:")
         print(f"  - Files processed: {generator.stats['files_processed']}")
         print(f"  - Full content: {generator.stats['full_content']}")
         print(f"  - Skeleton: {generator.stats['skeleton']}")
         print(f"  - Total tokens: {generator.stats['total_tokens']}")
-    else:
-        print(output)
+        return
+    try:
+        if compress:
+            with CompressedOutput(sys.stdout.buffer, compress, binary) as f:
+                generator.write(f, stream=args.stream)
+        elif binary:
+            generator.write(sys.stdout.buffer)
+        elif args.format != "text":
+            generator.write(sys.stdout)
+        elif args.stream:
+            generator.write(sys.stdout, stream=True)
+            print(flush=True)
+        else:
+            print(generator.generate(), flush=True)
+    except BrokenPipeError:
+        # The reader exited early (e.g. `| head`); keep the interpreter's
+        # final flush from failing on the closed pipe too
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -81,6 +81,13 @@ def test_greeter():
     return temp_dir
 
 
+@pytest.fixture(autouse=True)
+def isolated_cache_home(monkeypatch, tmp_path):
+    """Keep CLI runs from writing the skeleton cache into the real home."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg-cache"))
+    monkeypatch.delenv("TIKTOKEN_CACHE_DIR", raising=False)
+
+
 @pytest.fixture
 def default_config():
     """Returns a default Config instance."""
@@ -115,13 +122,3 @@ def mock_tiktoken_available(monkeypatch):
 @pytest.fixture
 def mock_tiktoken_unavailable(monkeypatch):
     monkeypatch.setattr("codebase_skeleton.TIKTOKEN_AVAILABLE", False)
-
-
-@pytest.fixture
-def mock_directory_tree_available(monkeypatch):
-    monkeypatch.setattr("codebase_skeleton.DIRECTORY_TREE_AVAILABLE", True)
-
-
-@pytest.fixture
-def mock_directory_tree_unavailable(monkeypatch):
-    monkeypatch.setattr("codebase_skeleton.DIRECTORY_TREE_AVAILABLE", False)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Test module: test_budget_planner
+"""
+import os
+import re
+import sys
+from pathlib import Path
+import pytest
+from unittest.mock import patch
+
+# Add project root to sys.path
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from codebase_skeleton import (
+    BudgetItem,
+    BudgetPlanner,
+    Config,
+    FileProcessor,
+    Outline,
+    SkeletonGenerator,
+    TokenCounter,
+    TokenEstimate,
+    TokenEstimator,
+)
+
+
+def planner(max_tokens: int = 1000) -> BudgetPlanner:
+    return BudgetPlanner(Config(max_tokens=max_tokens), TokenEstimator())
+
+
+class TestBudgetPlanner:
+    """Test ranking and selection against the budget."""
+
+    def test_rank_configs_then_entry_points_then_score(self):
+        """Test configs lead, then entry points, then shallow/new/small files."""
+        items = [
+            BudgetItem("pkg/deep/util.py", 100, 50.0, False),
+            BudgetItem("pkg/util.py", 100, 50.0, False),
+            BudgetItem("pkg/main.py", 100, 10.0, False),
+            BudgetItem("pkg/big.py", 10_000_000, 50.0, False),
+            BudgetItem("pkg/old.py", 100, 1.0, False),
+            BudgetItem("pyproject.toml", 100, 1.0, True),
+        ]
+        ranked = [item.rel for item in planner().rank(items)]
+        assert ranked == [
+            "pyproject.toml",
+            "pkg/main.py",
+            "pkg/util.py",
+            "pkg/deep/util.py",  # Recent changes outweigh one level of depth
+            "pkg/old.py",
+            "pkg/big.py",
+        ]
+
+    def test_estimate_from_size(self):
+        """Test skeletons are estimated at a fraction of full content."""
+        p = planner()
+        full = p.estimate(BudgetItem("a.py", 37_000, 0.0, True))
+        skeleton = p.estimate(BudgetItem("a.py", 37_000, 0.0, False))
+        tag = p.tag_tokens("a.py")
+        assert full == 10_000 + tag
+        assert skeleton == 3_000 + tag
+
+    def test_estimate_respects_read_limit(self):
+        """Test files read head-only are estimated from the head."""
+        p = BudgetPlanner(Config(max_file_bytes=4000), TokenEstimator())
+        item = BudgetItem("a.txt", 10_000_000, 0.0, True)
+        assert p.estimate(item) == 4000 // 4.2 + p.tag_tokens("a.txt")
+
+    def test_plan_skips_file_that_does_not_fit(self):
+        """Test a large file is skipped while smaller lower-ranked ones fit."""
+        items = [
+            BudgetItem("a.py", 100, 3.0, False),
+            BudgetItem("b.py", 1_000_000, 2.0, False),
+            BudgetItem("c.py", 100, 1.0, False),
+        ]
+        chosen, omitted = planner(200).plan(items, overhead=100)
+        assert [item.rel for item in chosen] == ["a.py", "c.py"]
+        assert [item.rel for item in omitted] == ["b.py"]
+
+    def test_fit_drops_lowest_ranked(self):
+        """Test fit drops from the bottom until exact counts fit."""
+        items = [BudgetItem(f"{name}.py", 0, 0.0, False) for name in "abc"]
+        for rank, item in enumerate(items):
+            item.rank, item.estimate = rank, 40
+        omitted = []
+        dropped = planner(100).fit(list(items), omitted, 10, lambda o: 5 * len(o))
+        assert [item.rel for item in dropped] == ["c.py"]
+        assert omitted == dropped
+
+    def test_demote_lowest_ranked_first(self):
+        """Test low ranks drop to names; the last one needed keeps more detail."""
+        items = [BudgetItem(f"{name}.py", 0, 0.0, False) for name in "abc"]
+        for rank, item in enumerate(items):
+            item.rank, item.estimate = rank, 40
+        body = {Outline.FIRST_LINE: 10, Outline.SIGNATURES: 5, Outline.NAMES: 0}
+        calls = []
+
+        def cost(batch, level):
+            calls.append((len(batch), level))
+            return [TokenEstimate(body[level], body[level] // 5)] * len(batch)
+
+        dropped = planner(100).demote(list(items), [], 0, lambda o: 0, cost)
+        assert dropped == []
+        assert [item.level for item in items] == [
+            Outline.DOCSTRINGS,
+            Outline.FIRST_LINE,
+            Outline.NAMES,
+        ]
+        assert (items[1].tokens, items[1].margin) == (10, 2)
+        # Names are counted in one batch; gentler levels only for the last file
+        assert calls == [(3, Outline.NAMES), (1, Outline.FIRST_LINE)]
+
+    def test_plan_admits_files_that_fit_demoted(self):
+        """Test files are chosen if they would fit at names only."""
+        items = [BudgetItem(f"{name}.py", 20_000, 0.0, False) for name in "abc"]
+        p = planner(700)
+        assert sum(p.estimate(item) for item in items) > 700
+        chosen, omitted = p.plan(items, overhead=100)
+        assert len(chosen) == 3 and not omitted
+
+
+class TestBudgetedGenerate:
+    """Test the budget in the generated output."""
+
+    @pytest.fixture
+    def repo(self, temp_dir):
+        (temp_dir / "README.md").write_text("# Demo\n")
+        for package in ("alpha", "beta"):
+            (temp_dir / package).mkdir()
+            for i in range(20):
+                path = temp_dir / package / f"mod{i}.py"
+                path.write_text(f"def f{i}(x):\n    return x\n" * 40)
+                os.utime(path, (1000 + i, 1000 + i))
+        return temp_dir
+
+    def test_output_fits_and_lists_omitted(self, repo, mock_tiktoken_unavailable):
+        """Test the whole output fits the budget and omissions are listed."""
+        config = Config(max_tokens=1500)
+        output = SkeletonGenerator(repo, config).generate()
+
+        assert TokenCounter().count(output) <= config.max_tokens
+        assert "<file path='README.md'" in output
+        assert "<omitted files='" in output
+        assert "<directory path='alpha' files='" in output
+        assert "files omitted" in output
+
+    def test_unchosen_files_are_never_read(self, repo):
+        """Test files past the budget are not processed at all."""
+        with patch.object(
+            FileProcessor, "process", autospec=True, side_effect=FileProcessor.process
+        ) as process:
+            generator = SkeletonGenerator(repo, Config(max_tokens=1500))
+            generator.generate()
+        processed = process.call_count
+        assert processed < 41
+        assert generator.stats["omitted"] >= 41 - processed
+
+    def test_zero_disables_budget(self, repo):
+        """Test --max-tokens 0 emits every file with no budget lines."""
+        output = SkeletonGenerator(repo, Config(max_tokens=0)).generate()
+        assert output.count("<file path=") == 41
+        assert "<omitted" not in output
+        assert "Budget:" not in output
+
+    def test_demoted_files_render_with_less_detail(self, temp_dir):
+        """Test low-ranked skeletons are demoted rather than dropped."""
+        doc = '    """Summary.\n\n    Details.\n    """\n    return x\n'
+        for i in range(12):
+            path = temp_dir / f"mod{i}.py"
+            path.write_text(f"def f{i}(x):\n{doc}\n" * 8)
+            os.utime(path, (1000 + i, 1000 + i))
+        config = Config(max_tokens=900)
+        output = SkeletonGenerator(temp_dir, config).generate()
+
+        assert TokenCounter().count(output) <= config.max_tokens
+        assert "<omitted" not in output
+        assert "files demoted (" in output
+        # The newest file keeps its docstrings; the oldest is down to names
+        tags = re.findall(r"<file path='(\w+\.py)'[^>]*?(?: detail='(.+)')?>", output)
+        detail = dict(tags)
+        assert detail["mod11.py"] == ""
+        assert detail["mod0.py"] == "names"
+        assert "detail='names'>\n" + "def f0\n" * 8 + "</file>" in output
+
+    def test_omitted_listing_collapses(self, monkeypatch):
+        """Test a long omitted listing is collapsed to parent directories."""
+        monkeypatch.setattr(SkeletonGenerator, "OMITTED_LINES", 2)
+        omitted = [
+            BudgetItem(f"src/{d}/m.py", 0, 0.0, False, estimate=10) for d in "abc"
+        ]
+        listing = SkeletonGenerator._render_omitted(omitted)
+        assert listing.splitlines() == [
+            "<omitted files='3' tokens='30'>",
+            "<directory path='src' files='3' tokens='30'/>",
+            "</omitted>",
+        ]
@@ -59,7 +59,7 @@ class TestBug01ConfigInExcludedDirs:
 
         # Verify stats
         assert generator.stats["full_content"] == 1  # Only root tsconfig
-        assert generator.stats["excluded"] >= 1  # At least the node_modules file
+        assert generator.stats["excluded"] >= 1  # node_modules/, pruned as one entry
 
         # The node_modules path should not appear in full-content section
         assert "node_modules/typescript/tsconfig.json" not in full_content_section
@@ -180,7 +180,7 @@ class TestBug01ConfigInExcludedDirs:
 
         # Verify stats
         assert generator.stats["full_content"] == 1  # Only root package.json
-        assert generator.stats["excluded"] >= 2  # build and dist files
+        assert generator.stats["excluded"] >= 2  # build/ and dist/, one entry each
 
     def test_legitimate_subdir_config_should_be_included(self, tmp_path):
         """
@@ -267,7 +267,8 @@ class TestBug01ConfigInExcludedDirs:
 
         # Only root package.json should be in full content
         assert generator.stats["full_content"] == 1
-        assert generator.stats["excluded"] >= 5  # All node_modules files
+        # node_modules is pruned without being entered, so it counts once
+        assert generator.stats["excluded"] >= 1
 
         # Verify none of the node_modules content appears
         for pkg in ["typescript", "@types/node", "react", "lodash", "axios"]:
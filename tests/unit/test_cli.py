@@ -2,6 +2,13 @@
 """
 Test module: test_cli
 """
+import bz2
+import gzip
+import io
+import json
+import lzma
+import os
+import subprocess
 import sys
 from pathlib import Path
 import pytest
@@ -11,7 +18,7 @@ from unittest.mock import patch
 project_root = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(project_root))
 
-from codebase_skeleton import main, Config
+from codebase_skeleton import main, Config, SkeletonCache, _format_size
 
 
 class TestCLI:
@@ -127,6 +134,20 @@ class TestCLI:
         captured = capsys.readouterr()
         assert "<codebase project=" in captured.out
 
+    def test_main_caches_only_with_cache_dir(self, mock_codebase, temp_dir, capsys):
+        """Test the skeleton cache is opt-in: nothing is written without --cache-dir."""
+        with patch("sys.argv", ["codebase_skeleton.py", str(mock_codebase)]):
+            main()
+        assert "Cache:" not in capsys.readouterr().out
+        assert not SkeletonCache.default_dir().exists()
+
+        cache = temp_dir / "cache"
+        argv = ["codebase_skeleton.py", str(mock_codebase), f"--cache-dir={cache}"]
+        with patch("sys.argv", argv):
+            main()
+        assert "Cache: 0 hits, 2 misses" in capsys.readouterr().out
+        assert any(path.is_file() for path in cache.rglob("*"))
+
     def test_main_no_arguments(self, capsys):
         """Test main() with no arguments shows error."""
         with patch("sys.argv", ["codebase_skeleton.py"]):
@@ -135,3 +156,167 @@ class TestCLI:
 
         captured = capsys.readouterr()
         assert "usage: codebase_skeleton.py" in captured.err
+
+    def test_main_files_from_stdin(self, mock_codebase, capsys, monkeypatch):
+        """Test --files-from=- reads a NUL-separated list from stdin."""
+        monkeypatch.setattr(
+            "sys.stdin", io.TextIOWrapper(io.BytesIO(b"src/main.py\0README.md\0"))
+        )
+        with patch(
+            "sys.argv",
+            ["codebase_skeleton.py", str(mock_codebase), "--files-from=-"],
+        ):
+            main()
+
+        out = capsys.readouterr().out
+        assert "<file path='src/main.py'" in out
+        assert "utils.js" not in out
+
+    def test_main_stream_to_stdout(self, mock_codebase, capsys):
+        """Test --stream prints files first and <stats> as a trailer."""
+        with patch(
+            "sys.argv", ["codebase_skeleton.py", str(mock_codebase), "--stream"]
+        ):
+            main()
+
+        out = capsys.readouterr().out
+        assert out.index("<file path=") < out.index("<stats>")
+        assert out.endswith("</codebase>\n")
+
+    @pytest.mark.parametrize(
+        "flags, budget", [([], 0), (["--max-tokens=900"], 900)]
+    )
+    @patch("codebase_skeleton.SkeletonGenerator")
+    def test_main_stream_has_no_implicit_budget(
+        self, mock_generator_class, mock_codebase, flags, budget
+    ):
+        """Test --stream drops the default budget, which would hold every file."""
+        argv = ["codebase_skeleton.py", str(mock_codebase), "--stream", *flags]
+        with patch("sys.argv", argv):
+            main()
+
+        config = mock_generator_class.call_args[0][1]
+        assert config.max_tokens == budget
+
+    def test_main_stream_reader_exits_early(self, temp_dir):
+        """Test a reader closing the pipe early ends the run without a traceback."""
+        for i in range(400):
+            (temp_dir / f"mod_{i}.py").write_text(
+                f'def f{i}(x):\n    """Docstring {i}."""\n    return x\n' * 5
+            )
+        proc = subprocess.Popen(
+            [
+                sys.executable,
+                str(project_root / "codebase_skeleton.py"),
+                str(temp_dir),
+                "--stream",
+                "--max-tokens=0",
+                "--no-cache",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=dict(os.environ, PYTHONIOENCODING="utf-8"),
+        )
+        assert proc.stdout.readline().startswith(b"<codebase project=")
+        proc.stdout.close()
+        stderr = proc.stderr.read().decode()
+        assert proc.wait(timeout=60) == 1
+        assert "Traceback" not in stderr
+
+    def test_main_shard_tokens(self, mock_codebase, temp_dir, capsys):
+        """Test --shard-tokens writes numbered shards and a manifest."""
+        output_file = temp_dir / "skeleton.txt"
+        with patch(
+            "sys.argv",
+            [
+                "codebase_skeleton.py",
+                str(mock_codebase),
+                "--shard-tokens=300",
+                f"--output={output_file}",
+            ],
+        ):
+            main()
+
+        manifest = json.loads((temp_dir / "skeleton.manifest.json").read_text())
+        assert len(manifest["shards"]) > 1
+        assert (temp_dir / "skeleton.01.txt").exists()
+        assert not output_file.exists()
+        assert "Manifest:" in capsys.readouterr().out
+
+    def test_main_shard_requires_output(self, mock_codebase, capsys):
+        """Test sharding without --output is a usage error."""
+        with patch(
+            "sys.argv", ["codebase_skeleton.py", str(mock_codebase), "--shard-count=2"]
+        ):
+            with pytest.raises(SystemExit):
+                main()
+
+        assert "require --output" in capsys.readouterr().err
+
+    def test_main_format_jsonl(self, mock_codebase, capsys):
+        """Test --format=jsonl prints one JSON record per line."""
+        with patch(
+            "sys.argv", ["codebase_skeleton.py", str(mock_codebase), "--format=jsonl"]
+        ):
+            main()
+
+        lines = capsys.readouterr().out.splitlines()
+        types = [json.loads(line)["type"] for line in lines]
+        assert types[:2] == ["codebase", "tree"]
+        assert types[-1] == "stats"
+        assert types.count("file") == 5
+
+    def test_main_tree_limits(self, mock_codebase, capsys):
+        """Test --tree-width/--tree-lines collapse the <tree>."""
+        with patch(
+            "sys.argv",
+            [
+                "codebase_skeleton.py",
+                str(mock_codebase),
+                "--tree-width=1",
+                "--tree-lines=3",
+            ],
+        ):
+            main()
+
+        out = capsys.readouterr().out
+        tree = out.split("<tree>")[1].split("</tree>")[0].strip().splitlines()
+        assert len(tree) == 3
+        assert tree[0].startswith(f"{mock_codebase.name}/ (5 files, ~")
+        assert tree[2].startswith("└── … ")
+
+    def test_main_compress_inferred_from_suffix(self, mock_codebase, temp_dir, capsys):
+        """Test a .gz output is gzip-compressed and both sizes are reported."""
+        output_file = temp_dir / "skeleton.txt.gz"
+        with patch(
+            "sys.argv",
+            ["codebase_skeleton.py", str(mock_codebase), f"--output={output_file}"],
+        ):
+            main()
+
+        text = gzip.decompress(output_file.read_bytes()).decode("utf-8")
+        assert text.startswith("<codebase project=")
+        out = capsys.readouterr().out
+        uncompressed = _format_size(len(text.encode("utf-8")))
+        compressed = _format_size(output_file.stat().st_size)
+        assert f"Size: {uncompressed} uncompressed, {compressed} gzip" in out
+
+    @pytest.mark.parametrize("codec,module", [("xz", lzma), ("bz2", bz2)])
+    def test_main_compress_flag(self, mock_codebase, temp_dir, codec, module):
+        """Test --compress picks the codec whatever the output suffix."""
+        output_file = temp_dir / "skeleton.out"
+        with patch(
+            "sys.argv",
+            [
+                "codebase_skeleton.py",
+                str(mock_codebase),
+                f"--output={output_file}",
+                f"--compress={codec}",
+                "--format=jsonl",
+                "--stream",
+            ],
+        ):
+            main()
+
+        lines = module.decompress(output_file.read_bytes()).decode().splitlines()
+        assert json.loads(lines[-1])["type"] == "stats"
@@ -2,6 +2,8 @@
 """
 Test module: test_code_extractor
 """
+import mmap
+import subprocess
 import sys
 from pathlib import Path
 import pytest
@@ -11,7 +13,14 @@ from unittest.mock import patch
 project_root = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(project_root))
 
-from codebase_skeleton import CodeExtractor
+from codebase_skeleton import (
+    CodeExtractor,
+    Config,
+    FileProcessor,
+    Outline,
+    ParserRegistry,
+    SourceBuffer,
+)
 
 SAMPLE_PYTHON_CODE = """
 import os
@@ -31,6 +40,54 @@ def top_level_func(name: str):
     print(f"Hello, {name}")
 """
 
+SCOPED_PYTHON_CODE = """
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+@dataclass(frozen=True)
+class Point:
+    x: int
+
+    @property
+    def norm(self) -> float:
+        def square(v): return v * v
+        return square(self.x)
+
+    class Meta: ordering = ["x"]
+
+def outer(a,
+          b):
+    def helper():
+        pass
+    return helper
+"""
+
+SCOPED_JSX_CODE = """
+import { api } from './api';
+
+const API_URL = '/api/items';
+
+export function useItems(filter) {
+  api.get(API_URL).then(res => res.json()).catch(err => console.error(err));
+}
+
+export const ItemList = ({ items }) => (
+  <ul>{items.map(item => <li onClick={() => select(item)} />)}</ul>
+);
+
+export default class App extends React.Component {
+  state = { selected: null };
+
+  handleSelect = (item) => {
+    this.setState({ selected: item }, () => this.props.onChange(item));
+  };
+}
+
+app.listen(3000, () => console.log('ready'));
+"""
+
 SAMPLE_JS_CODE = """
 import { other } from './other.js';
 
@@ -79,7 +136,7 @@ class TestCodeExtractor:
         extractor = CodeExtractor()
         assert "python" in extractor.parsers
         assert "javascript" in extractor.parsers
-        assert "python" in extractor.queries
+        assert "tsx" in extractor.parsers
 
     def test_extractor_initialization_without_tree_sitter(
         self, mock_tree_sitter_unavailable
@@ -87,7 +144,6 @@ class TestCodeExtractor:
         """Test CodeExtractor initializes without Tree-sitter."""
         extractor = CodeExtractor()
         assert not extractor.parsers
-        assert not extractor.queries
 
     def test_extract_skeleton_python_file(self, code_extractor):
         """Test skeleton extraction from Python file."""
@@ -200,6 +256,308 @@ class TestCodeExtractorTreeSitter:
         assert "def my_method(self, multiplier: int) -> int:" in skeleton
         assert "return self.value" not in skeleton
 
+    def test_extract_from_bytes_matches_str(self, code_extractor):
+        """Test the bytes-native path gives the same skeleton as text input."""
+        for code, parser_type in [
+            (SAMPLE_PYTHON_CODE, "python"),
+            (SAMPLE_JS_CODE, "javascript"),
+        ]:
+            from_bytes = code_extractor._extract_with_treesitter(
+                code.encode("utf-8"), parser_type
+            )
+            assert from_bytes == code_extractor._extract_with_treesitter(
+                code, parser_type
+            )
+
+    def test_extract_from_crlf_bytes(self, code_extractor):
+        """Test CRLF line endings do not leak into emitted lines."""
+        code = b'def func():\r\n    """Doc."""\r\n    pass\r\n'
+        skeleton = code_extractor._extract_with_treesitter(code, "python")
+        assert "\r" not in skeleton
+        assert '"""Doc."""' in skeleton
+
+    def test_large_files_are_memory_mapped(self, code_extractor, temp_dir):
+        """Test files above MMAP_THRESHOLD are mapped and report their loc."""
+        source = temp_dir / "big.py"
+        source.write_text(SAMPLE_PYTHON_CODE)
+        size = source.stat().st_size
+        processor = FileProcessor(Config(), code_extractor)
+
+        with patch.object(CodeExtractor, "MMAP_THRESHOLD", 1), patch(
+            "codebase_skeleton.mmap.mmap", wraps=mmap.mmap
+        ) as mapped:
+            result = processor.process(source, size, source.stat().st_mtime, False)
+
+        mapped.assert_called_once()
+        assert result.loc == SAMPLE_PYTHON_CODE.count("\n") + 1
+        assert result.text == code_extractor.extract_skeleton(
+            source, SAMPLE_PYTHON_CODE
+        )
+
+class TestPythonScopes:
+    """Test the scope-aware Python walk."""
+
+    def test_methods_emitted_once_with_decorators(self, code_extractor):
+        """Test class members appear once, inside their class, with decorators."""
+        skeleton = code_extractor._extract_with_treesitter(SCOPED_PYTHON_CODE, "python")
+        assert skeleton.count("def norm(self) -> float:") == 1
+        assert "@dataclass(frozen=True)\nclass Point:" in skeleton
+        assert "    @property\n    def norm(self) -> float:" in skeleton
+        assert "    class Meta:\n" in skeleton
+        assert "ordering" not in skeleton
+
+    def test_function_bodies_not_descended(self, code_extractor):
+        """Test nested helpers stay hidden and signatures stop at the colon."""
+        skeleton = code_extractor._extract_with_treesitter(SCOPED_PYTHON_CODE, "python")
+        assert "def outer(a,\n          b):" in skeleton
+        assert "helper" not in skeleton
+        assert "square" not in skeleton
+
+    def test_conditional_imports_found(self, code_extractor):
+        """Test imports inside try/except blocks are kept."""
+        skeleton = code_extractor._extract_with_treesitter(SCOPED_PYTHON_CODE, "python")
+        assert "    import ujson as json" in skeleton
+        assert "    import json" in skeleton
+
+    def test_nested_defs_when_configured(self, mock_tree_sitter_available):
+        """Test nested_defs lists definitions inside function bodies."""
+        extractor = CodeExtractor(Config(nested_defs=True))
+        skeleton = extractor._extract_with_treesitter(SCOPED_PYTHON_CODE, "python")
+        assert skeleton.count("def helper():") == 1
+        assert "def square(v):" in skeleton
+        assert "return square" not in skeleton
+
+    def test_walk_visits_only_statement_level_nodes(self, code_extractor):
+        """Test the walk examines far fewer nodes than the tree contains."""
+        code = SCOPED_PYTHON_CODE * 20
+        code_extractor._extract_with_treesitter(code, "python")
+        tree = code_extractor.parsers["python"].parse(code.encode())
+        assert code_extractor.nodes_visited * 5 < tree.root_node.descendant_count
+
+
+class TestJavaScriptScopes:
+    """Test the scope-aware JS/TS walk."""
+
+    def test_callbacks_not_emitted(self, code_extractor):
+        """Test inline arrow functions and callbacks are not skeleton entries."""
+        skeleton = code_extractor._extract_with_treesitter(SCOPED_JSX_CODE, "jsx")
+        for callback in ("res =>", "err =>", "item =>", "() =>"):
+            assert callback not in skeleton
+        assert "app.listen" not in skeleton
+
+    def test_exports_emitted_once(self, code_extractor):
+        """Test exported declarations appear once, with their export prefix."""
+        skeleton = code_extractor._extract_with_treesitter(SCOPED_JSX_CODE, "jsx")
+        assert skeleton.count("function useItems(filter)") == 1
+        assert "export function useItems(filter) {" in skeleton
+        assert skeleton.count("ItemList") == 1
+        assert "export const ItemList = ({ items }) => {" in skeleton
+        assert skeleton.count("class App") == 1
+
+    def test_bindings_and_class_members(self, code_extractor):
+        """Test top-level bindings and class fields are kept, bodies hidden."""
+        skeleton = code_extractor._extract_with_treesitter(SCOPED_JSX_CODE, "jsx")
+        assert "const API_URL = '/api/items';" in skeleton
+        assert "    state = { selected: null }" in skeleton
+        assert "    handleSelect = (item) => {" in skeleton
+        assert "setState" not in skeleton
+
+    def test_iife_module_is_looked_through(self, code_extractor):
+        """Test definitions inside an immediately invoked wrapper are found."""
+        code = "!function(){function a(x){return x}class B{m(){}}}();"
+        skeleton = code_extractor._extract_with_treesitter(code, "javascript")
+        assert "function a(x) {" in skeleton
+        assert "class B {" in skeleton
+        assert "return x" not in skeleton
+
+    def test_minified_bindings_stay_short(self, code_extractor):
+        """Test long one-line bindings are cut and declarators split."""
+        code = "var a=[" + ",".join(["1"] * 500) + "],f=function(x){return x};"
+        skeleton = code_extractor._extract_with_treesitter(code, "javascript")
+        first, rest = skeleton.split("\n", 1)
+        assert first.startswith("var a=[1,1") and first.endswith(" …")
+        assert len(first) <= len("var ") + CodeExtractor.FIRST_LINE_LIMIT + 2
+        assert rest.startswith("var f=function(x) {")
+
+        code = "const table = [" + ",".join(["1"] * 500) + "];"
+        skeleton = code_extractor._extract_with_treesitter(code, "javascript")
+        assert skeleton.startswith("const table = [1,1")
+        assert len(skeleton) <= CodeExtractor.FIRST_LINE_LIMIT + 2
+
+    def test_multiple_declarators_keep_their_keyword(self, code_extractor):
+        """Test every binding of a declaration is kept, behind its keyword."""
+        code = (
+            "let a = 1, b = () => {\n  return 2;\n};\n"
+            "export const c = 3, d = function () {\n  return 4;\n}, e = 5;\n"
+        )
+        skeleton = code_extractor._extract_with_treesitter(code, "javascript")
+        assert skeleton.startswith("let a = 1\nlet b = () => {\n")
+        assert "export const c = 3\nexport const d = function () {\n" in skeleton
+        assert skeleton.rstrip().endswith("}\n\nexport const e = 5")
+        assert "return" not in skeleton
+
+    def test_typescript_declarations(self, code_extractor):
+        """Test interfaces, abstract classes and abstract members."""
+        code = (
+            "interface Shape { area(): number; }\n"
+            "export abstract class Base implements Shape {\n"
+            "  abstract area(): number;\n"
+            "  describe(): string { return `${this.area()}`; }\n"
+            "}\n"
+        )
+        skeleton = code_extractor._extract_with_treesitter(code, "typescript")
+        assert "interface Shape { area(): number; }" in skeleton
+        assert "export abstract class Base implements Shape {" in skeleton
+        assert "    abstract area(): number" in skeleton
+        assert "    describe(): string {" in skeleton
+        assert "this.area()" not in skeleton
+
+    def test_nested_defs_when_configured(self, mock_tree_sitter_available):
+        """Test nested_defs lists functions declared inside function bodies."""
+        code = "function outer() { function inner(a) { return a; } const f = () => 1; }"
+        extractor = CodeExtractor(Config(nested_defs=True))
+        skeleton = extractor._extract_with_treesitter(code, "javascript")
+        assert "function inner(a) {" in skeleton
+        assert "const f = () => {" in skeleton
+        assert "return a" not in skeleton
+        assert "inner" not in CodeExtractor()._extract_with_treesitter(
+            code, "javascript"
+        )
+
+
+class TestLazyInitialization:
+    """Test optional dependencies and parsers load only when used."""
+
+    def test_import_loads_no_optional_dependency(self):
+        """Test importing the module imports no grammar, tokenizer or pool."""
+        probe = (
+            "import sys, codebase_skeleton; "
+            "print(sorted(m for m in ('tree_sitter', 'tree_sitter_python', "
+            "'tiktoken', 'directory_tree', 'concurrent.futures') "
+            "if m in sys.modules))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", probe],
+            cwd=project_root,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert result.stdout.strip() == "[]"
+        assert result.stderr == ""  # No warnings at import
+
+    def test_parsers_built_per_language_on_first_use(self, code_extractor):
+        """Test only the languages actually parsed get a parser."""
+        parsers = code_extractor.parsers
+        assert isinstance(parsers, ParserRegistry)
+        assert "tsx" in parsers and "python" in parsers
+        assert not parsers._parsers
+
+        code_extractor.extract_skeleton(Path("a.py"), "def f():\n    pass\n")
+        assert set(parsers._parsers) == {"python"}
+
+    def test_unknown_grammar_is_not_available(self, mock_tree_sitter_available):
+        """Test a missing grammar package leaves its language out."""
+        parsers = ParserRegistry({"cobol": ("tree_sitter_cobol", "language")})
+        assert "cobol" not in parsers
+        assert len(parsers) == 0
+
+
+class TestSourceBuffer:
+    """Test the line-indexed byte buffer used by extraction."""
+
+    def test_line_lookup(self):
+        """Test lines decode individually, including the last one."""
+        src = SourceBuffer("a = 1\r\nb = 'é'\nlast".encode("utf-8"))
+        assert src.line_count == 3
+        assert src.line(0) == "a = 1"
+        assert src.line(1) == "b = 'é'"
+        assert src.line(2) == "last"
+        assert src.text(0, 1) == "a"
+
+
+class TestOutline:
+    """Test outlines rendered at each detail level."""
+
+    MULTILINE_DOC = (
+        "def load(path):\n"
+        '    """Load a file.\n\n'
+        "    Longer description.\n"
+        '    """\n'
+        "    return open(path).read()\n"
+    )
+
+    def test_docstrings_level_is_the_skeleton(self, code_extractor):
+        """Test the default level renders the extracted skeleton exactly."""
+        for name, code in (("a.py", SAMPLE_PYTHON_CODE), ("a.js", SAMPLE_JS_CODE)):
+            outline = code_extractor.extract_outline(Path(name), code)
+            skeleton = code_extractor.extract_skeleton(Path(name), code)
+            assert Outline.render(outline, Outline.DOCSTRINGS) == skeleton
+
+    def test_first_line_closes_docstring(self, code_extractor):
+        """Test multi-line docstrings are cut to their first line."""
+        outline = code_extractor.extract_outline(Path("a.py"), self.MULTILINE_DOC)
+        assert Outline.render(outline, Outline.FIRST_LINE).splitlines()[:2] == [
+            "def load(path):",
+            '    """Load a file."""',
+        ]
+
+    def test_signatures(self, code_extractor):
+        """Test bare signatures keep imports and drop docstrings and bodies."""
+        outline = code_extractor.extract_outline(Path("a.py"), SAMPLE_PYTHON_CODE)
+        assert Outline.render(outline, Outline.SIGNATURES).splitlines() == [
+            "import os",
+            "from sys import argv",
+            "",
+            "class MyClass:",
+            "    def __init__(self, value): ...",
+            "    def my_method(self, multiplier: int) -> int: ...",
+            "def top_level_func(name: str): ...",
+        ]
+        outline = code_extractor.extract_outline(Path("a.js"), SAMPLE_JS_CODE)
+        signatures = Outline.render(outline, Outline.SIGNATURES)
+        assert "export async function fetchData(url) { ... }" in signatures
+        assert "    constructor(name) { ... }\n}" in signatures
+        assert "[Implementation hidden]" not in signatures
+
+    def test_names(self, code_extractor):
+        """Test names only, indented by nesting."""
+        outline = code_extractor.extract_outline(Path("a.py"), SAMPLE_PYTHON_CODE)
+        assert Outline.render(outline, Outline.NAMES).splitlines() == [
+            "class MyClass",
+            "    def __init__",
+            "    def my_method",
+            "def top_level_func",
+        ]
+        outline = code_extractor.extract_outline(Path("a.ts"), SAMPLE_TS_CODE)
+        assert Outline.render(outline, Outline.NAMES).splitlines() == [
+            "interface UserProfile",
+            "function getUser",
+        ]
+        assert Outline.render(outline, Outline.PATH) == ""
+
+    def test_fallback_outline(self, mock_tree_sitter_unavailable):
+        """Test fallback skeletons are tagged from their text."""
+        extractor = CodeExtractor()
+        outline = extractor.extract_outline(Path("a.py"), SAMPLE_PYTHON_CODE)
+        assert Outline.render(outline) == extractor._fallback_extract(
+            SAMPLE_PYTHON_CODE, "py"
+        )
+        names = Outline.render(outline, Outline.NAMES).splitlines()
+        assert names == [
+            "class MyClass",
+            "    def __init__",
+            "    def my_method",
+            "def top_level_func",
+        ]
+
+    def test_packed_rows_render_the_same(self, code_extractor):
+        """Test cached rows render like the outline they were packed from."""
+        outline = code_extractor.extract_outline(Path("a.js"), SAMPLE_JS_CODE)
+        rows = Outline.pack(outline)
+        for level in range(Outline.DOCSTRINGS, Outline.PATH):
+            assert Outline.render(rows, level) == Outline.render(outline, level)
+
 
 class TestCodeExtractorFallback:
     """Test fallback extraction without Tree-sitter."""
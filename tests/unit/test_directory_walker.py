@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Test module: test_directory_walker
+"""
+import os
+import sys
+from pathlib import Path
+import pytest
+
+# Add project root to sys.path
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from codebase_skeleton import DirectoryWalker, PathPolicy
+
+
+def visible_files(walker):
+    return [
+        rel
+        for rel, _entry, is_dir, state, _depth in walker.walk()
+        if not is_dir and state == PathPolicy.VISIBLE
+    ]
+
+
+class TestDirectoryWalker:
+    """Test the pruning os.scandir walker."""
+
+    def test_walk_yields_dir_entries(self, mock_codebase, default_config):
+        """Test walker yields visible files with their DirEntry."""
+        policy = PathPolicy(default_config)
+        walker = DirectoryWalker(mock_codebase, policy.state)
+        found = {}
+        for rel, entry, is_dir, state, _depth in walker.walk():
+            assert isinstance(entry, os.DirEntry)
+            assert entry.name == rel.rpartition("/")[2]
+            if not is_dir and state == PathPolicy.VISIBLE:
+                found[rel] = entry
+
+        assert set(found) == {
+            ".gitignore",
+            "README.md",
+            "requirements.txt",
+            "src/main.py",
+            "src/utils.js",
+        }
+
+    def test_walk_prunes_excluded_directories(self, mock_codebase, default_config):
+        """Test excluded directories are never entered."""
+        policy = PathPolicy(default_config)
+        checked = []
+
+        def recording_classify(rel: str, is_dir: bool) -> int:
+            checked.append(rel)
+            return policy.state(rel, is_dir)
+
+        walker = DirectoryWalker(mock_codebase, recording_classify, tree_depth=0)
+        list(walker.walk())
+
+        assert "node_modules" in checked
+        assert "node_modules/some_lib.js" not in checked
+        assert "tests/test_main.py" not in checked
+        # Each pruned directory counts once against its parent
+        assert walker.excluded == {".": 2}
+
+    def test_walk_lists_excluded_dirs_to_tree_depth(
+        self, mock_codebase, default_config
+    ):
+        """Test excluded-but-visible directories are entered for the tree only."""
+        policy = PathPolicy(default_config)
+        walker = DirectoryWalker(mock_codebase, policy.state, tree_depth=5)
+        entries = {rel: state for rel, _e, _d, state, _depth in walker.walk()}
+
+        assert entries["tests/test_main.py"] == PathPolicy.EXCLUDED
+        assert "node_modules" not in entries
+        assert walker.excluded == {".": 2}
+
+    def test_walk_counts_excluded_files_when_requested(
+        self, mock_codebase, default_config
+    ):
+        """Test count_excluded tallies files inside excluded directories."""
+        policy = PathPolicy(default_config)
+        (mock_codebase / "node_modules" / "pkg").mkdir()
+        (mock_codebase / "node_modules" / "pkg" / "index.js").write_text("x")
+
+        walker = DirectoryWalker(mock_codebase, policy.state, count_excluded=True)
+        paths = visible_files(walker)
+
+        assert all("node_modules" not in p for p in paths)
+        assert walker.excluded["tests"] == 1
+        assert walker.excluded["node_modules"] == 1
+        assert walker.excluded["node_modules/pkg"] == 1
+
+    def test_walk_is_deterministic(self, temp_dir):
+        """Test walker yields files in a stable, name-sorted order."""
+        for name in ["b.py", "a.py", "c.py"]:
+            (temp_dir / name).write_text("")
+        (temp_dir / "sub").mkdir()
+        (temp_dir / "sub" / "z.py").write_text("")
+
+        walker = DirectoryWalker(temp_dir, lambda rel, is_dir: PathPolicy.VISIBLE)
+        assert visible_files(walker) == ["a.py", "b.py", "c.py", "sub/z.py"]
+
+    def test_walk_max_depth(self, temp_dir):
+        """Test max_depth stops descending entirely."""
+        (temp_dir / "a" / "b").mkdir(parents=True)
+        (temp_dir / "a" / "top.py").write_text("")
+        (temp_dir / "a" / "b" / "deep.py").write_text("")
+
+        walker = DirectoryWalker(
+            temp_dir, lambda rel, is_dir: PathPolicy.VISIBLE, max_depth=2
+        )
+        assert visible_files(walker) == ["a/top.py"]
+
+    @pytest.mark.skipif(
+        sys.platform == "win32",
+        reason="os.symlink requires special permissions on Windows",
+    )
+    def test_walk_stops_at_symlink_loops(self, temp_dir):
+        """Test symlinked directories are followed but loops terminate."""
+        (temp_dir / "pkg").mkdir()
+        (temp_dir / "pkg" / "mod.py").write_text("")
+        os.symlink(temp_dir, temp_dir / "pkg" / "loop", target_is_directory=True)
+        os.symlink(temp_dir / "pkg", temp_dir / "alias", target_is_directory=True)
+
+        walker = DirectoryWalker(temp_dir, lambda rel, is_dir: PathPolicy.VISIBLE)
+        assert visible_files(walker) == ["alias/mod.py", "pkg/mod.py"]
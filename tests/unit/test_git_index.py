@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Test module: test_git_index
+"""
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from unittest.mock import patch
+
+# Add project root to sys.path
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from codebase_skeleton import (
+    CodeExtractor,
+    Config,
+    GitIgnore,
+    GitIndex,
+    PathPolicy,
+    RepoSnapshot,
+    SkeletonGenerator,
+)
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git not found")
+
+
+def git(repo: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", "-c", "user.email=t@example.com", "-c", "user.name=t", *args],
+        cwd=repo,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+
+@pytest.fixture
+def git_repo(mock_codebase):
+    """mock_codebase committed to a git repository (node_modules untracked)."""
+    git(mock_codebase, "init", "-q")
+    git(mock_codebase, "add", "README.md", "requirements.txt", ".gitignore")
+    git(mock_codebase, "add", "src", "tests")
+    git(mock_codebase, "commit", "-qm", "initial")
+    return mock_codebase
+
+
+def ls_files_stage(repo: Path) -> dict:
+    """path -> blob id as reported by git itself."""
+    result = {}
+    for line in git(repo, "ls-files", "-s").splitlines():
+        meta, path = line.split("\t", 1)
+        result[path] = meta.split()[1]
+    return result
+
+
+class TestGitIndex:
+    """Test the local .git/index reader."""
+
+    @pytest.mark.parametrize("version", ["2", "3", "4"])
+    def test_parse_matches_git_ls_files(self, git_repo, version):
+        """Test parsed paths and blob ids agree with git for each index version."""
+        git(git_repo, "update-index", "--index-version", version)
+        index = GitIndex.read(git_repo / ".git")
+        assert {e.path: e.blob_id for e in index.entries} == ls_files_stage(git_repo)
+
+    def test_parse_rejects_non_index(self):
+        """Test parse raises ValueError on foreign data."""
+        with pytest.raises(ValueError):
+            GitIndex.parse(b"not an index at all")
+
+    def test_locate_from_subdirectory(self, git_repo):
+        """Test locate returns the prefix of a root below the worktree top."""
+        git_dir, top, prefix = GitIndex.locate(git_repo / "src")
+        assert git_dir == (git_repo / ".git").resolve()
+        assert top == git_repo.resolve()
+        assert prefix == "src/"
+
+    def test_locate_outside_repository(self, temp_dir):
+        """Test locate returns None when there is no repository."""
+        assert GitIndex.locate(temp_dir) is None
+
+
+class TestGitIndexSnapshot:
+    """Test snapshots built from the git index."""
+
+    def test_snapshot_exposes_blob_ids(self, git_repo, default_config):
+        """Test unchanged tracked files carry their blob id as change key."""
+        snapshot = RepoSnapshot.from_git_index(git_repo, PathPolicy(default_config))
+        blobs = ls_files_stage(git_repo)
+        entry = snapshot.entries["src/main.py"]
+        assert entry.change_key == blobs["src/main.py"]
+        # Untracked node_modules never shows up, without any walk
+        assert not any("node_modules" in rel for rel in snapshot.entries)
+
+    def test_modified_file_has_no_change_key(self, git_repo, default_config):
+        """Test a file edited after staging does not reuse the stale blob id."""
+        (git_repo / "src" / "main.py").write_text("def changed(): pass\n")
+        snapshot = RepoSnapshot.from_git_index(git_repo, PathPolicy(default_config))
+        assert snapshot.entries["src/main.py"].change_key is None
+
+    def test_untracked_scan_honours_gitignore(self, git_repo, default_config):
+        """Test the supplementary scan adds untracked files not in .gitignore."""
+        (git_repo / "new.py").write_text("def new(): pass\n")
+        (git_repo / "debug.log").write_text("noise")
+        (git_repo / ".gitignore").write_text("*.log\n")
+
+        snapshot = RepoSnapshot.from_git_index(
+            git_repo, PathPolicy(default_config), include_untracked=True
+        )
+        assert "new.py" in snapshot.entries
+        assert snapshot.entries["new.py"].change_key is None
+        assert "debug.log" not in snapshot.entries
+        assert snapshot.untracked == 1
+
+    def test_generate_with_git_index(self, git_repo):
+        """Test generate() uses the git index as its file source."""
+        generator = SkeletonGenerator(git_repo, Config(git_index=True))
+        output = generator.generate()
+        assert "<file path='src/main.py'" in output
+        assert "Source: git index (6 tracked, 0 untracked)" in output
+        assert generator.stats["excluded"] == 1  # tests/
+
+    def test_fresh_clone_hits_cache_by_blob_id(self, git_repo, tmp_path):
+        """Test a clone's skeletons come from the cache without being read."""
+        config = Config(git_index=True, cache_dir=str(tmp_path / "cache"))
+        first = SkeletonGenerator(git_repo, config)
+        expected = first.generate()
+        clone = tmp_path / "clone"
+        git(tmp_path, "clone", "-q", str(git_repo), str(clone))
+        # New paths and mtimes (aged, so no entry is racily clean): only the
+        # blob ids still match the first run
+        for path in git(clone, "ls-files").splitlines():
+            os.utime(clone / path, (1_000_000_000, 1_000_000_000))
+        git(clone, "update-index", "--refresh")
+        with patch.object(
+            CodeExtractor, "open_source", side_effect=AssertionError("source read")
+        ):
+            second = SkeletonGenerator(clone, config)
+            output = second.generate()
+
+        assert second.stats["cache_hits"] == first.stats["skeleton"] > 0
+        assert second.stats["cache_misses"] == 0
+        skeletons = expected[expected.index("<skeleton>") :]
+        assert output[output.index("<skeleton>") :] == skeletons
+
+class TestGitIgnore:
+    """Test the minimal .gitignore matcher."""
+
+    def test_rules(self):
+        """Test negation, anchoring, directory-only rules and '**'."""
+        ignore = GitIgnore(["*.log", "!keep.log", "/build", "out/", "docs/**/*.tmp"])
+        assert ignore.match("a/b/debug.log")
+        assert not ignore.match("keep.log")
+        assert ignore.match("build", is_dir=True)
+        assert not ignore.match("src/build", is_dir=True)
+        assert ignore.match("src/out", is_dir=True)
+        assert not ignore.match("src/out")
+        assert ignore.match("docs/a/b/x.tmp")
+        assert ignore.match("docs/x.tmp")
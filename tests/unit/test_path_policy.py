@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Test module: test_path_policy
+"""
+import sys
+from pathlib import Path
+import pytest
+
+# Add project root to sys.path
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from codebase_skeleton import PathPolicy, Config
+
+
+class TestPathPolicy:
+    """Test compiled path rules."""
+
+    @pytest.mark.parametrize(
+        "rel, expected",
+        [
+            ("node_modules/lib/index.js", PathPolicy.IGNORED),
+            ("src/main.pyc", PathPolicy.IGNORED),
+            ("pkg.egg-info/PKG-INFO", PathPolicy.IGNORED),
+            (".git/HEAD", PathPolicy.IGNORED),
+            ("tests/test_app.py", PathPolicy.EXCLUDED),
+            ("app/db/migrate/001.rb", PathPolicy.EXCLUDED),
+            ("src/main.py", PathPolicy.VISIBLE),
+            ("README.md", PathPolicy.VISIBLE),
+            ("src/environment.py", PathPolicy.VISIBLE),
+        ],
+    )
+    def test_default_states(self, default_config, rel, expected):
+        """Test default patterns and EXCLUDE_DIRS map to the right states."""
+        assert PathPolicy(default_config).state(rel) == expected
+
+    def test_custom_exclude_patterns(self):
+        """Test names, globs and multi-component patterns from Config.exclude."""
+        policy = PathPolicy(Config(exclude={"data/", "*.js", "src/legacy"}))
+        assert policy.is_ignored("data", is_dir=True)
+        assert policy.is_ignored("data/db.sqlite3")
+        assert policy.is_ignored("web/app.js")
+        assert policy.is_ignored("src/legacy/old.py")
+        assert not policy.is_excluded("src/new/legacy.py")
+        # Components match whole names, not substrings
+        assert not policy.is_excluded("metadata/schema.py")
+
+    def test_directory_decisions_are_cached(self, default_config):
+        """Test files reuse the cached decision for their directory."""
+        policy = PathPolicy(default_config)
+        policy.is_excluded("a/b/c/file.py")
+        assert {"a", "a/b", "a/b/c"} <= set(policy._dir_cache)
+        assert policy.is_excluded("a/b/tests/file.py")
+        assert policy._dir_cache["a/b/tests"][0] == PathPolicy.EXCLUDED
+
+    def test_full_content_rules(self):
+        """Test include_full, include_patterns, skeleton_only and defaults."""
+        config = Config(
+            include_full={"./src/settings.py"},
+            include_patterns={"*.toml", "config/*.yml"},
+            skeleton_only={"lib/"},
+        )
+        policy = PathPolicy(config)
+        assert policy.is_full_content("src/settings.py")
+        assert policy.is_full_content("conf/app.toml")
+        assert policy.is_full_content("deploy/config/prod.yml")
+        assert not policy.is_full_content("deploy/prod.yml")
+        assert policy.is_full_content("README.md")
+        # skeleton_only directories never get full content by pattern or default
+        assert not policy.is_full_content("lib/README.md")
+        assert not policy.is_full_content("lib/sub/app.toml")
+
+    def test_hybrid_mode_only_default_full_patterns(self):
+        """Test hybrid mode only uses DEFAULT_FULL_PATTERNS."""
+        policy = PathPolicy(Config(mode="hybrid", include_full={"src/main.py"}))
+        assert policy.is_full_content("package.json")
+        assert not policy.is_full_content("src/main.py")
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Test module: test_record_output
+"""
+import io
+import json
+import re
+import sys
+from pathlib import Path
+import pytest
+from unittest.mock import patch
+
+# Add project root to sys.path
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from codebase_skeleton import (
+    Config,
+    FileProcessor,
+    MsgPack,
+    RecordWriter,
+    SkeletonGenerator,
+    main,
+)
+
+
+def records(root: Path, **options):
+    out = io.StringIO()
+    SkeletonGenerator(root, Config(format="jsonl", **options)).write(out)
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+class TestRecordOutput:
+    """Test --format=jsonl and --format=msgpack."""
+
+    def test_jsonl_records(self, mock_codebase):
+        """Test header records, one record per file and the stats trailer."""
+        lines = records(mock_codebase, max_tokens=0)
+        assert [r["type"] for r in lines[:2]] == ["codebase", "tree"]
+        assert lines[0]["project"] == mock_codebase.name
+        assert lines[-1]["type"] == "stats"
+        files = {r["path"]: r for r in lines if r["type"] == "file"}
+        assert set(files) == {
+            ".gitignore",
+            "README.md",
+            "requirements.txt",
+            "src/main.py",
+            "src/utils.js",
+        }
+        main = files["src/main.py"]
+        assert (main["mode"], main["language"]) == ("skeleton", "python")
+        assert main["loc"] > 0 and main["tokens"] > 0
+        assert "def main" in main["content"]
+        assert files["README.md"]["mode"] == "full"
+        assert files["README.md"]["language"] == "markdown"
+        assert lines[-1]["total_tokens"] == sum(r["tokens"] for r in files.values())
+
+    def test_records_match_text_output(self, mock_codebase):
+        """Test records carry the same files and tokens as the text output."""
+        text = SkeletonGenerator(mock_codebase, Config(max_tokens=0)).generate()
+        tagged = dict(re.findall(r"<file path='([^']+)'[^>]*?tokens='(\d+)'", text))
+        files = [r for r in records(mock_codebase, max_tokens=0) if r["type"] == "file"]
+        assert {r["path"]: str(r["tokens"]) for r in files} == tagged
+
+    def test_budget_records(self, temp_dir):
+        """Test omitted files are records, and stats report the budget."""
+        for i in range(30):
+            (temp_dir / f"mod{i}.py").write_text(f"def f{i}(x):\n    return x\n" * 40)
+        lines = records(temp_dir, max_tokens=800)
+        omitted = [r for r in lines if r["type"] == "omitted"]
+        assert omitted and all(r["tokens"] > 0 for r in omitted)
+        assert lines[-1]["omitted"] == len(omitted)
+        assert lines[-1]["budget"] == 800
+
+    def test_records_are_streamed(self, temp_dir, monkeypatch):
+        """Test file records are flushed before later files are processed."""
+        monkeypatch.setattr(SkeletonGenerator, "STREAM_BATCH", 2)
+        for i in range(5):
+            (temp_dir / f"m{i}.py").write_text(f"def f{i}():\n    pass\n")
+        events = []
+        process = FileProcessor.process
+
+        def record(self, path, *args):
+            events.append(("process", path.name))
+            return process(self, path, *args)
+
+        class Recorder(io.StringIO):
+            def flush(self):
+                events.append(("flush", self.getvalue().count('"type":"file"')))
+
+        monkeypatch.setattr(FileProcessor, "process", record)
+        generator = SkeletonGenerator(temp_dir, Config(max_tokens=0, format="jsonl"))
+        generator.write(Recorder())
+
+        assert events.index(("flush", 2)) < events.index(("process", "m2.py"))
+
+    def test_records_are_streamed_with_default_flags(self, temp_dir, monkeypatch):
+        """Test --format=jsonl streams without an explicit --max-tokens."""
+        monkeypatch.setattr(SkeletonGenerator, "STREAM_BATCH", 2)
+        for i in range(5):
+            (temp_dir / f"m{i}.py").write_text(f"def f{i}():\n    pass\n")
+        events = []
+        process = FileProcessor.process
+
+        def record(self, path, *args):
+            events.append(("process", path.name))
+            return process(self, path, *args)
+
+        class Recorder(io.StringIO):
+            def flush(self):
+                events.append(("flush", self.getvalue().count('"type":"file"')))
+
+        monkeypatch.setattr(FileProcessor, "process", record)
+        argv = ["codebase_skeleton.py", str(temp_dir), "--format=jsonl"]
+        with patch("sys.argv", argv), patch("sys.stdout", Recorder()):
+            main()
+
+        assert events.index(("flush", 2)) < events.index(("process", "m2.py"))
+
+    def test_msgpack_matches_jsonl(self, mock_codebase):
+        """Test the MessagePack stream decodes to the JSON Lines records."""
+        out = io.BytesIO()
+        config = Config(max_tokens=0, format="msgpack")
+        SkeletonGenerator(mock_codebase, config).write(out)
+        decoded = list(MsgPack.unpack(out.getvalue()))
+        expected = records(mock_codebase, max_tokens=0)
+        assert decoded == expected
+
+    def test_language(self):
+        """Test languages come from file names and extensions."""
+        assert RecordWriter.language("a/b.tsx") == "tsx"
+        assert RecordWriter.language("Dockerfile") == "dockerfile"
+        assert RecordWriter.language("x/data.PARQ") == "parq"
+        assert RecordWriter.language(".env") == "text"
+        assert RecordWriter.language("LICENSE") == "text"
+
+
+class TestMsgPack:
+    """Test the stdlib MessagePack codec."""
+
+    @pytest.mark.parametrize(
+        "value",
+        [
+            None,
+            True,
+            False,
+            0,
+            127,
+            128,
+            65536,
+            2**64 - 1,
+            -1,
+            -33,
+            -(2**63),
+            1.5,
+            "",
+            "é" * 40,
+            "x" * 70000,
+            b"\x00\xff" * 200,
+            list(range(20)),
+            {"k": [{"nested": None}]},
+            {str(i): i for i in range(20)},
+        ],
+    )
+    def test_round_trip(self, value):
+        """Test values survive pack and unpack."""
+        assert list(MsgPack.unpack(MsgPack.pack(value))) == [value]
+
+    def test_encoding_is_standard(self):
+        """Test the smallest standard encoding is chosen."""
+        assert MsgPack.pack({"a": [1, -1, None]}) == b"\x81\xa1a\x93\x01\xff\xc0"
+        assert MsgPack.pack(256) == b"\xcd\x01\x00"
+        assert MsgPack.pack("x" * 40)[:2] == b"\xd9\x28"
+
+    def test_stream_of_objects(self):
+        """Test concatenated objects are read back one by one."""
+        data = MsgPack.pack({"type": "a"}) + MsgPack.pack({"type": "b"})
+        assert [r["type"] for r in MsgPack.unpack(data)] == ["a", "b"]
+
+    def test_unsupported_type(self):
+        """Test unknown objects and codes are rejected."""
+        with pytest.raises(TypeError):
+            MsgPack.pack(object())
+        with pytest.raises(ValueError):
+            list(MsgPack.unpack(b"\xc7\x01\x00\x00"))
+
+
+class TestAttributeEscaping:
+    """Test paths are escaped in text output attributes."""
+
+    def test_path_attribute_is_escaped(self, temp_dir):
+        """Test quotes, ampersands and angle brackets in paths are escaped."""
+        (temp_dir / "it's & <x>.py").write_text("def f():\n    pass\n")
+        output = SkeletonGenerator(temp_dir, Config(max_tokens=0)).generate()
+        assert "<file path='it&apos;s &amp; &lt;x>.py' loc=" in output
+        assert "<file path='it's" not in output
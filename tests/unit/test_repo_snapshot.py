@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test module: test_repo_snapshot
+"""
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+# Add project root to sys.path
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+import codebase_skeleton
+from codebase_skeleton import (
+    Config,
+    PathPolicy,
+    RepoSnapshot,
+    SkeletonGenerator,
+    TreeBuilder,
+    read_path_list,
+)
+
+
+class TestRepoSnapshot:
+    """Test the single-pass repository snapshot."""
+
+    def test_snapshot_indexes_sizes_and_mtimes(self, mock_codebase, default_config):
+        """Test files carry size and mtime from the walk."""
+        snapshot = RepoSnapshot.scan(mock_codebase, PathPolicy(default_config))
+        readme = snapshot.entries["README.md"]
+        stat = (mock_codebase / "README.md").stat()
+        assert not readme.is_dir
+        assert readme.size == stat.st_size
+        assert readme.mtime == stat.st_mtime
+        assert snapshot.entries["src"].is_dir
+
+    def test_snapshot_files_are_visible_only(self, mock_codebase, default_config):
+        """Test files() yields only files selected for processing."""
+        snapshot = RepoSnapshot.scan(
+            mock_codebase, PathPolicy(default_config), tree_depth=5
+        )
+        rels = [entry.rel for entry in snapshot.files()]
+        assert "src/main.py" in rels
+        assert "tests/test_main.py" not in rels
+        assert "tests/test_main.py" in snapshot.entries
+
+    def test_render_lists_snapshot_entries(self, mock_codebase, default_config):
+        """Test the snapshot renders as a tree without touching the filesystem."""
+        snapshot = RepoSnapshot.scan(
+            mock_codebase, PathPolicy(default_config), tree_depth=5
+        )
+        with patch("os.scandir", side_effect=AssertionError("walked again")):
+            rendered = TreeBuilder.render(snapshot)
+        assert rendered.splitlines()[0] == f"{mock_codebase.name}/"
+        assert "├── src/" in rendered
+        assert "main.py" in rendered
+        assert "node_modules" not in rendered
+
+    def test_generate_walks_repository_once(self, mock_codebase, default_config):
+        """Test generate() scans the filesystem in a single pass."""
+        calls = []
+        original_scandir = codebase_skeleton.os.scandir
+
+        def counting_scandir(path):
+            calls.append(Path(path))
+            return original_scandir(path)
+
+        with patch("codebase_skeleton.os.scandir", side_effect=counting_scandir):
+            output = SkeletonGenerator(mock_codebase, default_config).generate()
+
+        assert "<file path='src/main.py'" in output
+        assert len(calls) == len(set(calls))
+
+
+class TestFilesFrom:
+    """Test snapshots built from an explicit --files-from list."""
+
+    def test_read_path_list_newline_and_nul(self, temp_dir):
+        """Test both separators are accepted and blank entries dropped."""
+        (temp_dir / "lines.txt").write_bytes(b"src/a.py\r\nsrc/b.py\n\n")
+        (temp_dir / "nul.txt").write_bytes(b"src/a.py\0with space.py\0")
+
+        assert read_path_list(str(temp_dir / "lines.txt")) == ["src/a.py", "src/b.py"]
+        assert read_path_list(str(temp_dir / "nul.txt")) == [
+            "src/a.py",
+            "with space.py",
+        ]
+
+    def test_from_paths_skips_exclusion_and_walk(self, mock_codebase):
+        """Test listed paths are processed as given, even inside excluded dirs."""
+        with patch("codebase_skeleton.os.scandir") as scandir:
+            snapshot = RepoSnapshot.from_paths(
+                mock_codebase,
+                ["./src/main.py", "node_modules/some_lib.js", "src", "missing.py"],
+            )
+        scandir.assert_not_called()
+
+        rels = [entry.rel for entry in snapshot.files()]
+        assert rels == ["src/main.py", "node_modules/some_lib.js"]
+        assert snapshot.entries["src"].is_dir
+        assert not snapshot.excluded
+
+    def test_generate_renders_tree_from_list(self, mock_codebase):
+        """Test the <tree> section shows only the listed files."""
+        listing = mock_codebase / "files.txt"
+        listing.write_text("src/utils.js\nREADME.md\n")
+
+        output = SkeletonGenerator(
+            mock_codebase, Config(files_from=str(listing))
+        ).generate()
+
+        tree = output.split("<tree>")[1].split("</tree>")[0]
+        assert "utils.js" in tree and "README.md" in tree
+        assert "main.py" not in tree
+        assert "Source: file list (2 files)" in output
+        assert "<file path='src/utils.js'" in output
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Test module: test_sharding
+"""
+import json
+import re
+import sys
+from pathlib import Path
+import pytest
+
+# Add project root to sys.path
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from codebase_skeleton import (
+    Config,
+    ShardPacker,
+    SkeletonGenerator,
+    TokenCounter,
+    write_shards,
+)
+
+
+class TestShardPacker:
+    """Test bin-packing files into shards."""
+
+    def test_small_directory_is_one_unit(self):
+        """Test a directory that fits is never split."""
+        costs = {"a/x.py": 30, "a/y.py": 30, "b/z.py": 50, "c.py": 10}
+        # The root's own files come before its subdirectories
+        assert ShardPacker(100).pack(costs) == [
+            ["c.py", "a/x.py", "a/y.py"],
+            ["b/z.py"],
+        ]
+
+    def test_large_directory_splits_into_subdirectories(self):
+        """Test an oversized directory is split along its subdirectories."""
+        costs = {
+            "src/a/1.py": 40,
+            "src/a/2.py": 40,
+            "src/b/1.py": 60,
+            "src/m.py": 10,
+        }
+        units = list(ShardPacker(100).units(sorted(costs), costs))
+        assert units == [["src/m.py"], ["src/a/1.py", "src/a/2.py"], ["src/b/1.py"]]
+
+    def test_first_fit_backfills_earlier_shards(self):
+        """Test a later unit goes into the first shard with room."""
+        costs = {"a/1.py": 70, "b/1.py": 70, "c/1.py": 30}
+        assert ShardPacker(100).pack(costs) == [["a/1.py", "c/1.py"], ["b/1.py"]]
+
+    def test_oversized_file_gets_own_shard(self):
+        """Test a file larger than a shard is packed alone."""
+        costs = {"big.py": 500, "small.py": 10}
+        assert ShardPacker(100).pack(costs) == [["big.py"], ["small.py"]]
+
+    def test_for_count_balances(self):
+        """Test --shard-count finds the least capacity giving K shards."""
+        costs = {f"d{i}/m.py": 10 for i in range(10)}
+        packer = ShardPacker.for_count(costs, 3)
+        shards = packer.pack(costs)
+        assert len(shards) == 3
+        assert packer.capacity == 40
+
+
+class TestShardedOutput:
+    """Test sharded output documents and the manifest."""
+
+    @pytest.fixture
+    def repo(self, temp_dir):
+        (temp_dir / "README.md").write_text("# Demo\n")
+        for package in ("alpha", "beta", "gamma"):
+            (temp_dir / package).mkdir()
+            for i in range(8):
+                (temp_dir / package / f"mod{i}.py").write_text(
+                    f'def f{i}(x):\n    """Doc {i}."""\n    return x\n' * 10
+                )
+        return temp_dir
+
+    def test_shards_fit_and_cover_every_file(self, repo, mock_tiktoken_unavailable):
+        """Test each shard fits --shard-tokens and every file is in one shard."""
+        config = Config(max_tokens=0, shard_tokens=2000)
+        generator = SkeletonGenerator(repo, config)
+        shards, omitted = generator.generate_shards()
+
+        assert len(shards) > 1 and not omitted
+        counter = TokenCounter()
+        seen = []
+        for index, shard in enumerate(shards, 1):
+            assert counter.count(shard.text) <= config.shard_tokens
+            assert shard.text.startswith(
+                f"<codebase project='{repo.name}' shard='{index}' of='{len(shards)}'>"
+            )
+            paths = re.findall(r"<file path='([^']+)'", shard.text)
+            assert paths == shard.paths
+            seen.extend(paths)
+        packages = ("alpha", "beta", "gamma")
+        modules = [f"{p}/mod{i}.py" for p in packages for i in range(8)]
+        assert sorted(seen) == sorted(["README.md"] + modules)
+
+    def test_directories_stay_together(self, repo):
+        """Test files of a directory that fits in a shard share one shard."""
+        generator = SkeletonGenerator(repo, Config(max_tokens=0, shard_tokens=2000))
+        shards, _ = generator.generate_shards()
+        for package in ("alpha", "beta", "gamma"):
+            holders = [
+                shard
+                for shard in shards
+                if any(path.startswith(package) for path in shard.paths)
+            ]
+            assert len(holders) == 1
+
+    def test_every_shard_repeats_the_digest(self, repo):
+        """Test all shards carry the same tree digest."""
+        generator = SkeletonGenerator(repo, Config(max_tokens=0, shard_count=3))
+        shards, _ = generator.generate_shards()
+        assert len(shards) == 3
+        digests = {
+            re.search(r"<tree-digest.*?</tree-digest>", s.text, re.S).group()
+            for s in shards
+        }
+        assert len(digests) == 1
+        digest = digests.pop()
+        assert f"id='{generator.tree_id()}' files='25'" in digest
+        assert re.search(
+            r"<directory path='alpha' files='8' tokens='\d+' shards='\d'/>", digest
+        )
+
+    def test_header_larger_than_shard(self, repo):
+        """Test a shard budget smaller than the header is an error."""
+        generator = SkeletonGenerator(repo, Config(max_tokens=0, shard_tokens=50))
+        with pytest.raises(ValueError, match="no room for files"):
+            generator.generate_shards()
+
+    def test_write_shards_and_manifest(self, repo, temp_dir):
+        """Test shard files are numbered and the manifest lists their paths."""
+        generator = SkeletonGenerator(repo, Config(max_tokens=0, shard_count=2))
+        (temp_dir / "out").mkdir()
+        written = write_shards(generator, temp_dir / "out" / "skel.txt")
+        assert [p.name for p in written] == [
+            "skel.01.txt",
+            "skel.02.txt",
+            "skel.manifest.json",
+        ]
+        manifest = json.loads(written[-1].read_text())
+        assert manifest["tree_digest"] == generator.tree_id()
+        for entry, path in zip(manifest["shards"], written):
+            assert entry["file"] == path.name
+            text = path.read_text()
+            assert re.findall(r"<file path='([^']+)'", text) == entry["paths"]
+            assert entry["files"] == len(entry["paths"])
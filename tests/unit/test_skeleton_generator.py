@@ -2,7 +2,11 @@
 """
 Test module: test_skeleton_generator
 """
+import io
+import os
+import re
 import sys
+from concurrent.futures import Future
 from pathlib import Path
 import pytest
 from unittest.mock import patch
@@ -11,7 +15,14 @@ from unittest.mock import patch
 project_root = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(project_root))
 
-from codebase_skeleton import SkeletonGenerator, Config
+from codebase_skeleton import (
+    CodeExtractor,
+    ContentSniffer,
+    FileProcessor,
+    SkeletonCache,
+    SkeletonGenerator,
+    Config,
+)
 
 
 class TestSkeletonGenerator:
@@ -102,6 +113,21 @@ class TestSkeletonGeneratorGenerate:
         # Verify exclusions happened via stats instead
         assert generator.stats["excluded"] > 0
 
+    def test_overview_never_reads_files(self, mock_codebase):
+        """Test overview lists files from stat alone, without reading them."""
+        generator = SkeletonGenerator(mock_codebase, Config(mode="overview"))
+        with patch.object(FileProcessor, "process") as process, patch.object(
+            CodeExtractor, "extract_outline"
+        ) as extract, patch("builtins.open", side_effect=AssertionError):
+            output = generator.generate()
+
+        process.assert_not_called()
+        extract.assert_not_called()
+        assert generator.stats["files_processed"] == 0
+        assert generator.stats["listed"] == 5
+        assert re.search(r"Files: 5 listed, not read \(\d+ B, ~\d+ lines", output)
+        assert "Files processed" not in output
+
     def test_generate_updates_stats_counters(self, mock_codebase, default_config):
         """Test that stats counters are updated correctly."""
         generator = SkeletonGenerator(mock_codebase, default_config)
@@ -111,7 +137,7 @@ class TestSkeletonGeneratorGenerate:
         # Based on mock_codebase:
         # Full: README.md, requirements.txt, .gitignore (3)
         # Skeleton: src/main.py, src/utils.js (2)
-        # Excluded: tests/test_main.py, node_modules/some_lib.js (2)
+        # Excluded entries: tests/test_main.py, node_modules/ (pruned whole) (2)
         # Total processed = 3 + 2 = 5
         assert stats["files_processed"] == 5
         assert stats["full_content"] == 3
@@ -123,13 +149,21 @@ class TestSkeletonGeneratorGenerate:
         """Test generation continues on file read errors."""
 
         original_read_text = Path.read_text
+        original_read_bytes = Path.read_bytes
 
         def mock_read_text(self, *args, **kwargs):
             if self.name == "main.py":
                 raise IOError("mock read error")
             return original_read_text(self, *args, **kwargs)
 
-        with patch("pathlib.Path.read_text", mock_read_text):
+        def mock_read_bytes(self):
+            if self.name == "main.py":
+                raise IOError("mock read error")
+            return original_read_bytes(self)
+
+        with patch("pathlib.Path.read_text", mock_read_text), patch(
+            "pathlib.Path.read_bytes", mock_read_bytes
+        ):
             generator = SkeletonGenerator(mock_codebase, default_config)
             output = generator.generate()
 
@@ -173,3 +207,302 @@ class TestSkeletonGeneratorGenerate:
 
         assert "<excluded>" in output_with_flag
         assert "<directory path='tests' files='1'/>" in output_with_flag
+
+    @pytest.mark.parametrize(
+        "show_excluded, label", [(False, "1 entry"), (True, "3 files")]
+    )
+    def test_excluded_stat_names_what_it_counts(self, tmp_path, show_excluded, label):
+        """Test pruned directories are reported as entries, not files."""
+        (tmp_path / "app.py").write_text("x = 1\n")
+        (tmp_path / "node_modules" / "lib").mkdir(parents=True)
+        for name in ("a.js", "b.js", "lib/c.js"):
+            (tmp_path / "node_modules" / name).write_text("var x;\n")
+        generator = SkeletonGenerator(tmp_path, Config(show_excluded=show_excluded))
+        output = generator.generate()
+
+        assert generator.stats["excluded"] == int(label.split()[0])
+        assert f"Excluded: {label}\n" in output
+        assert "Skeleton: 1 file\n" in output
+
+class TestContentSniffer:
+    """Test the binary/text gate applied before files are read."""
+
+    @pytest.mark.parametrize(
+        "head, expected",
+        [
+            (b"def main():\n    pass\n", False),
+            ("café naïve\n".encode("utf-8"), False),
+            ("é".encode("utf-8")[:1], False),  # Cut mid-character
+            (b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR", True),
+            (b"SQLite format 3\x00", True),
+            (bytes(range(1, 32)) * 4, True),
+            (b"", False),
+        ],
+    )
+    def test_looks_binary(self, head, expected):
+        """Test the NUL/UTF-8 head sniff."""
+        assert ContentSniffer.looks_binary(head) is expected
+
+    def test_extension_lists_skip_sniffing(self, temp_dir, default_config):
+        """Test allow- and deny-listed extensions are decided without opening."""
+        sniffer = ContentSniffer(default_config)
+        with patch("builtins.open", side_effect=AssertionError("opened")):
+            assert sniffer.is_binary(temp_dir / "logo.PNG")
+            assert not sniffer.is_binary(temp_dir / "app.py")
+
+    def test_generate_skips_binary_files(self, mock_codebase, default_config):
+        """Test binary files are listed in the tree but never read or counted."""
+        (mock_codebase / "src" / "logo.png").write_bytes(b"\x89PNG\r\n\x1a\n")
+        (mock_codebase / "src" / "blob.dat").write_bytes(b"abc\x00\x01\x02" * 100)
+        (mock_codebase / "src" / "notes.conf").write_text("key = value\n")
+
+        generator = SkeletonGenerator(mock_codebase, default_config)
+        output = generator.generate()
+
+        assert "logo.png" in output.split("</tree>")[0]
+        assert "<file path='src/logo.png'" not in output
+        assert "<file path='src/blob.dat'" not in output
+        assert "<file path='src/notes.conf'" in output
+        assert generator.stats["binary"] == 2
+        assert "Binary: 2 files skipped" in output
+
+
+class TestBoundedReads:
+    """Test head-only reads for data formats and oversized files."""
+
+    def test_data_file_read_head_only(self, mock_codebase, default_config):
+        """Test a large CSV is read head-only with an exact streamed loc."""
+        rows = "".join(f"{i},value_{i}\n" for i in range(20000))
+        (mock_codebase / "src" / "fixture.csv").write_text(rows)
+
+        generator = SkeletonGenerator(mock_codebase, default_config)
+        output = generator.generate()
+
+        section = output.split("<file path='src/fixture.csv'")[1].split("</file>")[0]
+        assert "loc='20001'" in section
+        assert "truncated='true'" in section
+        assert "# [Truncated: read" in section
+        assert "19999,value_19999" not in section
+        assert generator.stats["truncated"] == 1
+
+    def test_max_file_bytes_limits_source_files(self, mock_codebase):
+        """Test source files over max_file_bytes keep a skeleton of their head."""
+        body = "".join(f"def func_{i}():\n    return {i}\n\n" for i in range(500))
+        (mock_codebase / "src" / "big.py").write_text(body)
+
+        output = SkeletonGenerator(
+            mock_codebase, Config(max_file_bytes=1024)
+        ).generate()
+
+        section = output.split("<file path='src/big.py'")[1].split("</file>")[0]
+        assert "def func_0" in section
+        assert "def func_499" not in section
+        assert "loc='1501'" in section
+
+    def test_max_file_bytes_zero_disables_limit(self, mock_codebase):
+        """Test max_file_bytes=0 reads code files whole."""
+        body = "".join(f"def func_{i}():\n    return {i}\n\n" for i in range(500))
+        (mock_codebase / "src" / "big.py").write_text(body)
+
+        generator = SkeletonGenerator(mock_codebase, Config(max_file_bytes=0))
+        output = generator.generate()
+
+        assert "def func_499" in output
+        assert generator.stats["truncated"] == 0
+
+    def test_full_content_data_file_not_head_only(self, mock_codebase):
+        """Test data files selected for full content are read whole."""
+        (mock_codebase / "package.json").write_text(
+            '{"name": "x", "pad": "' + "a" * 40000 + '"}'
+        )
+        output = SkeletonGenerator(mock_codebase, Config()).generate()
+
+        section = output.split("<file path='package.json'")[1].split("</file>")[0]
+        assert "truncated" not in section
+
+
+class TestParallelExtraction:
+    """Test --jobs worker pools merge results like a serial run."""
+
+    @pytest.mark.parametrize("backend", ["thread", "process"])
+    def test_parallel_output_matches_serial(self, mock_codebase, backend):
+        """Test pooled extraction is deterministic and aggregates stats."""
+        for i in range(6):
+            (mock_codebase / "src" / f"mod_{i}.py").write_text(
+                f"def func_{i}(x):\n    return x * {i}\n"
+            )
+        (mock_codebase / "src" / "logo.png").write_bytes(b"\x89PNG")
+
+        serial = SkeletonGenerator(mock_codebase, Config())
+        parallel = SkeletonGenerator(mock_codebase, Config(jobs=3, backend=backend))
+
+        assert parallel.generate() == serial.generate()
+        assert parallel.stats == serial.stats
+        assert parallel.stats["skeleton"] == 8
+        assert parallel.stats["binary"] == 1
+
+    def test_parallel_read_errors_are_reported(self, mock_codebase, capsys):
+        """Test a failing file is skipped and reported from a worker thread."""
+        (mock_codebase / "src" / "broken.txt").write_text("x")
+        original_read_text = Path.read_text
+
+        def mock_read_text(self, *args, **kwargs):
+            if self.name == "broken.txt":
+                raise IOError("mock read error")
+            return original_read_text(self, *args, **kwargs)
+
+        generator = SkeletonGenerator(mock_codebase, Config(jobs=2, backend="thread"))
+        with patch("pathlib.Path.read_text", mock_read_text):
+            output = generator.generate()
+
+        assert "<file path='src/broken.txt'" not in output
+        assert generator.stats["files_processed"] == 5
+        assert "Warning: Could not read" in capsys.readouterr().err
+
+
+class TestStreaming:
+    """Test streamed output and bounded in-flight state."""
+
+    class Recorder(io.StringIO):
+        """A stream that logs each flush alongside other events."""
+
+        def __init__(self, events):
+            super().__init__()
+            self.events = events
+
+        def flush(self):
+            self.events.append(("flush", self.getvalue().count("<file path=")))
+
+    def test_stream_has_same_files_and_stats_trailer(self, mock_codebase):
+        """Test streamed output holds the same files, with <stats> at the end."""
+        config = Config(max_tokens=0)
+        buffered = SkeletonGenerator(mock_codebase, config).generate()
+        out = io.StringIO()
+        SkeletonGenerator(mock_codebase, config).write(out, stream=True)
+        streamed = out.getvalue()
+
+        def files(text):
+            blocks = text.split("\n<file ")[1:]
+            return sorted(block.split("</file>")[0] for block in blocks)
+
+        assert files(streamed) == files(buffered)
+        assert streamed.index("</metadata>") < streamed.index("<file path=")
+        assert streamed.index("</skeleton>") < streamed.index("<stats>")
+        assert streamed.rstrip().endswith("</total-tokens>\n</codebase>")
+
+    def test_files_written_before_processing_ends(self, temp_dir, monkeypatch):
+        """Test each batch is flushed before later files are processed."""
+        monkeypatch.setattr(SkeletonGenerator, "STREAM_BATCH", 2)
+        for i in range(5):
+            (temp_dir / f"m{i}.py").write_text(f"def f{i}():\n    pass\n")
+        events = []
+        process = FileProcessor.process
+
+        def record(self, path, *args):
+            events.append(("process", path.name))
+            return process(self, path, *args)
+
+        monkeypatch.setattr(FileProcessor, "process", record)
+        generator = SkeletonGenerator(temp_dir, Config(max_tokens=0))
+        generator.write(self.Recorder(events), stream=True)
+
+        assert events.index(("flush", 2)) < events.index(("process", "m2.py"))
+        assert events.index(("flush", 4)) < events.index(("process", "m4.py"))
+
+    def test_pool_results_are_windowed(self):
+        """Test a pool is kept only a window of chunks ahead of the reader."""
+        submitted = []
+
+        class Pool:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                pass
+
+            def submit(self, fn, chunk):
+                submitted.append(chunk)
+                future = Future()
+                future.set_result(fn(chunk))
+                return future
+
+        chunks = [[i, -i] for i in range(1, 6)]
+        results = SkeletonGenerator._windowed(Pool(), list, chunks, 2)
+        assert next(results) == 1
+        assert len(submitted) == 2
+        assert list(results) == [-1, 2, -2, 3, -3, 4, -4, 5, -5]
+
+
+class TestSkeletonCache:
+    """Test the persistent skeleton cache."""
+
+    def test_second_run_hits_without_reading(self, mock_codebase, tmp_path):
+        """Test unchanged files are served by the stat fast path."""
+        config = Config(cache_dir=str(tmp_path / "cache"))
+        first = SkeletonGenerator(mock_codebase, config)
+        first_output = first.generate()
+        assert first.stats["cache_hits"] == 0
+        assert first.stats["cache_misses"] == 2
+        assert "Cache: 0 hits, 2 misses" in first_output
+
+        second = SkeletonGenerator(mock_codebase, config)
+        with patch(
+            "codebase_skeleton.CodeExtractor.open_source",
+            side_effect=AssertionError("source read"),
+        ):
+            second_output = second.generate()
+
+        assert second.stats["cache_hits"] == 2
+        assert second_output.replace("2 hits, 0 misses", "0 hits, 2 misses") == (
+            first_output
+        )
+
+    def test_touched_file_hits_by_content(self, mock_codebase, tmp_path):
+        """Test a changed mtime with identical bytes falls back to the content key."""
+        config = Config(cache_dir=str(tmp_path / "cache"))
+        SkeletonGenerator(mock_codebase, config).generate()
+
+        main_py = mock_codebase / "src" / "main.py"
+        os.utime(main_py, (1, 1))
+        generator = SkeletonGenerator(mock_codebase, config)
+        generator.generate()
+        assert generator.stats["cache_hits"] == 2
+
+        main_py.write_text("def changed():\n    pass\n")
+        generator = SkeletonGenerator(mock_codebase, config)
+        output = generator.generate()
+        assert generator.stats["cache_misses"] == 1
+        assert "def changed():" in output
+
+    def test_fingerprint_separates_extractors(self, temp_dir):
+        """Test entries from a different extractor version are not reused."""
+        cache_a = SkeletonCache(temp_dir, 1 << 20, "a")
+        cache_b = SkeletonCache(temp_dir, 1 << 20, "b")
+        key = cache_a.content_key(".py", b"x = 1")
+        cache_a.put(key, {"skeleton": "x = 1", "loc": 1, "tokens": 1})
+
+        assert cache_a.get(key)["skeleton"] == "x = 1"
+        assert cache_b.get(cache_b.content_key(".py", b"x = 1")) is None
+
+    def test_evict_least_recently_used(self, temp_dir):
+        """Test eviction removes the oldest entries until under the cap."""
+        cache = SkeletonCache(temp_dir, 2500, "fp")
+        keys = []
+        for i in range(5):
+            key = cache.content_key(".py", str(i))
+            cache.put(key, {"skeleton": "x" * 1000, "loc": 1, "tokens": i})
+            os.utime(cache._path("objects", key), (i, i))
+            keys.append(key)
+        cache.get(keys[0])  # Refreshes the oldest entry
+
+        cache.evict()
+
+        remaining = [k for k in keys if cache._path("objects", k).exists()]
+        assert remaining == [keys[0], keys[4]]
+
+    def test_unwritable_cache_does_not_fail(self, mock_codebase, tmp_path):
+        """Test cache write errors are swallowed."""
+        blocker = tmp_path / "not-a-dir"
+        blocker.write_text("")
+        generator = SkeletonGenerator(mock_codebase, Config(cache_dir=str(blocker)))
+        assert "<file path='src/main.py'" in generator.generate()
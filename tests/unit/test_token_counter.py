@@ -2,16 +2,29 @@
 """
 Test module: test_token_counter
 """
+import hashlib
+import json
+import os
+import re
 import sys
+import threading
 from pathlib import Path
+from types import SimpleNamespace
 import pytest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 # Add project root to sys.path
 project_root = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(project_root))
 
-from codebase_skeleton import TokenCounter
+from codebase_skeleton import (
+    Config,
+    SkeletonCache,
+    SkeletonGenerator,
+    TokenCounter,
+    TokenEstimate,
+    TokenEstimator,
+)
 
 
 class TestTokenCounter:
@@ -54,6 +67,35 @@ class TestTokenCounter:
         assert count == 5
         mock_encoder.encode.assert_called_once_with(text)
 
+    def test_encoder_loaded_on_first_count(self, monkeypatch):
+        """Test the encoding is not loaded until tokens are counted."""
+        monkeypatch.setattr("codebase_skeleton.TIKTOKEN_AVAILABLE", True)
+        mock_tiktoken = MagicMock()
+        mock_tiktoken.get_encoding.return_value.encode.return_value = [1, 2]
+        monkeypatch.setattr(
+            "codebase_skeleton.tiktoken", mock_tiktoken, raising=False
+        )
+
+        counter = TokenCounter()
+        mock_tiktoken.get_encoding.assert_not_called()
+        assert counter.count("ab") == 2
+        assert counter.count("cd") == 2
+        mock_tiktoken.get_encoding.assert_called_once_with("cl100k_base")
+
+    def test_encoder_load_failure_falls_back(self, monkeypatch):
+        """Test a failing encoding load degrades to approximate counts."""
+        monkeypatch.setattr("codebase_skeleton.TIKTOKEN_AVAILABLE", True)
+        mock_tiktoken = MagicMock()
+        mock_tiktoken.get_encoding.side_effect = OSError("offline")
+        monkeypatch.setattr(
+            "codebase_skeleton.tiktoken", mock_tiktoken, raising=False
+        )
+
+        counter = TokenCounter()
+        assert counter.count("12345678") == 2
+        assert counter.name == "approx"
+        assert "failed to load: offline" in counter.describe()
+
     def test_count_with_fallback(self, mock_tiktoken_unavailable):
         """Test approximate token counting (4 chars per token)."""
         counter = TokenCounter()
@@ -87,3 +129,312 @@ class TestTokenCounter:
         counter = TokenCounter()
         code = "def func(): # comment"
         assert counter.count(code) == len(code) // 4
+
+
+class TestTokenizerLoading:
+    """Test offline tokenizer sources and the load time limit."""
+
+    @pytest.fixture
+    def mock_tiktoken(self, monkeypatch):
+        monkeypatch.setattr("codebase_skeleton.TIKTOKEN_AVAILABLE", True)
+        mock = MagicMock()
+        mock.get_encoding.return_value.encode.return_value = [1, 2, 3]
+        mock.Encoding.return_value.encode.return_value = [1, 2, 3]
+        monkeypatch.setattr("codebase_skeleton.tiktoken", mock, raising=False)
+        return mock
+
+    def test_slow_load_falls_back_within_timeout(self, mock_tiktoken):
+        """Test a load that outlives the timeout yields approximate counts."""
+        release = threading.Event()
+        mock_tiktoken.get_encoding.side_effect = lambda name: release.wait(5)
+        try:
+            counter = TokenCounter(timeout=0.05)
+            assert counter.count("12345678") == 2
+            assert counter.describe() == (
+                "approximate, chars/token by file type "
+                "(cl100k_base did not load within 0.05s)"
+            )
+        finally:
+            release.set()
+
+    def test_tokenizer_file_loads_without_get_encoding(
+        self, mock_tiktoken, monkeypatch, tmp_path
+    ):
+        """Test a local BPE file is read directly instead of via the registry."""
+        bpe = tmp_path / "cl100k_base.tiktoken"
+        bpe.write_text("IQ== 0\n")
+        load_bpe = MagicMock(return_value={b"!": 0})
+        monkeypatch.setitem(
+            sys.modules, "tiktoken.load", SimpleNamespace(load_tiktoken_bpe=load_bpe)
+        )
+
+        counter = TokenCounter(tokenizer_file=str(bpe))
+        assert counter.count("abc") == 3
+        load_bpe.assert_called_once_with(str(bpe))
+        mock_tiktoken.get_encoding.assert_not_called()
+        kwargs = mock_tiktoken.Encoding.call_args.kwargs
+        assert kwargs["name"] == "cl100k_base"
+        assert kwargs["mergeable_ranks"] == {b"!": 0}
+
+    @pytest.fixture
+    def ranks(self, monkeypatch):
+        """A stand-in BPE file and a tiktoken.load that records its calls."""
+        data = b"IQ== 0\n"
+        monkeypatch.setattr(
+            TokenCounter, "CL100K_SHA256", hashlib.sha256(data).hexdigest()
+        )
+        load = SimpleNamespace(
+            load_tiktoken_bpe=MagicMock(return_value={b"!": 0}),
+            read_file=MagicMock(return_value=data),
+        )
+        monkeypatch.setitem(sys.modules, "tiktoken.load", load)
+        name = hashlib.sha1(TokenCounter.CL100K_URL.encode()).hexdigest()
+        return SimpleNamespace(data=data, name=name, load=load)
+
+    def test_cache_dir_downloads_once(self, mock_tiktoken, ranks, tmp_path):
+        """Test --tokenizer-cache is filled on a miss and read directly after."""
+        vendor = tmp_path / "vendor"
+        TokenCounter(cache_dir=str(vendor)).encoder
+        assert (vendor / ranks.name).read_bytes() == ranks.data
+        assert ranks.load.read_file.call_count == 1
+
+        TokenCounter(cache_dir=str(vendor)).encoder
+        assert ranks.load.read_file.call_count == 1
+        ranks.load.load_tiktoken_bpe.assert_called_with(str(vendor / ranks.name))
+        mock_tiktoken.get_encoding.assert_not_called()
+        assert "TIKTOKEN_CACHE_DIR" not in os.environ
+
+    def test_default_leaves_tiktoken_cache_alone(self, mock_tiktoken, ranks):
+        """Test without --tokenizer-cache tiktoken resolves its own cache."""
+        TokenCounter().encoder
+        mock_tiktoken.get_encoding.assert_called_once_with("cl100k_base")
+        ranks.load.read_file.assert_not_called()
+        assert "TIKTOKEN_CACHE_DIR" not in os.environ
+        assert not (SkeletonCache.default_dir() / "tiktoken").exists()
+
+    def test_fallback_reported_in_stats_and_not_cached(
+        self, mock_tiktoken, mock_codebase, tmp_path
+    ):
+        """Test <stats> names the fallback and its counts are not cached."""
+        mock_tiktoken.get_encoding.side_effect = OSError("no network")
+        config = Config(cache_dir=str(tmp_path / "cache"))
+        output = SkeletonGenerator(mock_codebase, config).generate()
+
+        assert "Tokenizer: approximate, chars/token by file type" in output
+        assert "no network" in output
+        version = f"v{SkeletonCache.FORMAT}"
+        objects = list((tmp_path / "cache" / version / "objects").rglob("*"))
+        records = [json.loads(p.read_text()) for p in objects if p.is_file()]
+        assert records
+        assert all(record["tokens"] is None for record in records)
+
+
+class TestBatchCounting:
+    """Test counting many texts in one call."""
+
+    @pytest.fixture
+    def counter(self, monkeypatch):
+        monkeypatch.setattr("codebase_skeleton.TIKTOKEN_AVAILABLE", True)
+        encoder = MagicMock()
+        encoder.encode.side_effect = encoder.encode_ordinary.side_effect = (
+            lambda text: text.split()
+        )
+        mock_tiktoken = MagicMock()
+        mock_tiktoken.get_encoding.return_value = encoder
+        monkeypatch.setattr(
+            "codebase_skeleton.tiktoken", mock_tiktoken, raising=False
+        )
+        return TokenCounter()
+
+    def test_counts_in_order_and_encodes_duplicates_once(self, counter):
+        """Test results follow the input order and repeats are not re-encoded."""
+        texts = ["a b", "c", "a b", "", "d e f"]
+        assert counter.count_many(texts) == [2, 1, 2, 0, 3]
+        assert counter.encoder.encode_ordinary.call_count == 4
+
+    @pytest.mark.parametrize("threads", [1, 2, 8])
+    def test_parallel_matches_serial(self, counter, monkeypatch, threads):
+        """Test a batch split across threads gives the per-text counts."""
+        monkeypatch.setattr(TokenCounter, "PARALLEL_MIN_CHARS", 0)
+        texts = [" ".join(["w"] * n) for n in range(50)]
+        assert counter.count_many(texts, threads) == [counter.count(t) for t in texts]
+
+    def test_approximate_batch(self, mock_tiktoken_unavailable):
+        """Test the approximate counter handles batches."""
+        assert TokenCounter().count_many(["12345678", "123"]) == [2, 0]
+
+    def test_generator_counts_in_one_batch(self, counter, mock_codebase):
+        """Test the output stage counts every shown file in a single batch."""
+        config = Config(mode="hybrid", max_tokens=0)  # No budget overhead counts
+        generator = SkeletonGenerator(mock_codebase, config)
+        generator.token_counter = counter
+        with patch.object(
+            TokenCounter, "count", side_effect=AssertionError("per-file count")
+        ), patch.object(
+            TokenCounter,
+            "count_many",
+            autospec=True,
+            side_effect=TokenCounter.count_many,
+        ) as count_many:
+            generator.generate()
+        assert count_many.call_count == 1
+        texts = count_many.call_args.args[1]
+        assert len(texts) == generator.stats["files_processed"]
+
+
+class TestTokenEstimator:
+    """Test chars-per-token estimates and their calibration."""
+
+    @pytest.mark.parametrize(
+        "suffix, text, kind",
+        [
+            (".PY", "x = 1\n", ".py"),
+            (".tsx", "let a = 1;\n", ".js"),
+            (".js", "var a=1;" * 100, ".min.js"),
+            (".js", "var a = 1;\n" * 100, ".js"),
+            (".unknown", "", ".unknown"),
+        ],
+    )
+    def test_kind(self, suffix, text, kind):
+        """Test aliases share a kind and minified JavaScript is split out."""
+        assert TokenEstimator.kind(suffix, text) == kind
+
+    def test_estimate_uses_kind_ratio_and_margin(self):
+        """Test estimates divide by the kind's ratio and carry two spreads."""
+        estimator = TokenEstimator({"": (4.0, 0.25), ".py": (2.0, 0.1)})
+        estimate = estimator.estimate("x" * 100, ".py")
+        assert (estimate.tokens, estimate.margin) == (50, 10)
+        assert (estimate.low, estimate.high) == (40, 60)
+        assert estimator.estimate("x" * 100, ".rb").tokens == 25
+
+    def test_unknown_type_matches_four_chars_per_token(self):
+        """Test text of unknown type keeps the 4 chars/token approximation."""
+        estimator = TokenEstimator()
+        for text in ["", "abc", "12345678", "x" * 1001]:
+            assert estimator.estimate(text).tokens == len(text) // 4
+
+    def test_estimates_add_with_margins(self):
+        """Test summed estimates add tokens and margins."""
+        total = TokenEstimate(100, 10) + TokenEstimate(50, 5)
+        assert (total.tokens, total.margin) == (150, 15)
+
+    def test_calibrate_fits_ratio_and_spread(self):
+        """Test calibration learns a kind's ratio from exact counts."""
+        estimator = TokenEstimator()
+        samples = [(".py", "x" * n, n // 5) for n in (500, 1000, 2000)]
+        estimator.calibrate(samples)
+        ratio, spread = estimator.ratios[".py"]
+        assert ratio == pytest.approx(5.0)
+        assert spread == TokenEstimator.MIN_SPREAD  # Perfectly consistent
+        assert estimator.calibrated == {".py": 3}
+
+    def test_calibrate_needs_enough_files(self):
+        """Test a kind with too few samples keeps its built-in ratio."""
+        estimator = TokenEstimator()
+        estimator.calibrate([(".md", "x" * 1000, 100), (".md", "y" * 1000, 100)])
+        assert estimator.ratios[".md"] == TokenEstimator.RATIOS[".md"]
+        assert not estimator.calibrated
+
+    def test_sample_spreads_over_each_kind(self, monkeypatch):
+        """Test the calibration sample is bounded per kind."""
+        monkeypatch.setattr(TokenEstimator, "SAMPLE_FILES", 2)
+        texts = ["a"] * 6 + ["b"] * 3
+        suffixes = [".py"] * 6 + [".md"] * 3
+        assert TokenEstimator.sample(texts, suffixes) == [0, 3, 6, 7]
+
+
+class TestEstimateMode:
+    """Test --token-count=estimate in the generator."""
+
+    @pytest.fixture
+    def encoder(self, monkeypatch):
+        """An encoder with exactly 5 characters per token."""
+        monkeypatch.setattr("codebase_skeleton.TIKTOKEN_AVAILABLE", True)
+        encoder = MagicMock()
+        encoder.encode.side_effect = encoder.encode_ordinary.side_effect = (
+            lambda text: [0] * (len(text) // 5)
+        )
+        mock_tiktoken = MagicMock()
+        mock_tiktoken.get_encoding.return_value = encoder
+        monkeypatch.setattr(
+            "codebase_skeleton.tiktoken", mock_tiktoken, raising=False
+        )
+        return encoder
+
+    @pytest.fixture
+    def repo(self, temp_dir):
+        (temp_dir / "pkg").mkdir()
+        for i in range(12):
+            (temp_dir / "pkg" / f"m{i}.py").write_text(f"def f{i}():\n    pass\n" * i)
+        return temp_dir
+
+    FILE_TAG = re.compile(
+        r"<file path='([^']+)' loc='\d+' tokens='(\d+)'(?: detail='[^']+')?>"
+        r"\n(.*?)\n</file>",
+        re.S,
+    )
+
+    def test_calibrates_on_sample_and_counts_emitted_exactly(
+        self, encoder, repo, tmp_path
+    ):
+        """Test ratios are fitted on a sample and emitted files counted exactly."""
+        config = Config(token_count="estimate", cache_dir=str(tmp_path / "cache"))
+        generator = SkeletonGenerator(repo, config)
+        output = generator.generate()
+
+        assert generator.token_counter.estimator.ratios[".py"][0] == pytest.approx(
+            5.0, rel=0.1
+        )
+        assert "budget estimated from chars/token calibrated on" in output
+        assert "Token estimate margin" not in output
+        files = self.FILE_TAG.findall(output)
+        assert len(files) == 12
+        assert all(int(tokens) == len(text) // 5 for _, tokens, text in files)
+        version = f"v{SkeletonCache.FORMAT}"
+        objects = list((tmp_path / "cache" / version / "objects").rglob("*"))
+        tokens = [json.loads(p.read_text())["tokens"] for p in objects if p.is_file()]
+        assert None not in tokens
+
+    def test_budget_settled_on_estimates(self, encoder, repo):
+        """Test demotion uses estimates; only the final texts are encoded."""
+        config = Config(token_count="estimate", max_tokens=500)
+        generator = SkeletonGenerator(repo, config)
+        output = generator.generate()
+
+        assert generator.stats["demoted"] or generator.stats["omitted"]
+        files = self.FILE_TAG.findall(output)
+        assert files
+        assert all(int(tokens) == len(text) // 5 for _, tokens, text in files)
+        total = int(re.search(r"<total-tokens>(\d+)<", output).group(1))
+        assert total == sum(int(tokens) for _, tokens, _ in files)
+        # Sampled files, then the emitted ones not in the sample
+        assert encoder.encode_ordinary.call_count <= TokenEstimator.SAMPLE_FILES + 12
+
+    def test_exact_mode_reports_no_margin(self, encoder, repo):
+        """Test exact counting encodes every file and reports no margin."""
+        output = SkeletonGenerator(repo, Config()).generate()
+        assert "Token estimate margin" not in output
+        assert encoder.encode_ordinary.call_count == 12
+
+    def test_margin_covers_only_written_files(self, mock_tiktoken_unavailable, repo):
+        """Test the margin covers written files, at the level they are written."""
+        everything = SkeletonGenerator(repo, Config(max_tokens=0))
+        everything.generate()
+        generator = SkeletonGenerator(repo, Config(max_tokens=450))
+        output = generator.generate()
+
+        written = self.FILE_TAG.findall(output)
+        assert generator.stats["omitted"] and generator.stats["demoted"]
+        estimator = generator.token_counter.estimator
+        margin = generator.stats["token_margin"]
+        assert margin == sum(
+            estimator.estimate(text, ".py").margin for _, _, text in written
+        )
+        assert margin < everything.stats["token_margin"]
+        assert f"Token estimate margin: ±{margin} (95%)" in output
+
+    def test_fallback_estimates_by_file_type(self, mock_tiktoken_unavailable, repo):
+        """Test without tiktoken counts come from the per-type table."""
+        output = SkeletonGenerator(repo, Config()).generate()
+        assert "Tokenizer: approximate, chars/token by file type" in output
+        assert "Token estimate margin: ±" in output
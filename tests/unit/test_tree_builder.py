@@ -5,62 +5,41 @@ COMPLETE FILE - Replace your entire tests/unit/test_tree_builder.py with this
 """
 import sys
 from pathlib import Path
+from typing import Optional
 import pytest
-from unittest.mock import patch
 
 # Add project root to sys.path
 project_root = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(project_root))
 
-from codebase_skeleton import TreeBuilder, Config
+from codebase_skeleton import (
+    Config,
+    PathPolicy,
+    RepoSnapshot,
+    SkeletonGenerator,
+    TreeBuilder,
+    _format_tokens,
+)
+
+
+def snapshot(root: Path, config: Optional[Config] = None) -> RepoSnapshot:
+    return RepoSnapshot.scan(root, PathPolicy(config or Config()))
 
 
 class TestTreeBuilder:
-    """Test TreeBuilder for directory tree generation."""
-
-    @patch("codebase_skeleton.DisplayTree")
-    def test_build_with_directory_tree_available(
-        self,
-        mock_display_tree,
-        mock_codebase,
-        default_config,
-        mock_directory_tree_available,
-    ):
-        """Test tree building using directory_tree library."""
-        mock_display_tree.return_value = "mocked tree"
-        tree_str = TreeBuilder.build(mock_codebase, default_config)
-        assert tree_str == "mocked tree"
-        mock_display_tree.assert_called_once()
-
-    @patch("codebase_skeleton.DisplayTree", side_effect=Exception("mock error"))
-    def test_build_with_directory_tree_exception(
-        self,
-        mock_display_tree,
-        mock_codebase,
-        default_config,
-        mock_directory_tree_available,
-    ):
-        """Test fallback when directory_tree raises exception."""
-        tree_str = TreeBuilder.build(mock_codebase, default_config)
-        assert "src/" in tree_str
-        assert "README.md" in tree_str
-        assert "node_modules" not in tree_str  # Should be ignored by fallback
-
-    def test_build_with_fallback(
-        self, mock_codebase, default_config, mock_directory_tree_unavailable
-    ):
-        """Test tree building with fallback ASCII tree."""
-        tree_str = TreeBuilder.build(mock_codebase, default_config)
+    """Test TreeBuilder rendering of repository snapshots."""
+
+    def test_render_lists_visible_entries(self, mock_codebase, default_config):
+        """Test the ASCII tree lists the snapshot's visible entries."""
+        tree_str = TreeBuilder.render(snapshot(mock_codebase, default_config))
         assert mock_codebase.name in tree_str
         assert "src/" in tree_str
         assert "main.py" in tree_str
         assert "node_modules" not in tree_str
 
-    def test_fallback_tree_basic_structure(
-        self, mock_codebase, default_config, mock_directory_tree_unavailable
-    ):
-        """Test fallback tree generates correct structure."""
-        tree_str = TreeBuilder.build(mock_codebase, default_config)
+    def test_render_basic_structure(self, mock_codebase, default_config):
+        """Test the tree generates correct structure."""
+        tree_str = TreeBuilder.render(snapshot(mock_codebase, default_config))
         lines = tree_str.strip().split("\n")
         assert f"{mock_codebase.name}/" in lines[0]
         assert any("├── .gitignore" in line for line in lines)
@@ -71,12 +50,10 @@ class TestTreeBuilder:
             "main.py" in line and ("├──" in line or "└──" in line) for line in lines
         )
 
-    def test_fallback_tree_respects_exclusions(
-        self, mock_codebase, mock_directory_tree_unavailable
-    ):
-        """Test fallback tree excludes configured patterns."""
+    def test_render_respects_exclusions(self, mock_codebase):
+        """Test the tree excludes configured patterns."""
         custom_config = Config(exclude={"src"})
-        tree_str = TreeBuilder.build(mock_codebase, custom_config)
+        tree_str = TreeBuilder.render(snapshot(mock_codebase, custom_config))
         
         # When we exclude "src", the src/ directory should not appear
         assert "src/" not in tree_str
@@ -89,27 +66,23 @@ class TestTreeBuilder:
         assert "tests/" in tree_str, "tests/ directory should still be present"
         assert "test_main.py" in tree_str, "test files should still be present"
 
-    def test_fallback_tree_depth_limit(
-        self, temp_dir, default_config, mock_directory_tree_unavailable
-    ):
-        """Test fallback tree respects max depth of 5."""
+    def test_render_depth_limit(self, temp_dir, default_config):
+        """Test the tree respects max depth of 5."""
         p = temp_dir
         for i in range(7):
             p = p / f"level_{i}"
             p.mkdir()
         (p / "file.txt").touch()
 
-        tree_str = TreeBuilder.build(temp_dir, default_config)
+        tree_str = TreeBuilder.render(snapshot(temp_dir, default_config))
         assert "level_5" not in tree_str
         assert "level_4" in tree_str
 
-    def test_fallback_tree_permission_error(
-        self, mock_codebase, default_config, mock_directory_tree_unavailable
-    ):
-        """Test fallback tree handles permission errors gracefully."""
+    def test_render_permission_error(self, mock_codebase, default_config):
+        """Test the tree handles permission errors gracefully."""
         (mock_codebase / "no_access").mkdir(mode=0o000)
         try:
-            tree_str = TreeBuilder.build(mock_codebase, default_config)
+            tree_str = TreeBuilder.render(snapshot(mock_codebase, default_config))
             assert "no_access" in tree_str  # The directory itself is listed
         finally:
             # Best effort to clean up, may fail on some systems
@@ -119,40 +92,119 @@ class TestTreeBuilder:
             except OSError:
                 pass
 
-    def test_fallback_tree_empty_directory(
-        self, temp_dir, default_config, mock_directory_tree_unavailable
-    ):
-        """Test fallback tree with empty directory."""
-        tree_str = TreeBuilder.build(temp_dir, default_config)
+    def test_render_empty_directory(self, temp_dir, default_config):
+        """Test the tree with empty directory."""
+        tree_str = TreeBuilder.render(snapshot(temp_dir, default_config))
         assert tree_str.strip() == f"{temp_dir.name}/"
 
-    def test_fallback_tree_single_file(
-        self, temp_dir, default_config, mock_directory_tree_unavailable
-    ):
-        """Test fallback tree with single file."""
+    def test_render_single_file(self, temp_dir, default_config):
+        """Test the tree with single file."""
         (temp_dir / "file.txt").touch()
-        tree_str = TreeBuilder.build(temp_dir, default_config)
+        tree_str = TreeBuilder.render(snapshot(temp_dir, default_config))
         assert "file.txt" in tree_str
 
-    def test_should_ignore_node_modules(
-        self, mock_codebase, default_config, mock_directory_tree_unavailable
-    ):
+    def test_should_ignore_node_modules(self, mock_codebase, default_config):
         """Test that node_modules is ignored in tree."""
-        tree_str = TreeBuilder.build(mock_codebase, default_config)
+        tree_str = TreeBuilder.render(snapshot(mock_codebase, default_config))
         assert "node_modules" not in tree_str
 
-    def test_should_ignore_venv(
-        self, temp_dir, default_config, mock_directory_tree_unavailable
-    ):
+    def test_should_ignore_venv(self, temp_dir, default_config):
         """Test that venv is ignored in tree."""
         (temp_dir / "venv").mkdir()
-        tree_str = TreeBuilder.build(temp_dir, default_config)
+        tree_str = TreeBuilder.render(snapshot(temp_dir, default_config))
         assert "venv" not in tree_str
 
-    def test_should_ignore_git(
-        self, temp_dir, default_config, mock_directory_tree_unavailable
-    ):
+    def test_should_ignore_git(self, temp_dir, default_config):
         """Test that .git is ignored in tree."""
         (temp_dir / ".git").mkdir()
-        tree_str = TreeBuilder.build(temp_dir, default_config)
+        tree_str = TreeBuilder.render(snapshot(temp_dir, default_config))
         assert ".git" not in tree_str
+
+
+class TestCollapsedTree:
+    """Test width, depth and line limits and directory annotations."""
+
+    def test_wide_directory_collapses_to_summary(self, temp_dir):
+        """Test entries past the width are summed up in one line."""
+        for i in range(12):
+            (temp_dir / f"f{i:02}.txt").write_text("x" * 10)
+        lines = TreeBuilder.render(snapshot(temp_dir), max_width=5).splitlines()
+        assert lines[1:] == [
+            "├── f00.txt",
+            "├── f01.txt",
+            "├── f02.txt",
+            "├── f03.txt",
+            "├── f04.txt",
+            "└── … 7 more files (70 B)",
+        ]
+
+    def test_summary_counts_hidden_directories(self, temp_dir):
+        """Test hidden directories count every file below them."""
+        for name in ("a", "b", "c"):
+            (temp_dir / name / "deep").mkdir(parents=True)
+            (temp_dir / name / "deep" / "m.py").write_text("x" * 37)
+        tree = TreeBuilder.render(
+            snapshot(temp_dir), max_width=1, estimate=lambda entry: 10
+        )
+        assert tree.splitlines()[-1] == (
+            "└── … 2 more directories (2 files, 74 B, ~20 tokens)"
+        )
+
+    def test_directories_annotated_with_totals(self, temp_dir):
+        """Test each directory shows the files and tokens of its subtree."""
+        (temp_dir / "src" / "pkg").mkdir(parents=True)
+        (temp_dir / "src" / "pkg" / "a.py").touch()
+        (temp_dir / "src" / "b.py").touch()
+        (temp_dir / "setup.py").touch()
+        lines = TreeBuilder.render(
+            snapshot(temp_dir), estimate=lambda entry: 500
+        ).splitlines()
+        assert lines[0] == f"{temp_dir.name}/ (3 files, ~1.5k tokens)"
+        assert "├── src/ (2 files, ~1.0k tokens)" in lines
+        assert "│   ├── pkg/ (1 file, ~500 tokens)" in lines
+
+    def test_line_budget_opens_largest_directories_first(self, temp_dir):
+        """Test directories that do not fit the line budget stay closed."""
+        for name, files in (("small", 2), ("large", 6)):
+            (temp_dir / name).mkdir()
+            for i in range(files):
+                (temp_dir / name / f"{name}{i}.txt").write_text("data")
+        tree = TreeBuilder.render(snapshot(temp_dir), max_lines=9)
+        assert len(tree.splitlines()) == 9
+        assert "large5.txt" in tree
+        assert "small0.txt" not in tree
+
+    def test_depth_zero_means_no_limit(self, temp_dir):
+        """Test max_depth=0 lists every level."""
+        p = temp_dir
+        for i in range(7):
+            p = p / f"level_{i}"
+            p.mkdir()
+        (p / "file.txt").touch()
+        tree = TreeBuilder.render(snapshot(temp_dir), max_depth=0)
+        assert "level_6/" in tree
+        assert "file.txt" in tree
+
+    @pytest.mark.parametrize(
+        "tokens, text",
+        [(850, "850"), (1_234, "1.2k"), (180_400, "180k"), (2_345_678, "2.3M")],
+    )
+    def test_format_tokens(self, tokens, text):
+        """Test token counts are rounded for people."""
+        assert _format_tokens(tokens) == text
+
+    def test_generated_tree_is_annotated_and_bounded(self, temp_dir):
+        """Test <tree> in generated output uses the configured limits."""
+        (temp_dir / "pkg").mkdir()
+        for i in range(30):
+            (temp_dir / "pkg" / f"mod{i:02}.py").write_text(f"X = {i}\n")
+        config = Config(tree_width=10)
+        output = SkeletonGenerator(temp_dir, config).generate()
+        tree = output.split("<tree>")[1].split("</tree>")[0]
+
+        assert "└── pkg/ (30 files, ~" in tree
+        assert "mod09.py" in tree
+        assert "mod10.py" not in tree
+        assert "└── … 20 more files (" in tree
+        # Every file is still shown; only the tree is collapsed
+        assert output.count("<file path=") == 30
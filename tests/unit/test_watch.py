@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Test module: test_watch
+"""
+import io
+import os
+import sys
+import time
+from pathlib import Path
+import pytest
+from unittest.mock import patch
+
+# Add project root to sys.path
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from codebase_skeleton import (
+    CodeExtractor,
+    Config,
+    FileProcessor,
+    InotifyWatcher,
+    PollingWatcher,
+    SkeletonGenerator,
+    WatchSession,
+    main,
+    write_atomic,
+)
+
+
+def touch(path: Path, text: str):
+    """Write text and bump the mtime so stat-based change checks see it."""
+    path.write_text(text)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+class TestIncrementalExtraction:
+    """Test reparsing from a previous tree."""
+
+    @pytest.mark.parametrize(
+        "edit",
+        [
+            lambda s: s.replace("greet(self)", "greet(self, loud: bool)"),
+            lambda s: "import sys\n" + s,
+            lambda s: s + "\ndef extra():\n    pass\n",
+            lambda s: s.replace("class Greeter:", "class Greeter(Base):"),
+            lambda s: "",
+        ],
+    )
+    def test_matches_fresh_extraction(self, mock_codebase, edit):
+        """Test incremental output equals a from-scratch parse after an edit."""
+        extractor = CodeExtractor()
+        if "python" not in extractor.parsers:
+            pytest.skip("tree-sitter python parser not available")
+        path = mock_codebase / "src" / "main.py"
+        before = path.read_bytes()
+        after = edit(before.decode()).encode()
+
+        _, previous = extractor.extract_incremental(path, before, None)
+        assert previous is not None
+        outline, _ = extractor.extract_incremental(path, after, previous)
+        assert outline == CodeExtractor().extract_outline(path, after)
+
+
+class TestIncrementalGenerate:
+    """Test generate() reuse between runs."""
+
+    def test_only_changed_files_are_reprocessed(self, mock_codebase):
+        """Test a second run reprocesses just the edited file."""
+        generator = SkeletonGenerator(mock_codebase, Config())
+        generator.enable_incremental()
+        generator.generate()
+
+        touch(mock_codebase / "src" / "utils.js", "export function renamed() {}\n")
+        with patch.object(
+            FileProcessor, "process", autospec=True, side_effect=FileProcessor.process
+        ) as process:
+            output = generator.generate()
+
+        assert [call.args[1].name for call in process.call_args_list] == ["utils.js"]
+        assert "renamed" in output
+        assert output == SkeletonGenerator(mock_codebase, Config()).generate()
+
+    def test_invalidate_forces_reprocessing(self, mock_codebase):
+        """Test invalidated files are reprocessed even with unchanged stat."""
+        generator = SkeletonGenerator(mock_codebase, Config())
+        generator.enable_incremental()
+        generator.generate()
+
+        generator.invalidate([mock_codebase / "src" / "main.py"])
+        with patch.object(
+            FileProcessor, "process", autospec=True, side_effect=FileProcessor.process
+        ) as process:
+            generator.generate()
+        assert [call.args[1].name for call in process.call_args_list] == ["main.py"]
+
+
+class TestWatchSession:
+    """Test the watch loop's refresh and output handling."""
+
+    class FakeWatcher:
+        def __init__(self, events=()):
+            self.events = list(events)
+            self.watched = set()
+
+        def watch(self, root, rel_dirs):
+            self.watched.update(rel_dirs)
+
+        def wait(self, timeout=None):
+            if not self.events:
+                raise KeyboardInterrupt
+            return self.events.pop(0)
+
+        def close(self):
+            pass
+
+    def test_refresh_rewrites_only_on_change(self, mock_codebase, tmp_path):
+        """Test the output is rewritten when a file changes and not otherwise."""
+        output = tmp_path / "skeleton.txt"
+        watcher = self.FakeWatcher()
+        generator = SkeletonGenerator(mock_codebase, Config())
+        session = WatchSession(generator, output, 0, watcher)
+
+        assert session.refresh()
+        assert "<file path='src/main.py'" in output.read_text()
+        assert {"", "src"} <= watcher.watched
+        assert not session.refresh()
+
+        touch(mock_codebase / "src" / "main.py", "def changed(): pass\n")
+        assert session.refresh()
+        assert "def changed()" in output.read_text()
+        assert list(tmp_path.iterdir()) == [output]
+
+    def test_refresh_keeps_files_from_stdin(self, mock_codebase, tmp_path):
+        """Test rebuilds reuse a --files-from=- list; stdin is only read once."""
+        output = tmp_path / "skeleton.txt"
+        stdin = io.TextIOWrapper(io.BytesIO(b"src/main.py\nREADME.md\n"))
+        with patch("sys.stdin", stdin):
+            generator = SkeletonGenerator(mock_codebase, Config(files_from="-"))
+            session = WatchSession(generator, output, 0, self.FakeWatcher())
+            assert session.refresh()
+
+            touch(mock_codebase / "src" / "main.py", "def changed(): pass\n")
+            assert session.refresh()
+        text = output.read_text()
+        assert "def changed()" in text
+        assert text.count("<file path=") == 2
+
+    def test_run_debounces_and_ignores_own_output(self, mock_codebase):
+        """Test a burst of events yields one rebuild; output events are ignored."""
+        output = mock_codebase / "skeleton.txt"
+        watcher = self.FakeWatcher(
+            [
+                {"src/main.py"},
+                {"src/utils.js"},
+                set(),  # Quiet window closes the burst
+                {"skeleton.txt", ".skeleton.txt.abc.tmp"},
+            ]
+        )
+        generator = SkeletonGenerator(mock_codebase, Config(exclude={"/skeleton.txt"}))
+        session = WatchSession(generator, output, 0, watcher)
+        updates = []
+        with patch.object(
+            WatchSession, "refresh", autospec=True, side_effect=WatchSession.refresh
+        ) as refresh:
+            with pytest.raises(KeyboardInterrupt):
+                session.run(updates.append)
+
+        changed = [call.args[1] for call in refresh.call_args_list]
+        assert changed == [None, {"src/main.py", "src/utils.js"}]
+        assert len(updates) == 1  # Second refresh produced identical output
+        assert "skeleton.txt'" not in output.read_text()
+
+    def test_write_atomic_replaces_file(self, tmp_path):
+        """Test write_atomic leaves exactly the new content and no temp files."""
+        target = tmp_path / "out.txt"
+        target.write_text("old")
+        write_atomic(target, "new")
+        assert target.read_text() == "new"
+        assert list(tmp_path.iterdir()) == [target]
+
+
+class TestWatchers:
+    """Test the change sources."""
+
+    def test_polling_watcher_requests_rescan(self):
+        """Test the polling watcher always asks for a rescan."""
+        assert PollingWatcher(interval=0.01).wait() is None
+
+    def test_inotify_reports_changed_paths(self, tmp_path):
+        """Test inotify reports created and modified files relative to root."""
+        watcher = InotifyWatcher.create()
+        if watcher is None:
+            pytest.skip("inotify not available")
+        try:
+            (tmp_path / "sub").mkdir()
+            watcher.watch(tmp_path, ["", "sub"])
+            assert watcher.wait(0) == set()
+
+            (tmp_path / "sub" / "a.py").write_text("x = 1\n")
+            (tmp_path / "b.py").write_text("y = 2\n")
+            changed = set()
+            deadline = time.monotonic() + 5
+            while {"sub/a.py", "b.py"} - changed and time.monotonic() < deadline:
+                changed |= watcher.wait(0.5) or set()
+            assert {"sub/a.py", "b.py"} <= changed
+        finally:
+            watcher.close()
+
+
+class TestWatchCLI:
+    """Test --watch argument handling."""
+
+    def test_watch_requires_output(self, mock_codebase, capsys):
+        """Test --watch without --output is rejected."""
+        with patch("sys.argv", ["codebase_skeleton.py", str(mock_codebase), "--watch"]):
+            with pytest.raises(SystemExit) as e:
+                main()
+        assert e.value.code == 2
+        assert "--watch requires --output" in capsys.readouterr().err